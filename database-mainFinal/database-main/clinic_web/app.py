@@ -1,7 +1,60 @@
-from flask import Flask, render_template, request, redirect
+import datetime
+import os
+import threading
+import time
+
+from flask import Flask, Response, render_template, request, redirect, jsonify
+import audit
+import audit_log
+import db
+import exporter
+import httpcache
+import importer
+from cache import TTLCache
+from ids import next_id
+import name_index
+import occupancy
+import refdata
+import revenue_rollup
+from schedule import schedule
+import slots
+import sqlstats
+import work_queue
 from db import get_connection
+from pagination import page_size
+from repository import get_repository
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder="Static")
+db.init_app(app)
+sqlstats.init_app(app)
+httpcache.init_app(app)
+
+# ------- PAGE VERSIONS (ETags, see httpcache.py) --------
+
+def bill_details_version(bill_id):
+    repo = get_repository()
+    rows = repo.bill_version(bill_id)
+    if rows is None:
+        return None
+    return tuple(rows) + (refdata.cache.versions(repo).get("doctor"),)
+
+
+def medications_version():
+    return (refdata.cache.versions(get_repository()).get("medication"),)
+
+
+def rooms_version():
+    # The page shows which rooms are busy now, so it also changes by the minute.
+    repo = get_repository()
+    return (repo.room_version(), refdata.cache.versions(repo).get("room"),
+            datetime.datetime.now().strftime("%Y-%m-%dT%H:%M"))
+
+
+def room_schedule_version(room_id):
+    repo = get_repository()
+    versions = refdata.cache.versions(repo)
+    return (repo.room_version(room_id), versions.get("room"), versions.get("doctor"),
+            schedule_week(request.args.get("week")))
 
 # ---------------- HOME PAGE ----------------
 
@@ -13,13 +66,11 @@ def home():
 
 @app.route("/patients")
 def patients():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT patient_id, full_name, email, phone FROM patient")
-    data = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template("patients.html", patients=data)
+    repo = get_repository()
+    page = repo.patients_page(after=request.args.get("after"), before=request.args.get("before"),
+                              limit=page_size(request.args.get("limit")))
+    repo.close()
+    return render_template("patients.html", patients=page.rows, page=page)
 
 # ------------ ADD PATIENT PAGE ---------------
 
@@ -30,23 +81,16 @@ def add_patient():
         email = request.form["email"]
         phone = request.form["phone"]
 
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Generate new ID
-        cursor.execute("SELECT MAX(patient_id) + 1 FROM patient")
-        new_id = cursor.fetchone()[0] or 1
+        repo = get_repository()
 
-        query = """
-        INSERT INTO patient (patient_id, full_name, email, phone)
-        VALUES (%s, %s, %s, %s)
-        """
+        new_id = next_id("patient")
 
-        cursor.execute(query, (new_id, full_name, email, phone))
-        conn.commit()
+        repo.add_patient(new_id, full_name, email, phone)
+        repo.commit()
+        invalidate_dashboard()
+        name_index.patients.added(new_id, full_name)
 
-        cursor.close()
-        conn.close()
+        repo.close()
 
         return redirect("/patients")
 
@@ -56,43 +100,19 @@ def add_patient():
 
 @app.route("/appointments")
 def appointments():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT a.appt_id, 
-               p.full_name AS patient_name,
-               d.full_name AS doctor_name,
-               a.starts_at,
-               a.ends_at,
-               a.status,
-               a.reason
-        FROM appointment a
-        JOIN patient p ON a.patient_id = p.patient_id
-        JOIN doctor d ON a.doctor_id = d.doctor_id
-        ORDER BY a.starts_at DESC
-    """)
-
-    data = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    repo = get_repository()
+    page = repo.appointments_page(after=request.args.get("after"), before=request.args.get("before"),
+                                  limit=page_size(request.args.get("limit")))
+    repo.close()
 
-    return render_template("appointments.html", appointments=data)
+    return render_template("appointments.html", appointments=page.rows, page=page)
 
 # ---------- ADD APPOINTMENT PAGE -------------
 @app.route("/add_appointment", methods=["GET", "POST"])
 def add_appointment():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Load the dropdown fields BEFORE the try/except
-    cursor.execute("SELECT patient_id, full_name FROM patient")
-    patients = cursor.fetchall()
-
-    cursor.execute("SELECT doctor_id, full_name FROM doctor")
-    doctors = cursor.fetchall()
-
+    # Patients and doctors are picked through the /api/patients and
+    # /api/doctors typeahead endpoints, so neither the form nor the POST
+    # path loads those tables.
     if request.method == "POST":
         patient_id = request.form["patient_id"]
         doctor_id = request.form["doctor_id"]
@@ -100,114 +120,125 @@ def add_appointment():
         ends_at = request.form["ends_at"]
         reason = request.form["reason"]
 
-        cursor.execute("SELECT COALESCE(MAX(appt_id), 100) + 1 FROM appointment")
-        new_id = cursor.fetchone()[0]
-
-        insert_query = """
-            INSERT INTO appointment (appt_id, patient_id, doctor_id, starts_at, ends_at, status, reason)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
+        try:
+            starts = datetime.datetime.fromisoformat(starts_at)
+            ends = datetime.datetime.fromisoformat(ends_at)
+        except ValueError:
+            starts = ends = None
+
+        error_message = None
+        if not patient_id.isdigit() or not doctor_id.isdigit():
+            error_message = "Please pick a patient and a doctor from the suggestions"
+        elif starts is None:
+            error_message = "Start time and end time are required"
+        elif ends <= starts:
+            error_message = "End time must be after the start time"
+        if error_message:
+            return render_template("add_appointment.html", form=request.form, error=error_message)
+
+        repo = get_repository()
+
+        # Taken before the doctor lock: reserving a new id block writes too.
+        new_id = next_id("appointment")
+
+        conflicts = schedule.doctor_conflicts(repo.conn, int(doctor_id), starts, ends, lock=True)
+        if conflicts:
+            repo.rollback()
+            repo.close()
+            error_message = "This doctor already has " + ", ".join(c.describe() for c in conflicts)
+            return render_template("add_appointment.html", form=request.form, error=error_message)
 
         try:
-            cursor.execute(insert_query, (
-                new_id, patient_id, doctor_id, starts_at, ends_at, "scheduled", reason
-            ))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            repo.add_appointment(new_id, patient_id, doctor_id, starts, ends, reason)
+            repo.commit()
+            invalidate_dashboard()
+            schedule.booked(new_id, int(doctor_id), starts, ends)
+            repo.close()
             return redirect("/appointments")
 
         except Exception as e:
-            # Clean & extract only the MySQL trigger message
+            # Clean & extract only the trigger message
             error_message = str(e).split(":")[-1].strip()
 
-            conn.rollback()
-            cursor.close()
-            conn.close()
+            repo.rollback()
+            repo.close()
 
-            return render_template(
-                "add_appointment.html",
-                patients=patients,
-                doctors=doctors,
-                error=error_message
-            )
+            return render_template("add_appointment.html", form=request.form, error=error_message)
 
     # Form GET load
-    cursor.close()
-    conn.close()
-    return render_template("add_appointment.html", patients=patients, doctors=doctors)
+    return render_template("add_appointment.html", form={})
+
+# ------------- TYPEAHEAD APIS ----------------
+
+TYPEAHEAD_LIMIT = 10
+
+
+def typeahead_limit():
+    try:
+        return max(1, min(int(request.args.get("limit", TYPEAHEAD_LIMIT)), 50))
+    except ValueError:
+        return TYPEAHEAD_LIMIT
+
+
+@app.route("/api/patients")
+def api_patients():
+    term = request.args.get("q", "").strip()
+    if not term:
+        return jsonify(results=[])
+
+    patient_ids = name_index.patients.search(term, typeahead_limit(), prefix=True)
+    rows = []
+    if patient_ids:
+        repo = get_repository()
+        rows = repo.patients_by_ids(patient_ids)
+        repo.close()
+
+    return jsonify(results=[{"id": r[0], "name": r[1], "phone": r[3]} for r in rows])
+
+
+@app.route("/api/doctors")
+def api_doctors():
+    term = request.args.get("q", "")
+    doctors = name_index.doctors.suggest(term, typeahead_limit())
+    return jsonify(results=[{"id": d[0], "name": d[1]} for d in doctors])
 
 # ------------- BILLING PAGE ----------------
 
 @app.route("/billing")
 def billing():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Get all bills with patient and doctor info
-    cursor.execute("""
-        SELECT b.bill_id, b.appt_id, p.full_name AS patient_name,
-               d.full_name AS doctor_name, a.starts_at, b.amount, 
-               b.payment_status, b.payment_method, b.billing_date
-        FROM billing b
-        JOIN appointment a ON a.appt_id = b.appt_id
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        ORDER BY b.billing_date DESC
-    """)
-    bills = cursor.fetchall()
-
-    # Get billing summary
-    cursor.execute("""
-        SELECT 
-            COALESCE(SUM(amount), 0) AS total,
-            COALESCE(SUM(CASE WHEN payment_status = 'paid' THEN amount ELSE 0 END), 0) AS paid,
-            COALESCE(SUM(CASE WHEN payment_status = 'unpaid' THEN amount ELSE 0 END), 0) AS unpaid
-        FROM billing
-    """)
-    summary = cursor.fetchone()
-    total_revenue = summary[0] if summary else 0
-    amount_paid = summary[1] if summary else 0
-    amount_unpaid = summary[2] if summary else 0
+    repo = get_repository()
+
+    # Get one page of bills with patient and doctor info
+    page = repo.bills_page(after=request.args.get("after"), before=request.args.get("before"),
+                           limit=page_size(request.args.get("limit")))
+
+    # Get billing summary (maintained by the billing triggers)
+    summary = repo.billing_totals()
 
     # Get accounts receivable (unpaid bills by patient)
-    cursor.execute("""
-        SELECT p.patient_id, p.full_name,
-               COUNT(b.bill_id) AS unpaid_count,
-               COALESCE(SUM(b.amount), 0) AS total_due
-        FROM patient p
-        LEFT JOIN appointment a ON a.patient_id = p.patient_id
-        LEFT JOIN billing b ON b.appt_id = a.appt_id AND b.payment_status = 'unpaid'
-        GROUP BY p.patient_id, p.full_name
-        HAVING total_due > 0
-        ORDER BY total_due DESC
-    """)
-    unpaid_bills = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    unpaid_bills = repo.receivables()
+
+    repo.close()
+
+    return render_template("billing.html", **billing_context(page, summary, unpaid_bills))
 
-    return render_template("billing.html", bills=bills, total_revenue=total_revenue, 
-                         amount_paid=amount_paid, amount_unpaid=amount_unpaid, 
-                         unpaid_bills=unpaid_bills)
+
+def billing_context(page, summary, unpaid_bills):
+    return dict(bills=page.rows, page=page,
+                total_revenue=summary[0] if summary else 0,
+                amount_paid=summary[1] if summary else 0,
+                amount_unpaid=summary[2] if summary else 0,
+                unpaid_bills=unpaid_bills)
 
 # ----------- ADD BILL PAGE ----------------
 
 @app.route("/add_bill", methods=["GET", "POST"])
 def add_bill():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Get all appointments without bills
-    cursor.execute("""
-        SELECT a.appt_id, p.full_name AS patient_name, d.full_name AS doctor_name, a.starts_at
-        FROM appointment a
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE a.appt_id NOT IN (SELECT appt_id FROM billing)
-        ORDER BY a.starts_at DESC
-    """)
-    appointments = cursor.fetchall()
+    repo = get_repository()
+
+    # Get one page of appointments without bills
+    page = repo.pending_page("bill", request.args)
+    appointments = page.rows
 
     if request.method == "POST":
         appt_id = request.form["appt_id"]
@@ -215,77 +246,50 @@ def add_bill():
         payment_method = request.form["payment_method"]
         payment_status = request.form["payment_status"]
 
-        # Generate new bill ID
-        cursor.execute("SELECT COALESCE(MAX(bill_id), 2000) + 1 FROM billing")
-        new_bill_id = cursor.fetchone()[0]
-
-        insert_query = """
-        INSERT INTO billing (bill_id, appt_id, amount, payment_status, payment_method, billing_date)
-        VALUES (%s, %s, %s, %s, %s, CURDATE())
-        """
+        new_bill_id = next_id("billing")
 
         try:
-            cursor.execute(insert_query, (new_bill_id, appt_id, amount, payment_status, payment_method))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            repo.add_bill(new_bill_id, appt_id, amount, payment_status, payment_method)
+            repo.commit()
+            invalidate_dashboard()
+            repo.close()
             return redirect("/billing")
         except Exception as e:
-            conn.rollback()
-            cursor.close()
-            conn.close()
-            return render_template("add_bill.html", appointments=appointments, error=str(e))
+            repo.rollback()
+            repo.close()
+            return render_template("add_bill.html", appointments=appointments, page=page,
+                                   page_query=work_queue.window(request.args)[2], error=str(e))
 
-    cursor.close()
-    conn.close()
-    return render_template("add_bill.html", appointments=appointments)
+    repo.close()
+    return render_template("add_bill.html", appointments=appointments, page=page,
+                           page_query=work_queue.window(request.args)[2])
 
 # ----------- EDIT BILL PAGE ----------------
 
 @app.route("/edit_bill/<int:bill_id>", methods=["GET", "POST"])
 def edit_bill(bill_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     if request.method == "POST":
         amount = request.form["amount"]
         payment_status = request.form["payment_status"]
         payment_method = request.form["payment_method"]
 
-        update_query = """
-        UPDATE billing 
-        SET amount = %s, payment_status = %s, payment_method = %s
-        WHERE bill_id = %s
-        """
-
         try:
-            cursor.execute(update_query, (amount, payment_status, payment_method, bill_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            repo.update_bill(bill_id, amount, payment_status, payment_method)
+            repo.commit()
+            invalidate_dashboard()
+            repo.close()
             return redirect("/billing")
         except Exception as e:
-            conn.rollback()
-            cursor.close()
-            conn.close()
+            repo.rollback()
+            repo.close()
             # Re-fetch and show error
             return redirect(f"/edit_bill/{bill_id}")
 
     # Get bill details
-    cursor.execute("""
-        SELECT b.bill_id, a.appt_id, p.patient_id, p.full_name, p.email, p.phone,
-               d.full_name AS doctor_name, a.starts_at, a.reason,
-               b.amount, b.payment_status, b.payment_method, b.billing_date
-        FROM billing b
-        JOIN appointment a ON a.appt_id = b.appt_id
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE b.bill_id = %s
-    """, (bill_id,))
-    bill = cursor.fetchone()
-
-    cursor.close()
-    conn.close()
+    bill = repo.bill_for_edit(bill_id)
+    repo.close()
 
     if not bill:
         return redirect("/billing")
@@ -295,25 +299,11 @@ def edit_bill(bill_id):
 # ----------- BILL DETAILS PAGE ----------------
 
 @app.route("/bill_details/<int:bill_id>")
+@httpcache.conditional(bill_details_version)
 def bill_details(bill_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT b.bill_id, a.appt_id, p.patient_id, p.full_name, p.email, p.phone, p.address,
-               d.full_name AS doctor_name, d.email AS doctor_email, a.starts_at, a.reason,
-               b.amount, b.payment_method, b.billing_date,
-               CASE WHEN b.payment_status = 'paid' THEN 'PAID' ELSE 'PENDING' END AS status
-        FROM billing b
-        JOIN appointment a ON a.appt_id = b.appt_id
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE b.bill_id = %s
-    """, (bill_id,))
-    bill = cursor.fetchone()
-
-    cursor.close()
-    conn.close()
+    repo = get_repository()
+    bill = repo.bill_details(bill_id)
+    repo.close()
 
     if not bill:
         return redirect("/billing")
@@ -323,21 +313,11 @@ def bill_details(bill_id):
 # ------------- MEDICATIONS PAGE ----------------
 
 @app.route("/medications")
+@httpcache.conditional(medications_version)
 def medications():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT m.med_id, m.med_name, mf.form_name, mv.strength, m.notes
-        FROM medication m
-        LEFT JOIN medication_variant mv ON mv.med_id = m.med_id
-        LEFT JOIN medication_form mf ON mf.form_id = mv.form_id
-        ORDER BY m.med_name
-    """)
-    medications = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    repo = get_repository()
+    medications = repo.medications()
+    repo.close()
 
     return render_template("medications.html", medications=medications)
 
@@ -345,80 +325,39 @@ def medications():
 
 @app.route("/add_medication", methods=["GET", "POST"])
 def add_medication():
-    conn = get_connection()
-    cursor = conn.cursor()
-
     if request.method == "POST":
         med_name = request.form["med_name"]
         form_type = request.form["form_type"]
         strength = request.form["strength"]
         notes = request.form.get("notes", "")
 
-        # Generate new medication ID
-        cursor.execute("SELECT COALESCE(MAX(med_id), 0) + 1 FROM medication")
-        new_med_id = cursor.fetchone()[0]
-
-        # Insert medication
-        cursor.execute("""
-            INSERT INTO medication (med_id, med_name, notes)
-            VALUES (%s, %s, %s)
-        """, (new_med_id, med_name, notes))
-
-        # Get or create form
-        cursor.execute("SELECT form_id FROM medication_form WHERE form_name = %s", (form_type,))
-        form_result = cursor.fetchone()
-        
-        if form_result:
-            form_id = form_result[0]
-        else:
-            cursor.execute("INSERT INTO medication_form (form_name) VALUES (%s)", (form_type,))
-            form_id = cursor.lastrowid
-
-        # Create medication variant
-        cursor.execute("SELECT COALESCE(MAX(variant_id), 0) + 1 FROM medication_variant")
-        new_variant_id = cursor.fetchone()[0]
-        
-        cursor.execute("""
-            INSERT INTO medication_variant (variant_id, med_id, form_id, strength)
-            VALUES (%s, %s, %s, %s)
-        """, (new_variant_id, new_med_id, form_id, strength))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        new_med_id = next_id("medication")
+        new_variant_id = next_id("medication_variant")
+
+        # Medication, its form (created if new) and the variant
+        repo = get_repository()
+        repo.add_medication(new_med_id, new_variant_id, med_name, notes, form_type, strength)
+        repo.commit()
+        refdata.cache.changed("medication")
+        invalidate_dashboard()
+        repo.close()
 
         return redirect("/medications")
 
-    cursor.close()
-    conn.close()
     return render_template("add_medication.html")
 
 # ------- ASSIGN MEDICATION TO PATIENT PAGE --------
 
 @app.route("/assign_medication/<int:med_id>", methods=["GET", "POST"])
 def assign_medication(med_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     # Get medication info
-    cursor.execute("""
-        SELECT m.med_name, mv.strength 
-        FROM medication m
-        LEFT JOIN medication_variant mv ON mv.med_id = m.med_id
-        WHERE m.med_id = %s LIMIT 1
-    """, (med_id,))
-    med_info = cursor.fetchone()
-
-    # Get appointments without prescriptions
-    cursor.execute("""
-        SELECT a.appt_id, p.full_name, d.full_name, a.starts_at
-        FROM appointment a
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE a.appt_id NOT IN (SELECT appt_id FROM prescription)
-        ORDER BY a.starts_at DESC
-    """)
-    appointments = cursor.fetchall()
+    med_info = repo.medication_info(med_id)
+
+    # Get one page of appointments without prescriptions
+    page = repo.pending_page("prescription", request.args)
+    appointments = page.rows
 
     if request.method == "POST":
         appointment_id = request.form["appointment_id"]
@@ -429,169 +368,258 @@ def assign_medication(med_id):
         instructions = request.form.get("instructions", "")
 
         # Get medication variant ID
-        cursor.execute("""
-            SELECT variant_id FROM medication_variant WHERE med_id = %s LIMIT 1
-        """, (med_id,))
-        variant_result = cursor.fetchone()
-        
-        if variant_result:
-            variant_id = variant_result[0]
-
-            # Generate new prescription ID
-            cursor.execute("SELECT COALESCE(MAX(rx_id), 1000) + 1 FROM prescription")
-            new_rx_id = cursor.fetchone()[0]
+        variant_id = repo.first_variant(med_id)
 
-            # Insert prescription
-            cursor.execute("""
-                INSERT INTO prescription (rx_id, appt_id, variant_id, dosage, route, frequency, instructions, quantity)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (new_rx_id, appointment_id, variant_id, dosage, route, frequency, instructions, quantity))
+        if variant_id is not None:
+            new_rx_id = next_id("prescription")
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+            # Insert prescription
+            repo.add_prescription(new_rx_id, appointment_id, variant_id, dosage, route,
+                                  frequency, instructions, quantity)
+            repo.commit()
+            repo.close()
 
             return redirect("/medications")
 
-    cursor.close()
-    conn.close()
+    repo.close()
 
     if not med_info:
         return redirect("/medications")
 
     return render_template("assign_medication.html", med_name=med_info[0], med_strength=med_info[1], 
-                         appointments=appointments)
+                         appointments=appointments, page=page,
+                         page_query=work_queue.window(request.args)[2])
 
 # ------------- ROOMS PAGE ----------------
 
 @app.route("/rooms")
+@httpcache.conditional(rooms_version)
 def rooms():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT r.room_id, r.room_name, r.room_type, r.notes,
-               COUNT(ar.appt_id) AS appointments_count
-        FROM clinic_room r
-        LEFT JOIN appointment_room ar ON ar.room_id = r.room_id
-        GROUP BY r.room_id, r.room_name, r.room_type, r.notes
-        ORDER BY r.room_id
-    """)
-    rooms = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-
-    return render_template("rooms.html", rooms=rooms)
+    repo = get_repository()
+    rooms = repo.rooms()
+    today = datetime.date.today()
+    week = occupancy.week_of(today)
+    today_usage = occupancy.report(repo, today, today + datetime.timedelta(days=1))
+    week_usage = occupancy.report(repo, week, week + datetime.timedelta(days=7))
+    free_at = occupancy.available_now(repo)
+    repo.close()
+
+    return render_template("rooms.html", rooms=rooms, free_at=free_at,
+                           today_usage={k: v["percent"] for k, v in today_usage.items()},
+                           week_usage={k: v["percent"] for k, v in week_usage.items()})
 
 # ----------- ADD ROOM PAGE ----------------
 
 @app.route("/add_room", methods=["GET", "POST"])
 def add_room():
-    conn = get_connection()
-    cursor = conn.cursor()
-
     if request.method == "POST":
         room_name = request.form["room_name"]
         room_type = request.form["room_type"]
         notes = request.form.get("notes", "")
 
-        # Generate new room ID
-        cursor.execute("SELECT COALESCE(MAX(room_id), 0) + 1 FROM clinic_room")
-        new_room_id = cursor.fetchone()[0]
+        new_room_id = next_id("clinic_room")
 
-        cursor.execute("""
-            INSERT INTO clinic_room (room_id, room_name, room_type, notes)
-            VALUES (%s, %s, %s, %s)
-        """, (new_room_id, room_name, room_type, notes))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        repo = get_repository()
+        repo.add_room(new_room_id, room_name, room_type, notes)
+        repo.commit()
+        refdata.cache.changed("room")
+        invalidate_dashboard()
+        repo.close()
 
         return redirect("/rooms")
 
-    cursor.close()
-    conn.close()
     return render_template("add_room.html")
 
 # ------- ASSIGN ROOM TO APPOINTMENT PAGE --------
 
 @app.route("/assign_room/<int:room_id>", methods=["GET", "POST"])
 def assign_room(room_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     # Get room info
-    cursor.execute("SELECT room_name FROM clinic_room WHERE room_id = %s", (room_id,))
-    room_result = cursor.fetchone()
-    room_name = room_result[0] if room_result else "Unknown"
-
-    # Get appointments without rooms
-    cursor.execute("""
-        SELECT a.appt_id, p.full_name, d.full_name, a.starts_at
-        FROM appointment a
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE a.appt_id NOT IN (SELECT appt_id FROM appointment_room)
-        ORDER BY a.starts_at DESC
-    """)
-    appointments = cursor.fetchall()
+    room_name = repo.room_name(room_id) or "Unknown"
 
+    # Get one page of appointments without rooms
+    page = repo.pending_page("room", request.args)
+    appointments = page.rows
+
+    error = None
     if request.method == "POST":
-        appointment_id = request.form["appointment_id"]
+        appointment_id = int(request.form["appointment_id"])
 
-        cursor.execute("""
-            INSERT INTO appointment_room (appt_id, room_id)
-            VALUES (%s, %s)
-        """, (appointment_id, room_id))
+        # Fresh transaction: lock the appointment, then the room, and check
+        # the room's bookings before inserting.
+        repo.rollback()
+        appt_times = repo.appointment_times(appointment_id, lock=True)
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+        conflicts = []
+        if appt_times and appt_times[1] is not None:
+            conflicts = schedule.room_conflicts(repo.conn, room_id, appt_times[0], appt_times[1],
+                                                lock=True, exclude=appointment_id)
 
-        return redirect("/rooms")
+        if conflicts:
+            repo.rollback()
+            error = "This room is already booked for " + ", ".join(c.describe() for c in conflicts)
+        else:
+            repo.assign_room(appointment_id, room_id)
+            repo.commit()
+            invalidate_dashboard()
+            schedule.room_assigned(appointment_id, room_id)
+            repo.close()
 
-    cursor.close()
-    conn.close()
+            return redirect("/rooms")
+
+    repo.close()
 
-    return render_template("assign_room.html", room_name=room_name, appointments=appointments)
+    return render_template("assign_room.html", room_name=room_name, appointments=appointments,
+                           page=page, page_query=work_queue.window(request.args)[2], error=error)
 
 # ------- ROOM SCHEDULE PAGE --------
 
 @app.route("/room_schedule/<int:room_id>")
+@httpcache.conditional(room_schedule_version)
 def room_schedule(room_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     # Get room name
-    cursor.execute("SELECT room_name FROM clinic_room WHERE room_id = %s", (room_id,))
-    room_result = cursor.fetchone()
-    room_name = room_result[0] if room_result else "Unknown"
-
-    # Get appointments in this room
-    cursor.execute("""
-        SELECT a.appt_id, p.full_name, d.full_name, a.starts_at, a.ends_at, a.status
-        FROM appointment a
-        JOIN appointment_room ar ON ar.appt_id = a.appt_id
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE ar.room_id = %s
-        ORDER BY a.starts_at DESC
-    """, (room_id,))
-    schedule = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    room_name = repo.room_name(room_id) or "Unknown"
+
+    # One week at a time: the free/busy calendar and the appointments in it
+    week = schedule_week(request.args.get("week"))
+    week_end = week + datetime.timedelta(days=7)
+    usage = occupancy.report(repo, week, week_end, [room_id])[room_id]
+    schedule = repo.room_schedule(room_id, occupancy.midnight(week), occupancy.midnight(week_end))
+
+    repo.close()
+
+    return render_template("room_schedule.html", room_id=room_id, room_name=room_name,
+                           schedule=schedule, usage=usage, week=week,
+                           prev_week=week - datetime.timedelta(days=7), next_week=week_end)
+
+
+def schedule_week(value):
+    # Monday of the week holding ``value`` (YYYY-MM-DD), default this week.
+    try:
+        day = datetime.date.fromisoformat(value) if value else datetime.date.today()
+    except ValueError:
+        day = datetime.date.today()
+    return occupancy.week_of(day)
+
 
-    return render_template("room_schedule.html", room_name=room_name, schedule=schedule)
+# ------- ROOM OCCUPANCY API --------
+
+@app.route("/api/rooms/occupancy")
+def api_room_occupancy():
+    args = request.args
+    try:
+        start = datetime.date.fromisoformat(args["from"]) if args.get("from") else datetime.date.today()
+        end = (datetime.date.fromisoformat(args["to"]) + datetime.timedelta(days=1)
+               if args.get("to") else start + datetime.timedelta(days=7))
+        room_ids = [int(r) for r in args.getlist("room_id")] or None
+    except ValueError:
+        return jsonify(error="from and to must be YYYY-MM-DD, room_id a number"), 400
+    if not start < end <= start + datetime.timedelta(days=occupancy.MAX_WINDOW_DAYS):
+        return jsonify(error="to must be on or after from, at most %d days"
+                             % occupancy.MAX_WINDOW_DAYS), 400
+
+    repo = get_repository()
+    known = refdata.cache.get(repo, "rooms")
+    room_ids = [r for r in room_ids if r in known] if room_ids else list(known)
+    usage = occupancy.report(repo, start, end, room_ids)
+    repo.close()
+    return jsonify(
+        start=start.isoformat(),
+        end=(end - datetime.timedelta(days=1)).isoformat(),
+        rooms=[{
+            "room_id": room_id,
+            "percent": u["percent"],
+            "days": {day.isoformat(): pct for day, pct in u["days"].items()},
+            "hours": {"%02d:00" % hour: pct for hour, pct in u["hours"]},
+            "busy": {day.isoformat(): [[s.strftime("%H:%M"), e.strftime("%H:%M")]
+                                       for s, e, busy in segments if busy]
+                     for day, segments in u["calendar"].items()},
+        } for room_id, u in usage.items()])
+
+
+@app.route("/api/rooms/available")
+def api_rooms_available():
+    at = parse_moment(request.args.get("at"), datetime.datetime.now())
+    if at is None:
+        return jsonify(error="at must be an ISO date or datetime"), 400
+    repo = get_repository()
+    free_at = occupancy.available_now(repo, at)
+    rooms = refdata.cache.get(repo, "rooms")
+    repo.close()
+    return jsonify(at=at.isoformat(), rooms=[
+        {"room_id": room_id, "room_name": rooms[room_id][1] if room_id in rooms else None,
+         "available": until is None, "busy_until": until.isoformat() if until else None}
+        for room_id, until in sorted(free_at.items())])
 
 # ----------- SEARCH PAGE ----------------
 
+SEARCH_LIMIT = 100
+
+
+def find_patients(repo, patient_name):
+    # The name index returns ranked ids; the rows themselves always come
+    # from the database so deleted patients never show up.
+    return repo.patients_by_ids(name_index.patients.search(patient_name, SEARCH_LIMIT))
+
+
+def day_range(value):
+    # Half-open [day 00:00, next day 00:00) bounds keep predicates on the
+    # raw starts_at column so the (doctor_id, starts_at) and starts_at
+    # indexes can be used; DATE(starts_at) = ... cannot.
+    try:
+        day = datetime.datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    return day, day + datetime.timedelta(days=1)
+
+
+def find_appointments(repo, search_type, search_value):
+    if search_type == "doctor" and search_value:
+        doctor_ids = name_index.doctors.search(search_value, SEARCH_LIMIT)
+        if not doctor_ids:
+            return []
+        return repo.appointments_for_doctors(doctor_ids, SEARCH_LIMIT)
+
+    if search_type == "date" and search_value:
+        bounds = day_range(search_value)
+        if bounds is None:
+            return []
+        return repo.appointments_between(*bounds)
+
+    return []
+
+
+def find_appointments_in_range(repo, date_from, date_to, doctor_name=""):
+    first = day_range(date_from)
+    last = day_range(date_to or date_from)
+    if first is None or last is None:
+        return []
+
+    doctor_ids = None
+    if doctor_name:
+        doctor_ids = name_index.doctors.search(doctor_name, SEARCH_LIMIT)
+        if not doctor_ids:
+            return []
+
+    return repo.appointments_between(first[0], last[1], doctor_ids, limit=SEARCH_LIMIT)
+
+
+def search_appointments_from_form(repo, form):
+    search_type = form.get("search_type", "")
+    if search_type == "range":
+        return find_appointments_in_range(repo, form.get("date_from", "").strip(),
+                                          form.get("date_to", "").strip(),
+                                          form.get("doctor_name", "").strip())
+    return find_appointments(repo, search_type, form.get("search_value", "").strip())
+
+
 @app.route("/search", methods=["GET", "POST"])
 def search():
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     patient_results = []
     appt_results = []
@@ -607,43 +635,13 @@ def search():
             if patient_name:
                 patient_search_term = patient_name
                 patient_searched = True
-                cursor.execute("""
-                    SELECT patient_id, full_name, email, phone
-                    FROM patient
-                    WHERE full_name LIKE %s
-                    ORDER BY full_name
-                """, (f"%{patient_name}%",))
-                patient_results = cursor.fetchall()
+                patient_results = find_patients(repo, patient_name)
 
         elif action == "search_appointments":
-            search_type = request.form.get("search_type", "")
-            search_value = request.form.get("search_value", "").strip()
-            
             appt_searched = True
-            if search_type == "doctor" and search_value:
-                cursor.execute("""
-                    SELECT a.appt_id, p.full_name, d.full_name, a.starts_at, a.status
-                    FROM appointment a
-                    JOIN patient p ON p.patient_id = a.patient_id
-                    JOIN doctor d ON d.doctor_id = a.doctor_id
-                    WHERE d.full_name LIKE %s
-                    ORDER BY a.starts_at DESC
-                """, (f"%{search_value}%",))
-                appt_results = cursor.fetchall()
-            
-            elif search_type == "date" and search_value:
-                cursor.execute("""
-                    SELECT a.appt_id, p.full_name, d.full_name, a.starts_at, a.status
-                    FROM appointment a
-                    JOIN patient p ON p.patient_id = a.patient_id
-                    JOIN doctor d ON d.doctor_id = a.doctor_id
-                    WHERE DATE(a.starts_at) = %s
-                    ORDER BY a.starts_at DESC
-                """, (search_value,))
-                appt_results = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+            appt_results = search_appointments_from_form(repo, request.form)
+
+    repo.close()
 
     return render_template("search.html", patient_results=patient_results, appt_results=appt_results,
                          patient_searched=patient_searched, appt_searched=appt_searched,
@@ -653,23 +651,15 @@ def search():
 
 @app.route("/search_patients", methods=["POST"])
 def search_patients():
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     patient_name = request.form.get("patient_name", "").strip()
     patient_results = []
 
     if patient_name:
-        cursor.execute("""
-            SELECT patient_id, full_name, email, phone
-            FROM patient
-            WHERE full_name LIKE %s
-            ORDER BY full_name
-        """, (f"%{patient_name}%",))
-        patient_results = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+        patient_results = find_patients(repo, patient_name)
+
+    repo.close()
 
     return render_template("search.html", patient_results=patient_results, patient_searched=True,
                          patient_search_term=patient_name, appt_results=[], appt_searched=False)
@@ -678,247 +668,470 @@ def search_patients():
 
 @app.route("/search_appointments", methods=["POST"])
 def search_appointments():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    search_type = request.form.get("search_type", "")
-    search_value = request.form.get("search_value", "").strip()
-    appt_results = []
-
-    if search_type == "doctor" and search_value:
-        cursor.execute("""
-            SELECT a.appt_id, p.full_name, d.full_name, a.starts_at, a.status
-            FROM appointment a
-            JOIN patient p ON p.patient_id = a.patient_id
-            JOIN doctor d ON d.doctor_id = a.doctor_id
-            WHERE d.full_name LIKE %s
-            ORDER BY a.starts_at DESC
-        """, (f"%{search_value}%",))
-        appt_results = cursor.fetchall()
-    
-    elif search_type == "date" and search_value:
-        cursor.execute("""
-            SELECT a.appt_id, p.full_name, d.full_name, a.starts_at, a.status
-            FROM appointment a
-            JOIN patient p ON p.patient_id = a.patient_id
-            JOIN doctor d ON d.doctor_id = a.doctor_id
-            WHERE DATE(a.starts_at) = %s
-            ORDER BY a.starts_at DESC
-        """, (search_value,))
-        appt_results = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    repo = get_repository()
+    appt_results = search_appointments_from_form(repo, request.form)
+    repo.close()
 
     return render_template("search.html", appt_results=appt_results, appt_searched=True,
                          patient_results=[], patient_searched=False)
 
 # ----------- DASHBOARD PAGE ----------------
 
-@app.route("/dashboard")
-def dashboard():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Total patients
-    cursor.execute("SELECT COUNT(*) FROM patient")
-    total_patients = cursor.fetchone()[0]
-
-    # Total appointments
-    cursor.execute("SELECT COUNT(*) FROM appointment")
-    total_appointments = cursor.fetchone()[0]
-
-    # Today's appointments
-    cursor.execute("""
-        SELECT COUNT(*) FROM appointment 
-        WHERE DATE(starts_at) = CURDATE()
-    """)
-    today_appointments = cursor.fetchone()[0]
-
-    # Scheduled vs completed
-    cursor.execute("""
-        SELECT COUNT(*) FROM appointment WHERE status = 'scheduled'
-    """)
-    scheduled_count = cursor.fetchone()[0]
-
-    cursor.execute("""
-        SELECT COUNT(*) FROM appointment WHERE status = 'completed'
-    """)
-    completed_count = cursor.fetchone()[0]
-
-    # Available rooms (rooms with no appointments today)
-    cursor.execute("""
-        SELECT COUNT(*) FROM clinic_room r
-        WHERE r.room_id NOT IN (
-            SELECT DISTINCT ar.room_id
-            FROM appointment_room ar
-            JOIN appointment a ON a.appt_id = ar.appt_id
-            WHERE DATE(a.starts_at) = CURDATE()
-        )
-    """)
-    available_rooms = cursor.fetchone()[0]
-
-    # Total medications
-    cursor.execute("SELECT COUNT(*) FROM medication")
-    total_medications = cursor.fetchone()[0]
-
-    # Total doctors
-    cursor.execute("SELECT COUNT(*) FROM doctor")
-    total_doctors = cursor.fetchone()[0]
-
-    # Total rooms
-    cursor.execute("SELECT COUNT(*) FROM clinic_room")
-    total_rooms = cursor.fetchone()[0]
-
-    # Unpaid bills
-    cursor.execute("""
-        SELECT COUNT(*) FROM billing WHERE payment_status = 'unpaid'
-    """)
-    unpaid_bills = cursor.fetchone()[0]
+# Every front-desk screen polls the dashboard, so the whole page is served
+# from a short-lived snapshot. Write routes call invalidate_dashboard() so
+# their own changes show up immediately; changes made by other workers
+# appear once the TTL runs out.
+DASHBOARD_TTL = float(os.environ.get("CLINIC_DASHBOARD_TTL", 5))
+dashboard_cache = TTLCache(DASHBOARD_TTL)
+
+
+def invalidate_dashboard():
+    dashboard_cache.invalidate()
+
+
+def dashboard_window():
+    # (today, tomorrow, end of the upcoming appointments list)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    return today, today + datetime.timedelta(days=1), today + datetime.timedelta(days=8)
+
+
+def dashboard_snapshot(counters, upcoming_appointments):
+    names = ("total_patients", "total_appointments", "today_appointments",
+             "scheduled_count", "completed_count", "available_rooms",
+             "total_medications", "total_doctors", "total_rooms", "unpaid_bills")
+    snapshot = {name: int(value) for name, value in zip(names, counters)}
+    snapshot["upcoming_appointments"] = upcoming_appointments
+    return snapshot
+
+
+def load_dashboard_snapshot():
+    repo = get_repository()
+    today, tomorrow, week_end = dashboard_window()
+
+    # All scalar counters in a single round trip
+    counters = repo.dashboard_counters(today, tomorrow)
 
     # Upcoming appointments (next 7 days)
-    cursor.execute("""
-        SELECT a.starts_at, p.full_name, d.full_name, a.reason, a.status
-        FROM appointment a
-        JOIN patient p ON p.patient_id = a.patient_id
-        JOIN doctor d ON d.doctor_id = a.doctor_id
-        WHERE DATE(a.starts_at) >= CURDATE()
-        AND DATE(a.starts_at) <= DATE_ADD(CURDATE(), INTERVAL 7 DAY)
-        ORDER BY a.starts_at ASC
-        LIMIT 20
-    """)
-    upcoming_appointments = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    upcoming_appointments = repo.upcoming_appointments(today, week_end)
 
-    return render_template("dashboard.html", total_patients=total_patients, 
-                         total_appointments=total_appointments, today_appointments=today_appointments,
-                         scheduled_count=scheduled_count, completed_count=completed_count,
-                         available_rooms=available_rooms, total_medications=total_medications,
-                         total_doctors=total_doctors, total_rooms=total_rooms, 
-                         unpaid_bills=unpaid_bills, upcoming_appointments=upcoming_appointments)
+    repo.close()
+    return dashboard_snapshot(counters, upcoming_appointments)
+
+
+@app.route("/dashboard")
+def dashboard():
+    snapshot = dashboard_cache.get_or_load("dashboard", load_dashboard_snapshot)
+    return render_template("dashboard.html", **snapshot)
 
 
 @app.route("/delete_patient/<int:patient_id>")
 def delete_patient(patient_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     try:
-        cursor.execute("DELETE FROM patient WHERE patient_id = %s", (patient_id,))
-        conn.commit()
+        repo.delete_patient(patient_id)
+        repo.commit()
+        invalidate_dashboard()
+        name_index.patients.removed(patient_id)
 
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
+        repo.rollback()
+        repo.close()
         # If trigger or FK fails, show error
         return render_template("patients.html", error=str(e))
 
-    cursor.close()
-    conn.close()
+    repo.close()
     return redirect("/patients")
 
 
 @app.route("/delete_appointment/<int:appt_id>")
 def delete_appointment(appt_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     try:
-        # Remove dependent records first to avoid FK constraint errors
-        cursor.execute("DELETE FROM billing WHERE appt_id = %s", (appt_id,))
-        cursor.execute("DELETE FROM prescription WHERE appt_id = %s", (appt_id,))
-        cursor.execute("DELETE FROM appointment_room WHERE appt_id = %s", (appt_id,))
-        cursor.execute("DELETE FROM appointment WHERE appt_id = %s", (appt_id,))
-        conn.commit()
+        repo.delete_appointment(appt_id)
+        repo.commit()
+        invalidate_dashboard()
+        schedule.removed(appt_id)
 
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
+        repo.rollback()
+        repo.close()
         return render_template("appointments.html", error=str(e))
 
-    cursor.close()
-    conn.close()
+    repo.close()
     return redirect("/appointments")
 
 
 @app.route("/delete_bill/<int:bill_id>")
 def delete_bill(bill_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     try:
-        cursor.execute("DELETE FROM billing WHERE bill_id = %s", (bill_id,))
-        conn.commit()
+        repo.delete_bill(bill_id)
+        repo.commit()
+        invalidate_dashboard()
 
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
+        repo.rollback()
+        repo.close()
         return render_template("billing.html", error=str(e))
 
-    cursor.close()
-    conn.close()
+    repo.close()
     return redirect("/billing")
 
 
 @app.route("/delete_medication/<int:med_id>")
 def delete_medication(med_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     try:
-        # Delete prescriptions referencing variants of this medication
-        cursor.execute("SELECT variant_id FROM medication_variant WHERE med_id = %s", (med_id,))
-        variants = cursor.fetchall()
-        for v in variants:
-            cursor.execute("DELETE FROM prescription WHERE variant_id = %s", (v[0],))
-
-        # Delete variants then medication
-        cursor.execute("DELETE FROM medication_variant WHERE med_id = %s", (med_id,))
-        cursor.execute("DELETE FROM medication WHERE med_id = %s", (med_id,))
-        conn.commit()
+        repo.delete_medication(med_id)
+        repo.commit()
+        refdata.cache.changed("medication")
+        invalidate_dashboard()
 
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
+        repo.rollback()
+        repo.close()
         return render_template("medications.html", error=str(e))
 
-    cursor.close()
-    conn.close()
+    repo.close()
     return redirect("/medications")
 
 
 @app.route("/delete_room/<int:room_id>")
 def delete_room(room_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    repo = get_repository()
 
     try:
-        # Remove any room assignments first
-        cursor.execute("DELETE FROM appointment_room WHERE room_id = %s", (room_id,))
-        cursor.execute("DELETE FROM clinic_room WHERE room_id = %s", (room_id,))
-        conn.commit()
+        repo.delete_room(room_id)
+        repo.commit()
+        refdata.cache.changed("room")
+        invalidate_dashboard()
 
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
+        repo.rollback()
+        repo.close()
         return render_template("rooms.html", error=str(e))
 
-    cursor.close()
-    conn.close()
+    repo.close()
     return redirect("/rooms")
 
 
 
 
+# ------- NEXT AVAILABLE SLOTS API --------
+
+MAX_SLOT_WINDOW = datetime.timedelta(days=62)
+
+
+def parse_moment(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
 
 
+@app.route("/api/slots")
+def api_slots():
+    args = request.args
+    try:
+        doctor_id = int(args["doctor_id"])
+        room_id = int(args["room_id"]) if args.get("room_id") else None
+        duration = datetime.timedelta(minutes=int(args.get("duration", 30)))
+        step = datetime.timedelta(minutes=int(args.get("step", 15)))
+        count = max(1, min(int(args.get("count", 5)), 50))
+        day_start = datetime.time.fromisoformat(args.get("day_start", "08:00"))
+        day_end = datetime.time.fromisoformat(args.get("day_end", "18:00"))
+    except (KeyError, ValueError):
+        return jsonify(error="doctor_id is required; room_id, duration, step and count "
+                             "must be integers, day_start/day_end HH:MM"), 400
+
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    window_start = parse_moment(args.get("from"), now)
+    if window_start is None:
+        return jsonify(error="from must be an ISO date or datetime"), 400
+    window_start = max(window_start, now)
+    window_end = parse_moment(args.get("to"), window_start + datetime.timedelta(days=7))
+    if window_end is None:
+        return jsonify(error="to must be an ISO date or datetime"), 400
+    window_end = min(window_end, window_start + MAX_SLOT_WINDOW)
+    if duration <= datetime.timedelta(0) or step <= datetime.timedelta(0) or window_end <= window_start:
+        return jsonify(error="duration and step must be positive and to after from"), 400
+
+    conn = get_connection()
+    doctor_busy, room_busy = schedule.busy(conn, doctor_id=doctor_id, room_id=room_id,
+                                           starts_at=window_start, ends_at=window_end)
+    conn.close()
+
+    found = slots.find_slots(doctor_busy, room_busy, window_start, window_end, duration, count,
+                             step=step, day_start=day_start, day_end=day_end)
+    return jsonify(
+        doctor_id=doctor_id,
+        room_id=room_id,
+        duration_minutes=int(duration.total_seconds() // 60),
+        slots=[{"starts_at": s.isoformat(), "ends_at": e.isoformat()} for s, e in found],
+    )
+
+
+# ------- REVENUE REPORTS --------
+# Read from revenue_daily / revenue_monthly (see revenue_rollup.py), so a
+# year is a few hundred rollup rows whatever the size of billing.
+
+MAX_TOP_DOCTORS = 50
+
+
+def parse_revenue_args(args):
+    """(year, month or None, top); ValueError on bad input."""
+    try:
+        year = int(args.get("year") or datetime.date.today().year)
+        top = max(1, min(int(args.get("top") or 10), MAX_TOP_DOCTORS))
+    except ValueError:
+        raise ValueError("year and top must be numbers")
+    month = None
+    if args.get("month"):
+        try:
+            month = datetime.datetime.strptime(args["month"], "%Y-%m").date()
+        except ValueError:
+            raise ValueError("month must be YYYY-MM")
+        year = month.year
+    if not 1900 <= year <= 9999:
+        raise ValueError("year out of range")
+    return year, month, top
+
+
+def revenue_report(year, month=None, top=10):
+    start = datetime.date(year, 1, 1)
+    end = datetime.date(year + 1, 1, 1)
+    repo = get_repository()
+    # December of the year before gives January its month-over-month change.
+    found = {row[0]: row for row in repo.revenue_by_month(datetime.date(year - 1, 12, 1), end)}
+    span = (month, revenue_rollup.next_month(month)) if month else (start, end)
+    top_doctors = repo.revenue_top_doctors(span[0], span[1], top)
+    methods = repo.revenue_by_method(span[0], span[1])
+    days = repo.revenue_by_day(span[0], span[1]) if month else []
+    repo.close()
+
+    months = []
+    previous = found.get(datetime.date(year - 1, 12, 1))
+    for number in range(1, 13):
+        first = datetime.date(year, number, 1)
+        row = found.get(first, (first, 0, 0, 0, 0))
+        change = None
+        if previous and previous[1]:
+            change = round(float(row[1] - previous[1]) / float(previous[1]) * 100, 1)
+        months.append({"month": first, "total": row[1], "paid": row[2], "unpaid": row[3],
+                       "bills": row[4], "change_pct": change})
+        previous = row
+    return {
+        "year": year,
+        "month": month,
+        "months": months,
+        "year_total": sum(m["total"] for m in months),
+        "year_bills": sum(m["bills"] for m in months),
+        "days": [{"day": d[0], "total": d[1], "paid": d[2], "unpaid": d[3], "bills": d[4]}
+                 for d in days],
+        "top_doctors": [{"doctor_id": d[0], "doctor": d[1], "total": d[2], "bills": d[3]}
+                        for d in top_doctors],
+        "methods": [{"method": m[0] or "unknown", "total": m[1], "bills": m[2]} for m in methods],
+    }
+
+
+@app.route("/reports/revenue")
+def revenue():
+    try:
+        year, month, top = parse_revenue_args(request.args)
+    except ValueError as e:
+        return render_template("revenue.html", error=str(e)), 400
+    return render_template("revenue.html", **revenue_report(year, month, top))
+
+
+@app.route("/api/reports/revenue")
+def api_revenue():
+    try:
+        year, month, top = parse_revenue_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    report = revenue_report(year, month, top)
+    report["month"] = month.strftime("%Y-%m") if month else None
+    for m in report["months"]:
+        m["month"] = m["month"].strftime("%Y-%m")
+    for d in report["days"]:
+        d["day"] = str(d["day"])[:10]
+    for rows in (report["months"], report["days"], report["top_doctors"], report["methods"]):
+        for row in rows:
+            for key in ("total", "paid", "unpaid"):
+                if key in row:
+                    row[key] = float(row[key])
+    report["year_total"] = float(report["year_total"])
+    return jsonify(report)
+
+
+# ------- AUDIT LOG API --------
+
+@app.route("/audit")
+def audit_log_query():
+    try:
+        filters = audit_log.parse_filters(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    repo = get_repository()
+    page = repo.audit_page(after=request.args.get("after"), before=request.args.get("before"),
+                           limit=page_size(request.args.get("limit")), **filters)
+    repo.close()
+    return jsonify(results=[audit_log.as_dict(row) for row in page.rows],
+                   next=page.next_token, prev=page.prev_token)
+
+
+# ------- EXPORTS --------
+
+@app.route("/export/<name>")
+def export(name):
+    if name not in exporter.EXPORTS:
+        return jsonify({"error": "unknown export"}), 404
+    fmt = request.args.get("format", "csv")
+    if fmt not in exporter.CONTENT_TYPES:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        date_from = exporter.parse_day(request.args.get("from"))
+        date_to = exporter.parse_day(request.args.get("to"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = exporter.Export(name, fmt, date_from, date_to)
+    return Response(body, content_type=exporter.CONTENT_TYPES[fmt], headers={
+        "Content-Disposition": 'attachment; filename="%s"' % body.filename,
+        "X-Accel-Buffering": "no",
+    })
+
+
+# ------- BULK IMPORT --------
+
+@app.route("/import/<kind>", methods=["POST"])
+def bulk_import(kind):
+    # Accepts a multipart "file" upload or the raw request body; the upload
+    # is streamed through the importer, never read into memory whole.
+    if kind not in importer.KINDS:
+        return jsonify({"error": "unknown import kind"}), 404
+
+    upload = request.files.get("file")
+    if upload is not None:
+        stream = upload.stream
+        fmt = request.args.get("format") or importer.guess_format(upload.filename)
+    else:
+        stream = request.stream
+        fmt = request.args.get("format") or (
+            "ndjson" if "json" in (request.content_type or "") else "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    report = importer.import_stream(get_connection(), kind, stream, fmt)
+    if report.inserted:
+        invalidate_dashboard()
+    return jsonify(report.as_dict())
+
+
+# ------- CONNECTION POOL AND QUERY STATS --------
+
+@app.route("/debug/pool")
+def debug_pool():
+    return jsonify(db.pool_stats())
+
+
+@app.route("/debug/refdata")
+def debug_refdata():
+    return jsonify(refdata.cache.stats())
+
+
+@app.route("/debug/occupancy")
+def debug_occupancy():
+    return jsonify(occupancy.cache.stats())
+
+
+@app.route("/debug/audit")
+def debug_audit():
+    # Queue depth, flush latency and spool use of the app-side audit writer.
+    return jsonify(audit.stats())
+
+
+@app.route("/debug/stats")
+def debug_stats():
+    # Per-route latency / DB time percentiles and histograms, plus the
+    # statements with the most total time. ?reset=1 starts a new window.
+    snapshot = sqlstats.registry.snapshot()
+    if request.args.get("reset"):
+        sqlstats.registry.reset()
+    return jsonify(snapshot)
+
+
+# ------- WARMUP, LIVENESS AND READINESS --------
+
+# serve.py compiles the templates in the master before forking and calls
+# warm_up() in each worker before it accepts connections, so a restarted
+# worker never serves its first requests from cold caches. /readyz stays
+# 503 until this process is warm and its pool hands out a working
+# connection within READY_POOL_TIMEOUT; /healthz only says the process is
+# alive and answers without touching the database.
+READY_POOL_TIMEOUT = float(os.environ.get("CLINIC_READY_POOL_TIMEOUT", 1.0))
+
+warm_state = {"warm": False, "seconds": None, "error": None}
+_warm_lock = threading.Lock()
+
+
+def preload_templates():
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def warm_up():
+    with _warm_lock:
+        if warm_state["warm"]:
+            return
+        started = time.perf_counter()
+        try:
+            db.get_pool().prefill()
+            with app.app_context():
+                repo = get_repository()
+                for dataset in refdata.DATASETS:
+                    refdata.cache.get(repo, dataset)
+                schedule.catch_up(get_connection())
+                name_index.patients.refresh()
+                name_index.doctors.refresh()
+        except Exception as e:
+            warm_state["error"] = "%s: %s" % (type(e).__name__, e)
+            raise
+        warm_state.update(warm=True, seconds=round(time.perf_counter() - started, 3), error=None)
+
+
+@app.route("/healthz")
+def healthz():
+    return jsonify(status="ok", pid=os.getpid())
+
+
+@app.route("/readyz")
+def readyz():
+    checks = {"pid": os.getpid()}
+    try:
+        # A worker started without serve.py warms on its first probe.
+        warm_up()
+        conn = db.get_pool().acquire(timeout=READY_POOL_TIMEOUT)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = "%s: %s" % (type(e).__name__, e)
+    checks.update(warm_state)
+    checks["pool"] = db.pool_stats()
+    ready = warm_state["warm"] and checks["database"] == "ok"
+    return jsonify(status="ready" if ready else "unavailable", **checks), 200 if ready else 503
 
 
 # ---------------- RUN THE APP ----------------
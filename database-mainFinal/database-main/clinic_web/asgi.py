@@ -0,0 +1,274 @@
+"""ASGI serving mode.
+
+    python asgi.py --port 8000                    # needs uvicorn
+    uvicorn asgi:application --port 8000          # or any ASGI server
+
+The pages whose queries do not depend on each other are coroutines here:
+/dashboard runs its counters and upcoming appointments, /billing its page of
+bills, totals and receivables, at the same time on separate pooled
+connections, so the page waits for the slowest query instead of the sum. A
+request waiting on the database is a suspended coroutine, not a blocked
+thread, so one worker holds hundreds of them; how many queries actually run
+at once is still bounded by the connection pool.
+
+Queries go through the same Repository code as the sync app. Each call
+checks a connection out of db.get_pool() and runs on a thread pool sized to
+the connection pool (DB_THREADS), which is what an async driver would do
+with its sockets; the SQL, refdata cache and embedded SQLite backend stay
+shared with app.py. Every other route is the Flask app itself, run on a
+second thread pool (WSGI_THREADS) with its request body streamed in as the
+app reads it and its response streamed back, so exports and imports behave
+as under a WSGI server.
+
+bench_asgi.py compares this mode with the threaded sync app.
+"""
+import argparse
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import render_template, request
+from werkzeug.exceptions import ClientDisconnected
+
+import db
+from app import app as flask_app
+from app import billing_context, dashboard_cache, dashboard_snapshot, dashboard_window
+from pagination import page_size
+from repository import get_repository
+
+DB_THREADS = int(os.environ.get("CLINIC_ASGI_DB_THREADS", db.POOL_SIZE + db.POOL_MAX_OVERFLOW))
+WSGI_THREADS = int(os.environ.get("CLINIC_ASGI_WSGI_THREADS", 16))
+
+_executors = {}
+
+
+def _executor(name, size):
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors[name] = ThreadPoolExecutor(size, thread_name_prefix="asgi-" + name)
+    return executor
+
+
+# ------- database calls --------
+
+def _with_repository(call):
+    repo = get_repository(db.get_pool().acquire())
+    try:
+        return call(repo)
+    finally:
+        repo.close()
+
+
+async def run_db(call):
+    """Await ``call(repo)`` on its own pooled connection. Wrap independent
+    calls in asyncio.gather() to run them concurrently."""
+    loop = asyncio.get_running_loop()
+    # The copied context carries the Flask request, so the queries still
+    # show up in the request's Server-Timing and /debug/sql.
+    return await loop.run_in_executor(_executor("db", DB_THREADS),
+                                      contextvars.copy_context().run, _with_repository, call)
+
+
+# ------- async pages --------
+
+_dashboard_lock = None
+
+
+async def dashboard(args):
+    global _dashboard_lock
+    snapshot = dashboard_cache.get("dashboard")
+    if snapshot is None:
+        if _dashboard_lock is None:
+            _dashboard_lock = asyncio.Lock()
+        # Concurrent misses wait for one load, like get_or_load() does.
+        async with _dashboard_lock:
+            snapshot = dashboard_cache.get("dashboard")
+            if snapshot is None:
+                generation = dashboard_cache.generation()
+                today, tomorrow, week_end = dashboard_window()
+                counters, upcoming = await asyncio.gather(
+                    run_db(lambda repo: repo.dashboard_counters(today, tomorrow)),
+                    run_db(lambda repo: repo.upcoming_appointments(today, week_end)))
+                snapshot = dashboard_snapshot(counters, upcoming)
+                dashboard_cache.put("dashboard", snapshot, generation)
+    return "dashboard.html", snapshot
+
+
+async def billing(args):
+    after, before, limit = args.get("after"), args.get("before"), page_size(args.get("limit"))
+    page, summary, unpaid_bills = await asyncio.gather(
+        run_db(lambda repo: repo.bills_page(after=after, before=before, limit=limit)),
+        run_db(lambda repo: repo.billing_totals()),
+        run_db(lambda repo: repo.receivables()))
+    return "billing.html", billing_context(page, summary, unpaid_bills)
+
+
+# GET path -> coroutine(request.args) returning (template, context)
+ASYNC_PAGES = {
+    "/dashboard": dashboard,
+    "/billing": billing,
+}
+
+
+async def _async_page(scope, send, page):
+    ctx = flask_app.request_context(_environ(scope))
+    ctx.push()
+    try:
+        # Same before/after_request hooks as a Flask-dispatched request.
+        try:
+            response = flask_app.preprocess_request()
+            if response is None:
+                template, context = await page(request.args)
+                response = render_template(template, **context)
+            response = flask_app.process_response(flask_app.make_response(response))
+        except Exception as e:
+            response = flask_app.make_response(flask_app.handle_exception(e))
+        body = response.get_data()
+        await send({"type": "http.response.start", "status": response.status_code,
+                    "headers": _headers(response.headers.items())})
+        await send({"type": "http.response.body", "body": body})
+    finally:
+        ctx.pop()
+
+
+# ------- everything else: the WSGI app --------
+
+def _environ(scope, body=None):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body or io.BytesIO(),
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+def _headers(items):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in items]
+
+
+class _RequestBody(io.RawIOBase):
+    """wsgi.input for the WSGI thread: pulls the body from receive() one
+    message at a time as the app reads it, so an upload is never held in
+    memory whole."""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.pending = b""
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and not self.done:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message["type"] == "http.disconnect":
+                self.done = True
+                raise ClientDisconnected()
+            self.pending = message.get("body", b"")
+            self.done = not message.get("more_body")
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def _call_wsgi(environ, loop, send):
+    def emit(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    body = flask_app(environ, start_response)
+    try:
+        emit({"type": "http.response.start", "status": started["status"],
+              "headers": _headers(started["headers"])})
+        for chunk in body:
+            if chunk:
+                emit({"type": "http.response.body", "body": chunk, "more_body": True})
+        emit({"type": "http.response.body", "body": b""})
+    finally:
+        # Lets a streamed export release its connection if the client left.
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+
+async def _wsgi(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    body = io.BufferedReader(_RequestBody(receive, loop))
+    await loop.run_in_executor(_executor("wsgi", WSGI_THREADS),
+                               _call_wsgi, _environ(scope, body), loop, send)
+
+
+# ------- ASGI application --------
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for executor in _executors.values():
+                executor.shutdown(wait=True)
+            _executors.clear()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    page = ASYNC_PAGES.get(scope["path"]) if scope["method"] == "GET" else None
+    if page is not None:
+        await _async_page(scope, send, page)
+    else:
+        await _wsgi(scope, receive, send)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the clinic app over ASGI with uvicorn.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error("uvicorn is not installed; run asgi:application under another ASGI server")
+    uvicorn.run(application, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,344 @@
+"""App-side audit pipeline, used when CLINIC_AUDIT_MODE=app.
+
+In that mode every pooled connection switches audit triggers 3-11 off for
+its own writes (db.set_trigger_audit), and the code writing appointment,
+billing and prescription rows builds the audit_log records itself, with
+the same entity_name, action and details text the triggers produce. A
+Repository holds its records until commit() and then hands them to
+submit(); a rollback drops them.
+
+submit() never blocks a request: records go onto a bounded in-process
+queue, and a background thread writes them in batches of up to BATCH_SIZE
+(executemany, which mysql-connector sends as one multi-row INSERT) at
+least every FLUSH_INTERVAL seconds. If the database cannot take a batch,
+or the queue is full, records are appended to SPOOL_PATH as JSON lines
+and replayed ahead of the next successful batch. performed_at is stamped
+when a record is built, so late writes keep the right time.
+
+Delivery is at-least-once for spooled records (a crash between the insert
+and truncating the spool replays them again). Records still in the queue
+when the process dies are lost, which is the price of taking the insert
+out of the transaction; keep the default trigger mode where that matters.
+
+    python audit.py --replay      # push a leftover spool into audit_log
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from decimal import Decimal
+
+try:
+    import fcntl
+except ImportError:     # no multi-process servers there, see _SpoolLock
+    fcntl = None
+
+import db
+
+ENABLED = db.AUDIT_MODE == "app"
+QUEUE_SIZE = int(os.environ.get("CLINIC_AUDIT_QUEUE_SIZE", 10000))
+BATCH_SIZE = int(os.environ.get("CLINIC_AUDIT_BATCH_SIZE", 500))
+FLUSH_INTERVAL = float(os.environ.get("CLINIC_AUDIT_FLUSH_INTERVAL", 0.5))
+SPOOL_PATH = os.environ.get(
+    "CLINIC_AUDIT_SPOOL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit_spool.jsonl"))
+RETRY_INTERVAL = 5.0
+
+INSERT_SQL = """
+    INSERT INTO audit_log (entity_name, entity_id, action, details, performed_at)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+# ------- records --------
+
+def concat(*parts):
+    # Like MySQL's CONCAT(): NULL if any part is NULL.
+    if any(part is None for part in parts):
+        return None
+    return "".join(str(part) for part in parts)
+
+
+def amount_text(amount):
+    # DECIMAL(10,2) as CONCAT() prints it
+    if amount is None:
+        return None
+    return str(Decimal(str(amount)).quantize(Decimal("0.01")))
+
+
+def record(entity_name, entity_id, action, details):
+    return (entity_name, entity_id, action, details,
+            datetime.datetime.now().replace(microsecond=0))
+
+
+def appointment_inserted(appt_id, patient_id, doctor_id):
+    return record("appointment", appt_id, "INSERT",
+                  concat("patient=", patient_id, ",doctor=", doctor_id))
+
+
+def appointment_deleted(appt_id, patient_id):
+    return record("appointment", appt_id, "DELETE",
+                  concat("deleted appointment for patient=", patient_id))
+
+
+def bill_inserted(bill_id, amount, payment_status):
+    return record("billing", bill_id, "INSERT",
+                  concat("amount=", amount_text(amount), ",status=", payment_status))
+
+
+def bill_updated(bill_id, old_status, new_status):
+    return record("billing", bill_id, "UPDATE", concat("status:", old_status, "->", new_status))
+
+
+def bill_deleted(bill_id, appt_id):
+    return record("billing", bill_id, "DELETE", concat("deleted billing for appt=", appt_id))
+
+
+def prescription_inserted(rx_id, variant_id, quantity):
+    return record("prescription", rx_id, "INSERT",
+                  concat("variant=", variant_id, ",quantity=", quantity))
+
+
+def prescription_deleted(rx_id, appt_id):
+    return record("prescription", rx_id, "DELETE",
+                  concat("deleted prescription for appt=", appt_id))
+
+
+# ------- spool --------
+
+class _SpoolLock:
+    """Serialises spool access between threads and, where fcntl exists,
+    between the worker processes of one server."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._file = open(self.path, "a+", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self._file
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+        finally:
+            self._file = None
+            self._lock.release()
+        return False
+
+
+def _encode(rec):
+    entity_name, entity_id, action, details, performed_at = rec
+    return json.dumps([entity_name, entity_id, action, details,
+                       performed_at.isoformat(" ")]) + "\n"
+
+
+def _decode(line):
+    entity_name, entity_id, action, details, performed_at = json.loads(line)
+    return (entity_name, entity_id, action, details,
+            datetime.datetime.fromisoformat(performed_at))
+
+
+def _insert(records):
+    conn = db.get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(records), BATCH_SIZE):
+            cursor.executemany(INSERT_SQL, records[start:start + BATCH_SIZE])
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+
+# ------- writer --------
+
+class AuditWriter:
+    def __init__(self, spool_path=SPOOL_PATH, queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(queue_size)
+        self._spool = _SpoolLock(spool_path)
+        self._spool_pending = os.path.exists(spool_path) and os.path.getsize(spool_path) > 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._retry_at = 0.0
+
+        self._lock = threading.Lock()
+        self._flush_ms = deque(maxlen=1024)
+        self._written = 0
+        self._batches = 0
+        self._spooled = 0
+        self._replayed = 0
+        self._failures = 0
+        self._last_error = None
+
+    def _ensure_started(self):
+        # One writer thread per process, restarted after a fork.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self._queue.maxsize)
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, records):
+        if not records:
+            return
+        self._ensure_started()
+        overflow = []
+        for rec in records:
+            try:
+                self._queue.put_nowait(rec)
+            except queue.Full:
+                overflow.append(rec)
+        if overflow:
+            self._to_spool(overflow)
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if batch or self._spool_pending:
+                self.flush(batch)
+        self.drain()
+
+    def flush(self, batch):
+        started = time.perf_counter()
+        if time.monotonic() < self._retry_at:
+            self._to_spool(batch)
+            return
+        try:
+            if self._spool_pending:
+                self._replay_spool()
+            if batch:
+                _insert(batch)
+        except Exception as e:       # database down, pool exhausted, ...
+            self._retry_at = time.monotonic() + RETRY_INTERVAL
+            with self._lock:
+                self._failures += 1
+                self._last_error = "%s: %s" % (type(e).__name__, e)
+            self._to_spool(batch)
+            return
+        with self._lock:
+            self._written += len(batch)
+            self._batches += 1 if batch else 0
+            self._flush_ms.append((time.perf_counter() - started) * 1000)
+
+    def _to_spool(self, records):
+        if not records:
+            return
+        with self._spool as f:
+            f.writelines(_encode(rec) for rec in records)
+            f.flush()
+            os.fsync(f.fileno())
+        self._spool_pending = True
+        with self._lock:
+            self._spooled += len(records)
+
+    def _replay_spool(self):
+        with self._spool as f:
+            f.seek(0)
+            records = [_decode(line) for line in f if line.strip()]
+            if records:
+                _insert(records)
+            f.truncate(0)
+        self._spool_pending = False
+        with self._lock:
+            self._replayed += len(records)
+        return len(records)
+
+    def close(self, timeout=10.0):
+        # Stop the writer after it has written out the queue; used at exit.
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch or self._spool_pending:
+            self.flush(batch)
+
+    def stats(self):
+        with self._lock:
+            flush_ms = sorted(self._flush_ms)
+            return {
+                "enabled": ENABLED,
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "written": self._written,
+                "batches": self._batches,
+                "spooled": self._spooled,
+                "replayed": self._replayed,
+                "spool_pending": self._spool_pending,
+                "failures": self._failures,
+                "last_error": self._last_error,
+                "flush_p50_ms": round(flush_ms[len(flush_ms) // 2], 3) if flush_ms else None,
+                "flush_max_ms": round(flush_ms[-1], 3) if flush_ms else None,
+            }
+
+
+writer = AuditWriter()
+
+
+def submit(records):
+    writer.submit(records)
+
+
+def stats():
+    return writer.stats()
+
+
+atexit.register(writer.close)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a leftover audit spool into audit_log.")
+    parser.add_argument("--replay", action="store_true", help="insert the spooled records")
+    parser.add_argument("--spool", default=SPOOL_PATH)
+    args = parser.parse_args()
+
+    if not args.replay:
+        parser.print_help()
+        return 1
+    count = AuditWriter(spool_path=args.spool)._replay_spool()
+    print("replayed %d audit records from %s" % (count, args.spool))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
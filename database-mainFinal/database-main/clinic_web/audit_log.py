@@ -0,0 +1,206 @@
+"""Query, partition and archive audit_log.
+
+    python audit_log.py query --entity billing --id 42
+    python audit_log.py query --action DELETE --since 2026-10-01 --until 2026-10-07
+    python audit_log.py partitions --ahead 3
+    python audit_log.py archive --keep-months 12 --dir /var/backups/clinic/audit
+
+query prints matching rows as NDJSON, newest first, and the token for the
+next page (pass it back with --after) on stderr. It reads through the same
+keyset pagination as the /audit endpoint, so every page is an index range
+scan on (entity_name, entity_id, performed_at), (entity_name, performed_at)
+or (performed_at) whatever the offset.
+
+On MySQL audit_log is range-partitioned by month. partitions splits the
+empty catch-all partition pmax into one partition per month up to --ahead
+months from now; run it from cron, archive does it too.
+
+archive moves every calendar month older than --keep-months out of the
+table, oldest first. Each month is exported to
+<dir>/audit_log-YYYY-MM.ndjson.gz (written as .part, fsync'd and renamed)
+and only then removed: by dropping its partition when it holds nothing
+but that month's exported rows, otherwise with chunked deletes, after which
+a partition left empty is dropped too. Rows that arrive for a month while
+it is being archived stay for the next run, which writes them to a new
+numbered file; existing files are never overwritten, so a crash can repeat
+rows across files but never lose any.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sys
+
+import exporter
+from repository import get_repository, next_month
+
+COLUMNS = ["log_id", "entity_name", "entity_id", "action", "performed_at", "details"]
+ARCHIVE_DIR = os.environ.get(
+    "CLINIC_AUDIT_ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit_archive"))
+KEEP_MONTHS = int(os.environ.get("CLINIC_AUDIT_KEEP_MONTHS", 12))
+PURGE_CHUNK = int(os.environ.get("CLINIC_AUDIT_PURGE_CHUNK", 5000))
+
+
+# ------- query --------
+
+def parse_filters(args):
+    """audit_page() filters from request args or a CLI namespace dict;
+    ValueError on bad input. ``until`` is an inclusive day."""
+    entity_id = args.get("entity_id")
+    try:
+        entity_id = int(entity_id) if entity_id not in (None, "") else None
+    except ValueError:
+        raise ValueError("entity_id must be a number, got %r" % entity_id)
+    since = exporter.parse_day(args.get("since"))
+    until = exporter.parse_day(args.get("until"))
+    if since and until and since > until:
+        raise ValueError("since is after until")
+    return {
+        "entity": args.get("entity") or None,
+        "entity_id": entity_id,
+        "action": (args.get("action") or "").upper() or None,
+        "since": datetime.datetime.combine(since, datetime.time()) if since else None,
+        "until": (datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time())
+                  if until else None),
+    }
+
+
+def as_dict(row):
+    return dict(zip(COLUMNS, map(exporter._json_value, row)))
+
+
+# ------- partitions --------
+
+def months_ahead(ahead, today=None):
+    month = (today or datetime.date.today()).replace(day=1)
+    months = []
+    for _ in range(ahead + 1):
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def ensure_partitions(repo, ahead):
+    return repo.add_audit_partitions(months_ahead(ahead))
+
+
+# ------- archive --------
+
+def _archive_path(directory, month):
+    base = os.path.join(directory, "audit_log-%s" % month.strftime("%Y-%m"))
+    path = base + ".ndjson.gz"
+    suffix = 1
+    while os.path.exists(path):
+        path = "%s.%d.ndjson.gz" % (base, suffix)
+        suffix += 1
+    return path
+
+
+def export_month(directory, month):
+    """Write one month to a new archive file; returns (path, rows)."""
+    last_day = next_month(month) - datetime.timedelta(days=1)
+    path = _archive_path(directory, month)
+    part = path + ".part"
+    rows = 0
+    with open(part, "wb") as raw:
+        with gzip.GzipFile(filename=os.path.basename(path)[:-3], mode="wb", fileobj=raw) as out:
+            for chunk in exporter.Export("audit", "ndjson", month, last_day):
+                out.write(chunk)
+                rows += chunk.count(b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(part, path)
+    return path, rows
+
+
+def archive(repo, directory, keep_months, chunk=PURGE_CHUNK, today=None):
+    cutoff = (today or datetime.date.today()).replace(day=1)
+    for _ in range(keep_months):
+        cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+    cutoff = datetime.datetime.combine(cutoff, datetime.time())
+
+    oldest = repo.oldest_audit()
+    repo.rollback()
+    if oldest is None:
+        return []
+    os.makedirs(directory, exist_ok=True)
+    archived = []
+    month = oldest.date().replace(day=1)
+    while month < cutoff.date():
+        start = datetime.datetime.combine(month, datetime.time())
+        end = datetime.datetime.combine(next_month(month), datetime.time())
+        # Only rows that exist now are removed; anything newer than
+        # max_log_id may miss this export and is left for the next run.
+        count, max_log_id = repo.audit_range_stats(start, end)
+        repo.rollback()
+        if count:
+            path, rows = export_month(directory, month)
+            deleted = repo.purge_audit_range(start, end, max_log_id, chunk)
+            repo.commit()
+            archived.append((month, path, rows, deleted))
+        month = next_month(month)
+    return archived
+
+
+# ------- CLI --------
+
+def _print_rows(rows):
+    for row in rows:
+        sys.stdout.write(json.dumps(as_dict(row)) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query, partition and archive audit_log.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query = commands.add_parser("query", help="print matching rows as NDJSON, newest first")
+    query.add_argument("--entity")
+    query.add_argument("--id", dest="entity_id")
+    query.add_argument("--action")
+    query.add_argument("--since", help="first day, YYYY-MM-DD")
+    query.add_argument("--until", help="last day, YYYY-MM-DD (inclusive)")
+    query.add_argument("--after", help="token printed by the previous page")
+    query.add_argument("--limit", type=int, default=100)
+
+    partitions = commands.add_parser("partitions", help="add monthly partitions ahead of time")
+    partitions.add_argument("--ahead", type=int, default=3)
+
+    arch = commands.add_parser("archive", help="move old months to compressed files")
+    arch.add_argument("--keep-months", type=int, default=KEEP_MONTHS)
+    arch.add_argument("--dir", default=ARCHIVE_DIR)
+    arch.add_argument("--chunk", type=int, default=PURGE_CHUNK)
+    arch.add_argument("--ahead", type=int, default=3)
+    args = parser.parse_args()
+
+    repo = get_repository()
+    try:
+        if args.command == "query":
+            try:
+                filters = parse_filters(vars(args))
+            except ValueError as e:
+                parser.error(str(e))
+            page = repo.audit_page(after=args.after, limit=args.limit, **filters)
+            _print_rows(page.rows)
+            if page.next_token:
+                print("next: %s" % page.next_token, file=sys.stderr)
+            return 0
+
+        if args.command == "partitions":
+            added = ensure_partitions(repo, args.ahead)
+        else:
+            for month, path, rows, deleted in archive(repo, args.dir, args.keep_months, args.chunk):
+                print("%s: %d rows -> %s, %d removed" % (month.strftime("%Y-%m"), rows, path, deleted))
+            added = ensure_partitions(repo, args.ahead)
+        for month in added:
+            print("added partition p%s" % month.strftime("%Y%m"))
+        if not repo.audit_partitions():
+            print("audit_log is not partitioned here; old months are removed with chunked deletes")
+        return 0
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
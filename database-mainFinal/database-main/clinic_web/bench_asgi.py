@@ -0,0 +1,157 @@
+"""Compare the threaded sync app with the ASGI mode under many slow requests.
+
+Both modes are driven in-process, with --clients requests in flight at any
+time: the sync app from a pool of --threads threads (one threaded WSGI
+worker), the ASGI app from that many coroutines on one event loop. A
+database server is emulated by the embedded engine plus a fixed delay per
+statement, so a page's latency is dominated by its round trips:
+
+    python seed_data.py --patients 2000 --appointments 20000
+    CLINIC_DB_BACKEND=sqlite CLINIC_SQLITE_LATENCY_MS=20 python bench_asgi.py --clients 200
+
+Against MySQL leave CLINIC_SQLITE_LATENCY_MS unset and point db.DB_CONFIG at
+a server with real latency. The dashboard cache is disabled so every request
+reaches the database. Results are written as JSON like bench_routes.py.
+"""
+import os
+
+os.environ.setdefault("CLINIC_DASHBOARD_TTL", "0")
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import asgi
+import db
+from app import app
+from bench_routes import _percentile, git_commit
+
+PATHS = {"dashboard": "/dashboard", "billing": "/billing"}
+
+
+def summarize(latencies, errors, wall):
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "mean_ms": round(statistics.mean(latencies), 3) if latencies else None,
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+    }
+
+
+def run_sync(path, requests, clients, threads):
+    # Every client's request is queued at once; the worker's threads take
+    # them in turn, as a threaded server would from its accept queue.
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(queued):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        status = client.get(path).status_code
+        with lock:
+            latencies.append((time.perf_counter() - queued) * 1000)
+            errors[0] += status >= 400
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        pending = set()
+        for _ in range(requests):
+            if len(pending) >= clients:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending.add(executor.submit(one, time.perf_counter()))
+        for future in pending:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+async def _asgi_get(path):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"",
+             "headers": [(b"host", b"localhost")], "http_version": "1.1",
+             "scheme": "http", "server": ("localhost", 80), "client": ("127.0.0.1", 0),
+             "root_path": ""}
+    await asgi.application(scope, receive, send)
+    return sent[0]["status"]
+
+
+async def _run_asgi(path, requests, clients):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            status = await _asgi_get(path)
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += status >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def run_asgi(path, requests, clients):
+    return asyncio.run(_run_asgi(path, requests, clients))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs ASGI serving under concurrent load.")
+    parser.add_argument("--requests", type=int, default=1000, help="timed requests per scenario and mode")
+    parser.add_argument("--clients", type=int, default=200, help="requests in flight at once")
+    parser.add_argument("--threads", type=int, default=8, help="threads of the sync worker")
+    parser.add_argument("--only", help="comma-separated scenario names (%s)" % ", ".join(PATHS))
+    parser.add_argument("--out", default="bench_asgi.json")
+    args = parser.parse_args()
+
+    app.config["TESTING"] = True
+    names = args.only.split(",") if args.only else sorted(PATHS)
+    results = {}
+    for name in names:
+        path = PATHS[name]
+        app.test_client().get(path)          # warm refdata and templates
+        results[name] = {
+            "sync": run_sync(path, args.requests, args.clients, args.threads),
+            "asgi": run_asgi(path, args.requests, args.clients),
+        }
+        for mode, result in results[name].items():
+            print("%-10s %-5s %s" % (name, mode, json.dumps(result)), file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {"requests": args.requests, "clients": args.clients, "threads": args.threads,
+                     "backend": db.BACKEND, "pool": db.POOL_SIZE + db.POOL_MAX_OVERFLOW,
+                     "sqlite_latency_ms": os.environ.get("CLINIC_SQLITE_LATENCY_MS")},
+        "scenarios": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
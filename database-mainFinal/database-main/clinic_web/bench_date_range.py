@@ -0,0 +1,87 @@
+"""Compare DATE(starts_at) filters with half-open range predicates.
+
+Runs EXPLAIN on both forms of the appointment date filters used by the
+search page and dashboard, prints the access type and index MySQL picks,
+then times each query.
+
+    python bench_date_range.py --date 2025-12-01 --doctor-id 1 --runs 50
+"""
+import argparse
+import datetime
+import json
+import statistics
+import time
+
+from db import get_pool
+
+QUERIES = {
+    "day": (
+        "SELECT COUNT(*) FROM appointment WHERE DATE(starts_at) = %(day)s",
+        "SELECT COUNT(*) FROM appointment WHERE starts_at >= %(start)s AND starts_at < %(end)s",
+    ),
+    "doctor_range": (
+        "SELECT appt_id, starts_at FROM appointment "
+        "WHERE doctor_id = %(doctor)s AND DATE(starts_at) >= %(day)s AND DATE(starts_at) <= %(last_day)s "
+        "ORDER BY starts_at",
+        "SELECT appt_id, starts_at FROM appointment "
+        "WHERE doctor_id = %(doctor)s AND starts_at >= %(start)s AND starts_at < %(range_end)s "
+        "ORDER BY starts_at",
+    ),
+}
+
+
+def explain(cursor, sql, params):
+    cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+    plan = json.loads(cursor.fetchone()[0])
+    table = plan["query_block"].get("table")
+    if table is None:
+        # ORDER BY plans nest the table under ordering_operation
+        table = plan["query_block"].get("ordering_operation", {}).get("table", {})
+    return table.get("access_type"), table.get("key"), table.get("rows_examined_per_scan")
+
+
+def timed(cursor, sql, params, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--date", default=datetime.date.today().isoformat())
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--doctor-id", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    day = datetime.datetime.strptime(args.date, "%Y-%m-%d")
+    params = {
+        "day": day.date(),
+        "last_day": (day + datetime.timedelta(days=args.days - 1)).date(),
+        "start": day,
+        "end": day + datetime.timedelta(days=1),
+        "range_end": day + datetime.timedelta(days=args.days),
+        "doctor": args.doctor_id,
+    }
+
+    conn = get_pool().acquire()
+    cursor = conn.cursor()
+    print("%-14s %-9s %-12s %-30s %10s %10s %10s" % (
+        "query", "form", "access", "key", "rows", "p50 ms", "p95 ms"))
+    for name, (before, after) in QUERIES.items():
+        for form, sql in (("DATE()", before), ("range", after)):
+            access, key, rows = explain(cursor, sql, params)
+            p50, p95 = timed(cursor, sql, params, args.runs)
+            print("%-14s %-9s %-12s %-30s %10s %10.3f %10.3f" % (
+                name, form, access, key, rows, p50, p95))
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
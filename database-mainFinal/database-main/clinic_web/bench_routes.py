@@ -0,0 +1,229 @@
+"""Drive the main pages through the Flask test client and record latency.
+
+Each scenario is requested --requests times (after --warmup untimed calls)
+from --concurrency threads, and the throughput, latency percentiles and the
+DB time reported in each response's Server-Timing header are written as
+JSON, tagged with the current git commit, so runs can be compared:
+
+    python seed_data.py --patients 100000 --appointments 1000000 --until 2026-06-30
+    python bench_routes.py --out before.json
+    ... change something ...
+    python bench_routes.py --out after.json --compare before.json
+
+Requests go straight into the WSGI app (no HTTP server), and the database is
+whatever db.DB_CONFIG points at; set CLINIC_DB_SOCKET to use a local server
+over its unix socket, or CLINIC_DB_BACKEND=sqlite (and CLINIC_SQLITE_PATH) to
+run everything in-process on the embedded engine. --writes adds POST /add_appointment, which books new
+appointments two years ahead and so modifies the database.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from app import app
+from db import get_pool
+
+SEARCH_TERMS = ["fat", "youssef", "ben", "ala", "sa", "omar", "tazi", "amina", "el"]
+_DB_TIMING = re.compile(r"db;dur=([\d.]+)")
+
+
+def id_ranges():
+    conn = get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        ranges = {}
+        for table, column in (("patient", "patient_id"), ("doctor", "doctor_id")):
+            cursor.execute("SELECT MIN(%s), MAX(%s) FROM %s" % (column, column, table))
+            ranges[table] = cursor.fetchone()
+        # Read as plain column values (not MIN/MAX) so both backends return
+        # datetimes rather than SQLite's untyped aggregate text.
+        bounds = []
+        for order in ("ASC", "DESC"):
+            cursor.execute("SELECT starts_at FROM appointment ORDER BY starts_at %s LIMIT 1" % order)
+            row = cursor.fetchone()
+            bounds.append(row[0] if row else None)
+        ranges["starts_at"] = tuple(bounds)
+        cursor.close()
+    finally:
+        conn.close()
+    return ranges
+
+
+def scenarios(ranges, writes):
+    """name -> function(rng) returning (method, path, form data or None)."""
+    first, last = ranges["starts_at"]
+    if first is None:
+        first = last = datetime.datetime.now()
+    span_days = max(1, (last - first).days)
+
+    def random_day(rng):
+        return (first + datetime.timedelta(days=rng.randrange(span_days))).strftime("%Y-%m-%d")
+
+    result = {
+        "patients": lambda rng: ("GET", "/patients", None),
+        "appointments": lambda rng: ("GET", "/appointments", None),
+        "billing": lambda rng: ("GET", "/billing", None),
+        "dashboard": lambda rng: ("GET", "/dashboard", None),
+        "search_patients": lambda rng: ("POST", "/search", {
+            "action": "search_patients", "patient_name": rng.choice(SEARCH_TERMS)}),
+        "search_day": lambda rng: ("POST", "/search", {
+            "action": "search_appointments", "search_type": "date", "search_value": random_day(rng)}),
+        "search_range": lambda rng: ("POST", "/search", {
+            "action": "search_appointments", "search_type": "range",
+            "date_from": random_day(rng), "date_to": "", "doctor_name": rng.choice(SEARCH_TERMS)}),
+        "add_appointment_form": lambda rng: ("GET", "/add_appointment", None),
+    }
+
+    if writes and ranges["patient"][0] is not None and ranges["doctor"][0] is not None:
+        # One 30 minute slot per request, far enough ahead to never collide
+        # with seeded or real bookings.
+        base = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=730),
+                                         datetime.time(8))
+        slots = itertools.count()
+        lock = threading.Lock()
+
+        def book(rng):
+            with lock:
+                slot = next(slots)
+            starts = base + datetime.timedelta(minutes=30 * slot)
+            return ("POST", "/add_appointment", {
+                "patient_id": str(rng.randint(*ranges["patient"])),
+                "doctor_id": str(ranges["doctor"][0]),
+                "starts_at": starts.isoformat(timespec="minutes"),
+                "ends_at": (starts + datetime.timedelta(minutes=20)).isoformat(timespec="minutes"),
+                "reason": "Benchmark",
+            })
+
+        result["add_appointment"] = book
+    return result
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def run_scenario(build, requests, concurrency, warmup, seed):
+    client = app.test_client()
+    warm_rng = random.Random(seed - 1)
+    for _ in range(warmup):
+        method, path, data = build(warm_rng)
+        client.open(path, method=method, data=data)
+
+    latencies = []
+    db_times = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        local = app.test_client()
+        while next(counter) < requests:
+            method, path, data = build(rng)
+            started = time.perf_counter()
+            response = local.open(path, method=method, data=data)
+            elapsed = (time.perf_counter() - started) * 1000
+            timing = _DB_TIMING.search(response.headers.get("Server-Timing", ""))
+            with lock:
+                latencies.append(elapsed)
+                if timing:
+                    db_times.append(float(timing.group(1)))
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    db_times.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "mean_ms": round(statistics.mean(latencies), 3) if latencies else None,
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+        "db_p50_ms": _percentile(db_times, 0.50),
+        "db_p95_ms": _percentile(db_times, 0.95),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous):
+    print("%-22s %12s %12s %9s" % ("scenario", "p50 before", "p50 after", "change"))
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before or not before.get("p50_ms") or result["p50_ms"] is None:
+            continue
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        print("%-22s %12.2f %12.2f %+8.1f%%" % (name, before["p50_ms"], result["p50_ms"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the clinic routes through the test client.")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--writes", action="store_true", help="include POST /add_appointment")
+    parser.add_argument("--out", default="bench_routes.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    app.config["TESTING"] = True
+    builders = scenarios(id_ranges(), args.writes)
+    if args.only:
+        wanted = args.only.split(",")
+        builders = {name: builders[name] for name in wanted if name in builders}
+
+    results = {}
+    for offset, (name, build) in enumerate(sorted(builders.items())):
+        results[name] = run_scenario(build, args.requests, args.concurrency, args.warmup,
+                                     args.seed + offset)
+        print("%-22s %s" % (name, json.dumps(results[name])), file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {"requests": args.requests, "warmup": args.warmup,
+                     "concurrency": args.concurrency, "seed": args.seed, "writes": args.writes},
+        "scenarios": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Read and reconcile the trigger-maintained billing summary tables.
+
+billing_summary (16 slots), billing_summary_patient and
+billing_summary_doctor are kept current by sp_billing_summary_apply, which
+the billing triggers call on every insert, update and delete, and by the
+appointment trigger that moves a bill's amounts when its appointment changes
+patient or doctor. They can drift if triggers were disabled during a load;
+run the reconcile job to detect and repair that:
+
+    python billing_summary.py            # report differences
+    python billing_summary.py --fix      # rebuild the tables from billing
+"""
+import argparse
+from decimal import Decimal
+
+from db import get_pool
+
+RECEIVABLES_LIMIT = 50
+
+FULL_GLOBAL = """
+    SELECT COALESCE(SUM(amount), 0),
+           COALESCE(SUM(CASE WHEN payment_status = 'paid' THEN amount ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN payment_status = 'unpaid' THEN amount ELSE 0 END), 0),
+           COUNT(*),
+           COALESCE(SUM(payment_status = 'unpaid'), 0)
+    FROM billing
+"""
+
+FULL_BY = """
+    SELECT a.{key},
+           SUM(b.amount),
+           COUNT(*),
+           COALESCE(SUM(CASE WHEN b.payment_status = 'unpaid' THEN b.amount ELSE 0 END), 0),
+           COALESCE(SUM(b.payment_status = 'unpaid'), 0)
+    FROM billing b
+    JOIN appointment a ON a.appt_id = b.appt_id
+    GROUP BY a.{key}
+"""
+
+
+def totals(cursor):
+    """(total, paid, unpaid, bills, unpaid bills) summed over the slots."""
+    cursor.execute("""
+        SELECT COALESCE(SUM(total_amount), 0), COALESCE(SUM(paid_amount), 0),
+               COALESCE(SUM(unpaid_amount), 0), COALESCE(SUM(bills_count), 0),
+               COALESCE(SUM(unpaid_count), 0)
+        FROM billing_summary
+    """)
+    return cursor.fetchone()
+
+
+def receivables(cursor, limit=RECEIVABLES_LIMIT):
+    """Patients with the largest unpaid balances, read via idx_bsp_unpaid."""
+    cursor.execute("""
+        SELECT s.patient_id, p.full_name, s.unpaid_count, s.unpaid_amount
+        FROM billing_summary_patient s
+        JOIN patient p ON p.patient_id = s.patient_id
+        WHERE s.unpaid_amount > 0
+        ORDER BY s.unpaid_amount DESC
+        LIMIT %s
+    """, (limit,))
+    return cursor.fetchall()
+
+
+def _money(value):
+    # SQLite sums DECIMAL columns as floats; compare both backends in cents.
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def _normalise(row):
+    # (total_billed, invoices_count, unpaid_amount, unpaid_count)
+    return (_money(row[0]), int(row[1]), _money(row[2]), int(row[3]))
+
+
+def _compare_by(cursor, table, key):
+    cursor.execute(FULL_BY.format(key=key))
+    expected = {row[0]: _normalise(row[1:]) for row in cursor.fetchall()}
+    cursor.execute("""
+        SELECT {key}, total_billed, invoices_count, unpaid_amount, unpaid_count
+        FROM {table}
+    """.format(key=key, table=table))
+    zero = (Decimal(0), 0, Decimal(0), 0)
+    actual = {row[0]: _normalise(row[1:]) for row in cursor.fetchall()}
+    diffs = []
+    for k in sorted(set(expected) | set(actual)):
+        want = expected.get(k, zero)
+        have = actual.get(k, zero)
+        if want != have:
+            diffs.append((table, k, want, have))
+    return diffs
+
+
+def reconcile(conn):
+    """Return differences between the summary tables and full aggregates."""
+    cursor = conn.cursor()
+    cursor.execute(FULL_GLOBAL)
+    want = tuple(cursor.fetchone())
+    have = tuple(totals(cursor))
+    diffs = []
+    if [_money(v) for v in want] != [_money(v) for v in have]:
+        diffs.append(("billing_summary", None, want, have))
+    diffs += _compare_by(cursor, "billing_summary_patient", "patient_id")
+    diffs += _compare_by(cursor, "billing_summary_doctor", "doctor_id")
+    cursor.close()
+    return diffs
+
+
+def rebuild(conn):
+    # INSERT ... SELECT share-locks the billing rows it reads, so billing
+    # writes wait for the rebuild to commit instead of being lost.
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM billing_summary")
+    cursor.execute("DELETE FROM billing_summary_patient")
+    cursor.execute("DELETE FROM billing_summary_doctor")
+    cursor.execute("""
+        INSERT INTO billing_summary (slot, total_amount, paid_amount, unpaid_amount, bills_count, unpaid_count)
+        SELECT bill_id % 16,
+               SUM(amount),
+               SUM(CASE WHEN payment_status = 'paid' THEN amount ELSE 0 END),
+               SUM(CASE WHEN payment_status = 'unpaid' THEN amount ELSE 0 END),
+               COUNT(*),
+               SUM(payment_status = 'unpaid')
+        FROM billing
+        GROUP BY bill_id % 16
+    """)
+    for table, key in (("billing_summary_patient", "patient_id"),
+                       ("billing_summary_doctor", "doctor_id")):
+        cursor.execute(("INSERT INTO {table} ({key}, total_billed, invoices_count, unpaid_amount, unpaid_count)"
+                        + FULL_BY).format(table=table, key=key))
+    conn.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the billing summary tables against billing.")
+    parser.add_argument("--fix", action="store_true", help="rebuild the summary tables if they differ")
+    args = parser.parse_args()
+
+    conn = get_pool().acquire()
+    try:
+        diffs = reconcile(conn)
+        for table, key, want, have in diffs:
+            print("%s %s: expected %s, found %s" % (table, key if key is not None else "", want, have))
+        if not diffs:
+            print("billing summaries match")
+        elif args.fix:
+            rebuild(conn)
+            print("rebuilt billing summaries (%d differences)" % len(diffs))
+    finally:
+        conn.close()
+    return 1 if diffs and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Small in-process cache whose entries expire after ``ttl`` seconds.
+
+    Concurrent misses for the same key are collapsed into one load, and a
+    load that races with invalidate() is not stored, so a write is never
+    hidden behind a snapshot taken before it.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+        return None
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have filled the entry while we waited.
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            with self._lock:
+                self.misses += 1
+                generation = self._generation
+            value = loader()
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, generation):
+        """Store a value loaded outside get_or_load() (asgi.py loads on the
+        event loop); dropped if invalidate() ran since ``generation()``."""
+        with self._lock:
+            self.misses += 1
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "ttl": self.ttl}
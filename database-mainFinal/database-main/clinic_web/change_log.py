@@ -0,0 +1,79 @@
+"""Prune the trigger-filled change logs.
+
+    python change_log.py                    # keep the last 24 hours
+    python change_log.py --keep-hours 6 --chunk 1000
+    python change_log.py --log row_change_log
+
+patient_change_log gets a row from the triggers on every patient insert,
+rename and delete, schedule_change_log on every appointment and
+appointment_room write. Workers replay them from their last change_id
+every second or so (name_index.py, schedule.py), so anything older than a
+few minutes has been applied everywhere and is dead weight. Run this from
+cron: it deletes the rows older than --keep-hours in change_id chunks, one
+transaction each.
+
+The newest row is always kept, so the log is never empty: the
+auto-increment counter cannot restart below ids a worker has seen, and a
+worker can compare its position with the oldest row left. One whose
+position is below that (a worker that was stalled for longer than the
+retention window) may have missed pruned changes and rebuilds its index
+from the base tables instead of replaying.
+
+row_change_log is read differently: a row's version is the highest
+change_id logged for it (httpcache.py ETags, the occupancy cache), so it is
+compacted rather than aged out. Every row that a newer one for the same
+(entity, entity_id) supersedes is deleted, in change_id chunks; versions
+do not change, and the log shrinks to one row per bill, appointment,
+patient and room that has ever changed.
+"""
+import argparse
+import datetime
+import os
+
+import db
+from repository import get_repository
+
+LOGS = ["patient_change_log", "schedule_change_log"]
+COMPACTED = "row_change_log"
+KEEP_HOURS = float(os.environ.get("CLINIC_CHANGE_LOG_KEEP_HOURS", 24))
+CHUNK = int(os.environ.get("CLINIC_CHANGE_LOG_CHUNK", 5000))
+
+
+def prune(repo, keep_hours=KEEP_HOURS, chunk=CHUNK, logs=LOGS, now=None):
+    """[(table, pruned through change_id, rows deleted)] for each log."""
+    before = (now or datetime.datetime.now()) - datetime.timedelta(hours=keep_hours)
+    pruned = []
+    for table in logs:
+        through = repo.change_log_prune_point(table, before)
+        repo.rollback()
+        if through is None:
+            continue
+        pruned.append((table, through, repo.prune_change_log(table, through, chunk)))
+    return pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete old rows from the change logs.")
+    parser.add_argument("--keep-hours", type=float, default=KEEP_HOURS)
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="rows per transaction, at most")
+    parser.add_argument("--log", choices=LOGS + [COMPACTED], action="append",
+                        help="only this log (repeatable)")
+    args = parser.parse_args()
+    if args.keep_hours <= 0 or args.chunk <= 0:
+        parser.error("--keep-hours and --chunk must be positive")
+
+    logs = args.log or LOGS + [COMPACTED]
+    repo = get_repository(db.get_pool().acquire())
+    try:
+        pruned = [table for table in logs if table in LOGS]
+        for table, through, deleted in prune(repo, args.keep_hours, args.chunk, pruned):
+            print("%s: %d rows deleted, through change_id %d" % (table, deleted, through))
+        if COMPACTED in logs:
+            print("%s: %d superseded rows deleted" % (COMPACTED, repo.compact_row_change_log(args.chunk)))
+    finally:
+        repo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,338 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
 import mysql.connector
+from flask import g, has_app_context
+
+import sqlite_backend
+import sqlstats
+
+# "mysql" (the real server) or "sqlite", the embedded engine in
+# sqlite_backend.py for tests, benchmarks and profiling in-process.
+BACKEND = os.environ.get("CLINIC_DB_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get(
+    "CLINIC_SQLITE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "clinic.sqlite3"))
+
+# "trigger": audit_log is written by triggers inside each transaction.
+# "app": the app writes it in batches off the request path (audit.py), and
+# every connection from the pool switches those triggers off for itself.
+AUDIT_MODE = os.environ.get("CLINIC_AUDIT_MODE", "trigger")
+
+# Catch this rather than a driver's own class so code runs on both backends.
+Error = (mysql.connector.Error, sqlite3.Error)
+
+DB_CONFIG = {
+    "host": os.environ.get("CLINIC_DB_HOST", "localhost"),
+    "user": os.environ.get("CLINIC_DB_USER", "naanani"),
+    "password": os.environ.get("CLINIC_DB_PASSWORD", "OPEN@@2005"),   # your MySQL password here
+    "database": os.environ.get("CLINIC_DB_NAME", "clinic"),
+}
+# A local server can be reached over its unix socket instead of TCP.
+if os.environ.get("CLINIC_DB_SOCKET"):
+    DB_CONFIG["unix_socket"] = os.environ["CLINIC_DB_SOCKET"]
+
+# Pool sizing is per process, so with gunicorn the server-side connection
+# count is roughly workers * (POOL_SIZE + POOL_MAX_OVERFLOW).
+POOL_SIZE = int(os.environ.get("CLINIC_DB_POOL_SIZE", 5))
+POOL_MAX_OVERFLOW = int(os.environ.get("CLINIC_DB_POOL_MAX_OVERFLOW", 10))
+POOL_TIMEOUT = float(os.environ.get("CLINIC_DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = float(os.environ.get("CLINIC_DB_POOL_RECYCLE", 1800))
+POOL_PRE_PING = os.environ.get("CLINIC_DB_POOL_PRE_PING", "1") != "0"
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Proxy around a pooled connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        if self._released:
+            raise mysql.connector.errors.InterfaceError("Connection was returned to the pool")
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._released:
+            raise mysql.connector.errors.InterfaceError("Connection was returned to the pool")
+        return sqlstats.instrument(self._raw.cursor(*args, **kwargs))
+
+    @property
+    def released(self):
+        return self._released
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+    def invalidate(self):
+        # Close the socket instead of returning it, e.g. when a streamed
+        # result was abandoned half way and draining it would cost more
+        # than reconnecting.
+        if not self._released:
+            self._released = True
+            self._pool.discard(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not self._released:
+            try:
+                self._raw.rollback()
+            except Error:
+                pass
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """Fixed-size pool with overflow, checkout timeout, idle recycling and pre-ping."""
+
+    def __init__(self, config, backend="mysql", size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE, pre_ping=POOL_PRE_PING):
+        self.config = dict(config)
+        self.backend = backend
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.pid = os.getpid()
+
+        self._idle = deque()          # (raw connection, returned_at)
+        self._opened = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self._started = time.monotonic()
+        self._checkouts = 0
+        self._recent_checkouts = deque()
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        if self.backend == "sqlite":
+            raw = sqlite_backend.connect(self.config["path"])
+        else:
+            raw = mysql.connector.connect(**self.config)
+        if AUDIT_MODE == "app":
+            set_trigger_audit(raw, False)
+        return raw
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Error:
+            pass
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        raw = None
+        returned_at = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, returned_at = self._idle.pop()
+                    break
+                if self._opened < self.size + self.max_overflow:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        "No database connection available after %.1fs "
+                        "(size=%d, overflow=%d)" % (timeout, self.size, self.max_overflow))
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            raw = self._checkout_health(raw, returned_at)
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        now = time.monotonic()
+        waited = now - started
+        with self._cond:
+            self._checkouts += 1
+            self._recent_checkouts.append(now)
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, raw)
+
+    def _checkout_health(self, raw, returned_at):
+        if raw is None:
+            return self._connect()
+        if self.recycle and time.monotonic() - returned_at > self.recycle:
+            self._discard(raw)
+            self._reconnects += 1
+            return self._connect()
+        if self.pre_ping and not raw.is_connected():
+            self._discard(raw)
+            self._reconnects += 1
+            return self._connect()
+        return raw
+
+    def release(self, raw):
+        healthy = True
+        try:
+            if raw.unread_result:
+                raw.consume_results()
+            # Always end the transaction so the next borrower does not inherit
+            # uncommitted writes or a stale REPEATABLE READ snapshot.
+            if raw.in_transaction:
+                raw.rollback()
+        except Error:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy and len(self._idle) < self.size:
+                self._idle.append((raw, time.monotonic()))
+                raw = None
+            else:
+                self._opened -= 1
+            self._cond.notify()
+
+        if raw is not None:
+            self._discard(raw)
+
+    def discard(self, raw):
+        with self._cond:
+            self._in_use -= 1
+            self._opened -= 1
+            self._cond.notify()
+        try:
+            raw.shutdown()
+        except Error + (AttributeError,):
+            self._discard(raw)
+
+    def prefill(self, count=None):
+        # Open up to ``count`` (default: size) connections now, so the first
+        # requests after a worker starts do not pay for the handshakes.
+        conns = []
+        try:
+            for _ in range(min(count or self.size, self.size)):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def dispose(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+        for raw, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            while self._recent_checkouts and now - self._recent_checkouts[0] > 60:
+                self._recent_checkouts.popleft()
+            return {
+                "pid": self.pid,
+                "backend": self.backend,
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "checkouts_per_sec": round(len(self._recent_checkouts) / 60.0, 3),
+                "checkouts_per_sec_lifetime": round(self._checkouts / max(now - self._started, 1e-9), 3),
+                "wait_avg_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(1000 * self._wait_max, 3),
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # Pools are created lazily and per process so that forked workers never
+    # share sockets opened by the parent.
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                if BACKEND == "sqlite":
+                    _pool = ConnectionPool({"path": SQLITE_PATH}, backend="sqlite")
+                else:
+                    _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
 
 def get_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="naanani",
-        password="OPEN@@2005",   # your MySQL password here
-        database="clinic"
-    )
+    # Inside a request, every caller shares one checkout which is returned by
+    # the teardown handler even if the route raised before closing it.
+    if has_app_context():
+        conn = g.get("_clinic_conn")
+        if conn is None or conn.released:
+            conn = get_pool().acquire()
+            g._clinic_conn = conn
+        return conn
+    return get_pool().acquire()
+
+
+def connect():
+    # A connection outside the pool, configured like the pooled ones, for
+    # work that must never wait for a checkout (ids.py). The caller owns it.
+    return get_pool()._connect()
+
+
+def release_request_connection(exc=None):
+    conn = g.pop("_clinic_conn", None)
+    if conn is not None:
+        conn.close()
+
+
+def set_trigger_audit(conn, enabled):
+    # Audit triggers 3-11 skip rows written by a connection that turned
+    # them off (a session variable on MySQL, a connection flag read by
+    # clinic_app_audit() on SQLite).
+    if isinstance(conn, PooledConnection):
+        conn = conn._raw
+    if isinstance(conn, sqlite_backend.Connection):
+        conn.app_audit = not enabled
+        return
+    cursor = conn.cursor()
+    cursor.execute("SET @clinic_app_audit = %s", (None if enabled else 1,))
+    cursor.close()
+
+
+def error_message(e):
+    # mysql-connector keeps the server's text in .msg; sqlite3 only has args.
+    return getattr(e, "msg", None) or str(e)
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
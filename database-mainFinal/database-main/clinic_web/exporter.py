@@ -0,0 +1,156 @@
+import csv
+import datetime
+import io
+import json
+import os
+from decimal import Decimal
+
+from db import get_pool
+from repository import get_repository
+
+# Streaming CSV / NDJSON exports.
+#
+# Each export runs on its own pool connection with an unbuffered cursor and
+# is written out FETCH_SIZE rows at a time, so a worker holds one batch in
+# memory however large the result is. The queries read in index order
+# (starts_at, billing_date, performed_at) so MySQL streams rows without sorting
+# the whole result first. A client that disconnects mid-export gets its
+# connection closed rather than drained.
+
+FETCH_SIZE = int(os.environ.get("CLINIC_EXPORT_FETCH", 1000))
+# Seconds MySQL waits on a slow client before dropping the export (the
+# SQLite backend has no socket to time out).
+NET_WRITE_TIMEOUT = int(os.environ.get("CLINIC_EXPORT_WRITE_TIMEOUT", 600))
+
+# name -> (column headers, SELECT ... FROM ..., date column, ORDER BY)
+EXPORTS = {
+    "appointments": (
+        ["appt_id", "patient_id", "patient_name", "doctor_id", "doctor_name",
+         "starts_at", "ends_at", "status", "reason"],
+        """
+        SELECT a.appt_id, a.patient_id, p.full_name, a.doctor_id, d.full_name,
+               a.starts_at, a.ends_at, a.status, a.reason
+        FROM appointment a
+        JOIN patient p ON p.patient_id = a.patient_id
+        JOIN doctor d ON d.doctor_id = a.doctor_id
+        """,
+        "a.starts_at", "a.starts_at, a.appt_id",
+    ),
+    "billing": (
+        ["bill_id", "appt_id", "patient_name", "doctor_name", "starts_at",
+         "amount", "payment_status", "payment_method", "billing_date"],
+        """
+        SELECT b.bill_id, b.appt_id, p.full_name, d.full_name, a.starts_at,
+               b.amount, b.payment_status, b.payment_method, b.billing_date
+        FROM billing b
+        JOIN appointment a ON a.appt_id = b.appt_id
+        JOIN patient p ON p.patient_id = a.patient_id
+        JOIN doctor d ON d.doctor_id = a.doctor_id
+        """,
+        "b.billing_date", "b.billing_date, b.bill_id",
+    ),
+    "audit": (
+        ["log_id", "entity_name", "entity_id", "action", "performed_at", "details"],
+        """
+        SELECT log_id, entity_name, entity_id, action, performed_at, details
+        FROM audit_log
+        """,
+        "performed_at", "performed_at, log_id",
+    ),
+}
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        raise ValueError("dates must be YYYY-MM-DD, got %r" % value)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _encode_csv(headers, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if headers:
+        writer.writerow(headers)
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def _encode_ndjson(headers, rows):
+    return "".join(
+        json.dumps(dict(zip(headers, map(_json_value, row)))) + "\n" for row in rows
+    ).encode("utf-8")
+
+
+class Export:
+    """Iterable response body; the connection is released by iteration or close()."""
+
+    def __init__(self, name, fmt="csv", date_from=None, date_to=None):
+        headers, select_sql, date_column, order_by = EXPORTS[name]
+        self.headers = headers
+        self.fmt = fmt
+        self.filename = "%s.%s" % (name, fmt)
+
+        where = []
+        params = []
+        if date_from is not None:
+            where.append("%s >= %%s" % date_column)
+            params.append(date_from)
+        if date_to is not None:
+            # Inclusive end day as a half-open bound keeps the index usable.
+            where.append("%s < %%s" % date_column)
+            params.append(date_to + datetime.timedelta(days=1))
+        sql = select_sql
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY " + order_by
+
+        # The query runs before the response starts, so errors still turn
+        # into a normal error page instead of a truncated download.
+        self.finished = False
+        self.conn = get_pool().acquire()
+        try:
+            self.repo = get_repository(self.conn)
+            self.repo.begin_export(NET_WRITE_TIMEOUT)
+            self.cursor = self.conn.cursor()
+            self.cursor.execute(sql, params)
+        except Exception:
+            self.conn.invalidate()
+            raise
+
+    def __iter__(self):
+        encode = _encode_csv if self.fmt == "csv" else _encode_ndjson
+        try:
+            if self.fmt == "csv":
+                yield encode(self.headers, [])
+            while True:
+                rows = self.cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                yield encode(None if self.fmt == "csv" else self.headers, rows)
+            self.finished = True
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn.released:
+            return
+        if self.finished:
+            self.cursor.close()
+            self.repo.end_export()
+            self.conn.close()
+        else:
+            self.conn.invalidate()
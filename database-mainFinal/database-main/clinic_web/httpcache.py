@@ -0,0 +1,100 @@
+import functools
+import glob
+import os
+
+from flask import current_app, request
+
+# HTTP caching: conditional GET for pages, long-lived static assets.
+#
+# A page wrapped in conditional() declares the versions it is built from
+# (row_change_log high-water marks, refdata entity versions). They become
+# its ETag, so a browser revalidating a page it already holds gets a 304
+# after those few index lookups, without the page's own queries or the
+# template rendering. Pages are "private, no-cache": always revalidated,
+# never kept by shared caches (they carry patient data).
+#
+# ETags only, no Last-Modified: one-second timestamps would hide a second
+# change made within the same second.
+#
+# Static files get ?v=<mtime> appended by url_for, and requests carrying it
+# are cacheable for STATIC_MAX_AGE; a deploy changes the URL instead of
+# waiting for caches to expire.
+
+STATIC_MAX_AGE = int(os.environ.get("CLINIC_STATIC_MAX_AGE", 365 * 24 * 3600))
+PAGE_CACHE_CONTROL = "private, no-cache"
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _release():
+    # Part of every ETag, so pages rendered by an older deploy of the code
+    # or templates are never revalidated.
+    release = os.environ.get("CLINIC_RELEASE")
+    if release:
+        return release
+    paths = glob.glob(os.path.join(_HERE, "*.py")) + glob.glob(os.path.join(_HERE, "Templates", "*"))
+    return "%x" % max(int(os.stat(path).st_mtime) for path in paths)
+
+
+RELEASE = _release()
+
+_static_versions = {}
+
+
+def etag_for(parts):
+    return "%s-%s" % (RELEASE, "-".join(str(part or 0) for part in parts))
+
+
+def conditional(version):
+    """Route decorator. ``version(**view_args)`` returns the tuple of
+    versions the page depends on, or None to serve it unconditionally
+    (e.g. the row is gone and the route redirects)."""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            parts = version(**kwargs)
+            if parts is None:
+                return view(**kwargs)
+            etag = etag_for(parts)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = PAGE_CACHE_CONTROL
+            return response
+        return wrapper
+    return decorate
+
+
+def _static_version(endpoint, values):
+    if endpoint != "static" or "v" in values:
+        return
+    filename = values.get("filename")
+    version = _static_versions.get(filename)
+    if version is None:
+        try:
+            version = "%x" % int(os.stat(os.path.join(current_app.static_folder, filename)).st_mtime)
+        except OSError:
+            return
+        _static_versions[filename] = version
+    values["v"] = version
+
+
+def _static_cache_control(response):
+    if request.endpoint != "static":
+        return response
+    if request.args.get("v"):
+        response.headers["Cache-Control"] = "public, max-age=%d, immutable" % STATIC_MAX_AGE
+    else:
+        # Unversioned URL: cacheable, but revalidated through the ETag /
+        # Last-Modified Flask already sends with static files.
+        response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
+def init_app(app):
+    app.url_defaults(_static_version)
+    app.after_request(_static_cache_control)
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import db
+from repository import get_repository
+
+# Primary keys are handed out from blocks reserved in the id_sequence table
+# (hi/lo). Reserving a block is one atomic UPDATE, so gunicorn workers never
+# receive overlapping ranges, and every other insert needs no extra lookup.
+# IDs from a block that is never used (worker restart, rolled back insert)
+# are simply skipped.
+#
+# Reservations run on one connection per process that the allocator keeps
+# for itself, outside the pool. A request refilling a block already holds
+# its pooled connection; had it to check out a second one, every thread
+# could end up holding one and waiting for another until POOL_TIMEOUT.
+BLOCK_SIZE = int(os.environ.get("CLINIC_ID_BLOCK_SIZE", 50))
+
+# sequence name -> (table, id column, offset used when the table is empty)
+SEQUENCES = {
+    "patient": ("patient", "patient_id", 0),
+    "appointment": ("appointment", "appt_id", 100),
+    "billing": ("billing", "bill_id", 2000),
+    "prescription": ("prescription", "rx_id", 1000),
+    "medication": ("medication", "med_id", 0),
+    "medication_variant": ("medication_variant", "variant_id", 0),
+    "clinic_room": ("clinic_room", "room_id", 0),
+}
+
+
+class IdBlock:
+    def __init__(self, start, end):
+        self.next = start
+        self.end = end
+
+
+class IdAllocator:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.pid = os.getpid()
+        self._blocks = {}
+        self._locks = {name: threading.Lock() for name in SEQUENCES}
+        self._conn = None
+        self._conn_pid = None
+        self._conn_lock = threading.Lock()
+
+    def next_id(self, name):
+        if self.pid != os.getpid():
+            # Blocks reserved before a fork would be shared with siblings.
+            self._blocks = {}
+            self.pid = os.getpid()
+
+        with self._locks[name]:
+            block = self._blocks.get(name)
+            if block is None or block.next >= block.end:
+                block = self._reserve(name, self.block_size)
+                self._blocks[name] = block
+            value = block.next
+            block.next += 1
+            return value
+
+    def reserve(self, name, count):
+        # Bulk callers (imports) take a dedicated range in one round trip.
+        block = self._reserve(name, count)
+        return range(block.next, block.end)
+
+    def advance(self, name, floor):
+        # Called for rows inserted with explicit ids (imports) so the
+        # sequence never hands those ids out again.
+        self._reserve(name, 0)
+        self._committed(lambda repo: repo.advance_sequence(name, floor))
+
+    def _reserve(self, name, count):
+        table, column, offset = SEQUENCES[name]
+        end = self._committed(lambda repo: repo.reserve_ids(name, count, table, column, offset))
+        return IdBlock(end - count, end)
+
+    def _committed(self, work):
+        # Commits at once, so a reservation never holds the id_sequence row
+        # lock for the rest of the caller's transaction. On SQLite, which has
+        # a single writer, callers must take their ids before their first
+        # write.
+        with self._conn_lock:
+            if self._conn_pid != os.getpid():
+                # The parent's connection; closing it would end its session.
+                self._conn = None
+            if self._conn is not None and not self._conn.is_connected():
+                self._close()
+            if self._conn is None:
+                self._conn = db.connect()
+                self._conn_pid = os.getpid()
+            try:
+                result = work(get_repository(self._conn))
+                self._conn.commit()
+            except BaseException:
+                self._close()
+                raise
+            return result
+
+    def _close(self):
+        conn, self._conn = self._conn, None
+        try:
+            conn.close()
+        except db.Error:
+            pass
+
+
+allocator = IdAllocator()
+
+
+def next_id(name):
+    return allocator.next_id(name)
@@ -0,0 +1,352 @@
+"""Bulk import of patients and appointments from CSV or NDJSON.
+
+Records are read one at a time, validated against the same rules as the
+table CHECKs and the appointment trigger, and inserted CHUNK_SIZE rows per
+executemany() and commit. If a chunk fails in the database (foreign key,
+overlapping appointment) it is rolled back and replayed row by row so only
+the offending rows are rejected. Memory use depends on the chunk size, not on
+the file size.
+
+    python importer.py patients patients.csv
+    python importer.py appointments history.ndjson --rejects rejects.csv
+
+The column names (CSV header or NDJSON keys) are the table's column names.
+Rows without an id get one from id_sequence; rows with one advance it. A
+file is read twice: a first pass finds its highest explicit id and moves
+the sequence past it, so an id handed out for one row can never be the
+explicit id of another row further down.
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import audit
+import db
+from db import get_pool
+from ids import SEQUENCES, allocator
+
+CHUNK_SIZE = int(os.environ.get("CLINIC_IMPORT_CHUNK", 1000))
+REPORT_REJECTS = 100
+
+# Same test as CHECK (email LIKE '%@%.%')
+EMAIL_PATTERN = re.compile(r"@.*\.", re.S)
+APPOINTMENT_STATUSES = ("scheduled", "completed", "cancelled")
+
+
+class Reject(Exception):
+    pass
+
+
+# ------- field parsers --------
+
+def _text(record, column, max_length, required=False):
+    value = (record.get(column) or "").strip()
+    if not value:
+        if required:
+            raise Reject("%s is required" % column)
+        return None
+    if len(value) > max_length:
+        raise Reject("%s is longer than %d characters" % (column, max_length))
+    return value
+
+
+def _int(record, column, required=False):
+    value = record.get(column)
+    if value is None or str(value).strip() == "":
+        if required:
+            raise Reject("%s is required" % column)
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Reject("%s is not an integer: %r" % (column, value))
+
+
+def _date(record, column):
+    value = (record.get(column) or "").strip()
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise Reject("%s is not a YYYY-MM-DD date: %r" % (column, value))
+
+
+def _datetime(record, column, required=False):
+    value = (record.get(column) or "").strip()
+    if not value:
+        if required:
+            raise Reject("%s is required" % column)
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise Reject("%s is not an ISO date and time: %r" % (column, value))
+
+
+# ------- row validation --------
+
+def patient_row(record):
+    email = _text(record, "email", 255)
+    if email is not None and not EMAIL_PATTERN.search(email):
+        raise Reject("email is not a valid address: %r" % email)
+    return (
+        _int(record, "patient_id"),
+        _text(record, "full_name", 150, required=True),
+        _date(record, "dob"),
+        email,
+        _text(record, "phone", 30),
+        _text(record, "address", 255),
+        _int(record, "plan_id"),
+    )
+
+
+def appointment_row(record):
+    starts_at = _datetime(record, "starts_at", required=True)
+    # trg_appt_before_insert requires an end time after the start
+    ends_at = _datetime(record, "ends_at", required=True)
+    if ends_at <= starts_at:
+        raise Reject("ends_at must be after starts_at")
+    status = (record.get("status") or "scheduled").strip().lower()
+    if status not in APPOINTMENT_STATUSES:
+        raise Reject("status must be one of %s" % ", ".join(APPOINTMENT_STATUSES))
+    return (
+        _int(record, "appt_id"),
+        _int(record, "patient_id", required=True),
+        _int(record, "doctor_id", required=True),
+        starts_at,
+        ends_at,
+        status,
+        _text(record, "reason", 255),
+    )
+
+
+# kind -> (sequence name, row builder, INSERT statement)
+KINDS = {
+    "patients": ("patient", patient_row, """
+        INSERT INTO patient (patient_id, full_name, dob, email, phone, address, plan_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """),
+    "appointments": ("appointment", appointment_row, """
+        INSERT INTO appointment (appt_id, patient_id, doctor_id, starts_at, ends_at, status, reason)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """),
+}
+
+
+# kind -> audit_log record of an inserted row, for CLINIC_AUDIT_MODE=app
+AUDIT_RECORDS = {
+    "appointments": lambda row: audit.appointment_inserted(row[0], row[1], row[2]),
+}
+
+
+# ------- readers --------
+
+def read_records(stream, fmt):
+    """Yield (line number, dict) from a text stream, one record at a time."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "ndjson":
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_num, Reject("invalid JSON: %s" % e)
+                continue
+            if not isinstance(record, dict):
+                yield line_num, Reject("expected a JSON object")
+                continue
+            # Values are parsed as text, as they would be from CSV.
+            yield line_num, {k: None if v is None else str(v) for k, v in record.items()}
+    else:
+        raise ValueError("unknown format %r" % fmt)
+
+
+def guess_format(filename, default="csv"):
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    return default
+
+
+# ------- import --------
+
+class ImportReport:
+    def __init__(self, on_reject=None):
+        self.inserted = 0
+        self.rejected = 0
+        self.rejects = []          # first REPORT_REJECTS (line, reason)
+        self.on_reject = on_reject
+
+    def reject(self, line_num, reason):
+        self.rejected += 1
+        if len(self.rejects) < REPORT_REJECTS:
+            self.rejects.append((line_num, reason))
+        if self.on_reject is not None:
+            self.on_reject(line_num, reason)
+
+    def as_dict(self):
+        return {
+            "inserted": self.inserted,
+            "rejected": self.rejected,
+            "rejects": [{"line": line, "reason": reason} for line, reason in self.rejects],
+        }
+
+
+def _flush(conn, sequence, insert_sql, chunk, report, audit_record=None, floor=0):
+    # The sequence goes past the chunk's explicit ids before ids are
+    # reserved for the rest of it. Returns the new floor.
+    highest = max((row[0] for _, row in chunk if row[0] is not None), default=None)
+    if highest is not None and highest >= floor:
+        floor = highest + 1
+        allocator.advance(sequence, floor)
+    missing = [i for i, (_, row) in enumerate(chunk) if row[0] is None]
+    if missing:
+        ids = iter(allocator.reserve(sequence, len(missing)))
+        for i in missing:
+            line_num, row = chunk[i]
+            chunk[i] = (line_num, (next(ids),) + row[1:])
+
+    cursor = conn.cursor()
+    inserted = []
+    try:
+        cursor.executemany(insert_sql, [row for _, row in chunk])
+        conn.commit()
+        inserted = [row for _, row in chunk]
+    except db.Error:
+        # Find the bad rows: a failed statement only undoes itself, so the
+        # good rows of the chunk still go in with one commit.
+        conn.rollback()
+        for line_num, row in chunk:
+            try:
+                cursor.execute(insert_sql, row)
+                inserted.append(row)
+            except db.Error as e:
+                report.reject(line_num, db.error_message(e))
+        conn.commit()
+    finally:
+        cursor.close()
+    report.inserted += len(inserted)
+    if audit.ENABLED and audit_record is not None:
+        audit.submit([audit_record(row) for row in inserted])
+    return floor
+
+
+def highest_id(kind, records):
+    """The largest well-formed explicit id in ``records``, or None."""
+    column = SEQUENCES[KINDS[kind][0]][1]
+    highest = None
+    for _, record in records:
+        if isinstance(record, Reject):
+            continue
+        try:
+            value = _int(record, column)
+        except Reject:
+            continue
+        if value is not None and (highest is None or value > highest):
+            highest = value
+    return highest
+
+
+def import_records(conn, kind, records, chunk_size=CHUNK_SIZE, on_reject=None, floor=0):
+    """Validate and insert ``records`` from read_records(); returns an ImportReport.
+
+    ``floor`` is where the sequence already stands when the caller moved it
+    past every explicit id in ``records`` (import_stream does); otherwise
+    each chunk moves it past its own, which only protects earlier rows."""
+    sequence, build_row, insert_sql = KINDS[kind]
+    audit_record = AUDIT_RECORDS.get(kind)
+    report = ImportReport(on_reject)
+    chunk = []
+
+    for line_num, record in records:
+        try:
+            if isinstance(record, Reject):
+                raise record
+            row = build_row(record)
+        except Reject as e:
+            report.reject(line_num, str(e))
+            continue
+        chunk.append((line_num, row))
+        if len(chunk) >= chunk_size:
+            floor = _flush(conn, sequence, insert_sql, chunk, report, audit_record, floor)
+            chunk = []
+    if chunk:
+        _flush(conn, sequence, insert_sql, chunk, report, audit_record, floor)
+    return report
+
+
+def import_stream(conn, kind, stream, fmt, chunk_size=CHUNK_SIZE, on_reject=None):
+    """Import from a binary stream (an upload or an open file). A stream
+    that cannot seek (stdin) is spooled to a temporary file for the two
+    passes."""
+    spool = None
+    if not stream.seekable():
+        spool = tempfile.TemporaryFile()
+        shutil.copyfileobj(stream, spool)
+        spool.seek(0)
+        stream = spool
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        start = text.tell()
+        floor = 0
+        highest = highest_id(kind, read_records(text, fmt))
+        if highest is not None:
+            floor = highest + 1
+            allocator.advance(KINDS[kind][0], floor)
+        text.seek(start)
+        return import_records(conn, kind, read_records(text, fmt), chunk_size, on_reject, floor)
+    finally:
+        text.detach()
+        if spool is not None:
+            spool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import patients or appointments from CSV or NDJSON.")
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="default: from the file extension, else csv")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows per insert and commit")
+    parser.add_argument("--rejects", help="write rejected rows (line, reason) to this CSV file")
+    args = parser.parse_args()
+
+    fmt = args.format or guess_format(args.path)
+    rejects_file = open(args.rejects, "w", newline="") if args.rejects else None
+    rejects_writer = csv.writer(rejects_file or sys.stderr)
+    if rejects_file:
+        rejects_writer.writerow(["line", "reason"])
+
+    def on_reject(line_num, reason):
+        rejects_writer.writerow([line_num, reason])
+
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    conn = get_pool().acquire()
+    try:
+        report = import_stream(conn, args.kind, stream, fmt, args.chunk, on_reject)
+    finally:
+        conn.close()
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        if rejects_file:
+            rejects_file.close()
+
+    print("%s: %d inserted, %d rejected" % (args.kind, report.inserted, report.rejected))
+    return 1 if report.rejected else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
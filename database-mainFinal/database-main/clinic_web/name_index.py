@@ -0,0 +1,233 @@
+import heapq
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+
+import refdata
+from db import get_connection
+from repository import get_repository
+
+# Trigram inverted index over patient and doctor names, kept in each worker.
+#
+# Names are folded (case, accents, whitespace) and indexed with a leading and
+# trailing space so word starts get their own grams. A query is answered from
+# the posting list of its rarest trigram, then every candidate is verified
+# against the folded name, so stale postings never leak into results.
+# Queries of one or two characters only match at the start of a word, as do
+# all queries in prefix mode (used by the typeahead endpoints).
+
+PATIENT_POLL_INTERVAL = float(os.environ.get("CLINIC_NAME_INDEX_POLL", 1.0))
+LOAD_BATCH = 10000
+
+
+def fold(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.casefold().split())
+
+
+def _grams(folded):
+    padded = " %s " % folded
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _rank(query, name):
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    if (" " + query) in (" " + name):
+        return 2
+    return 3
+
+
+class NameIndex:
+    def __init__(self):
+        self.names = {}
+        self.postings = defaultdict(lambda: array("i"))
+        self.stale = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, key, name):
+        folded = fold(name)
+        previous = self.names.get(key)
+        if previous == folded:
+            return
+        if previous is not None:
+            self.stale += 1
+        self.names[key] = folded
+        for gram in _grams(folded):
+            self.postings[gram].append(key)
+        if self.stale > 1000 and self.stale > len(self.names) // 5:
+            self.compact()
+
+    def remove(self, key):
+        if self.names.pop(key, None) is not None:
+            self.stale += 1
+
+    def compact(self):
+        names = self.names
+        self.names = {}
+        self.postings = defaultdict(lambda: array("i"))
+        self.stale = 0
+        for key, folded in names.items():
+            self.names[key] = folded
+            for gram in _grams(folded):
+                self.postings[gram].append(key)
+
+    def _candidates(self, query):
+        if len(query) >= 3:
+            grams = {query[i:i + 3] for i in range(len(query) - 2)}
+            lists = [self.postings.get(g) for g in grams]
+            if any(not p for p in lists):
+                return ()
+            return min(lists, key=len)
+        prefix = " " + query
+        if len(prefix) == 3:
+            return self.postings.get(prefix, ())
+        seen = set()
+        for gram, keys in list(self.postings.items()):
+            if gram.startswith(prefix):
+                seen.update(keys)
+        return seen
+
+    def search(self, term, limit=50, prefix=False):
+        query = fold(term)
+        if not query:
+            return []
+        short = prefix or len(query) < 3
+        matches = {}
+        for key in self._candidates(query):
+            if key in matches:
+                continue
+            name = self.names.get(key)
+            if name is None:
+                continue
+            if short:
+                if (" " + query) not in (" " + name):
+                    continue
+            elif query not in name:
+                continue
+            matches[key] = (_rank(query, name), len(name), name, key)
+        return [m[3] for m in heapq.nsmallest(limit, matches.values())]
+
+
+class PatientNameIndex:
+    """Warmed from ``patient`` and kept current from ``patient_change_log``."""
+
+    def __init__(self):
+        self.index = NameIndex()
+        self.loaded = False
+        self.last_change_id = 0
+        self.last_poll = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+        # Take the change-log position first so changes made while the
+        # table is being read are replayed afterwards.
+        cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM patient_change_log")
+        self.last_change_id = cursor.fetchone()[0]
+        cursor.execute("SELECT patient_id, full_name FROM patient")
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH)
+            if not rows:
+                break
+            for patient_id, full_name in rows:
+                self.index.add(patient_id, full_name)
+        cursor.close()
+        self.loaded = True
+
+    def _catch_up(self, conn):
+        cursor = conn.cursor()
+        # change_log.py prunes old rows but keeps the newest; if the oldest
+        # row left is past our position, changes we never saw are gone.
+        cursor.execute("SELECT MIN(change_id) FROM patient_change_log")
+        oldest = cursor.fetchone()[0]
+        if oldest is not None and oldest > self.last_change_id + 1:
+            self.index = NameIndex()
+            self._load(conn)
+        cursor.execute("""
+            SELECT c.change_id, c.patient_id, p.full_name
+            FROM patient_change_log c
+            LEFT JOIN patient p ON p.patient_id = c.patient_id
+            WHERE c.change_id > %s
+            ORDER BY c.change_id
+        """, (self.last_change_id,))
+        for change_id, patient_id, full_name in cursor.fetchall():
+            if full_name is None:
+                self.index.remove(patient_id)
+            else:
+                self.index.add(patient_id, full_name)
+            self.last_change_id = change_id
+        cursor.close()
+
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.loaded and now - self.last_poll < PATIENT_POLL_INTERVAL:
+                return
+            conn = get_connection()
+            if not self.loaded:
+                self._load(conn)
+            self._catch_up(conn)
+            self.last_poll = now
+
+    def search(self, term, limit=50, prefix=False):
+        self.refresh()
+        with self._lock:
+            return self.index.search(term, limit, prefix)
+
+    def added(self, patient_id, full_name):
+        with self._lock:
+            if self.loaded:
+                self.index.add(patient_id, full_name)
+
+    def removed(self, patient_id):
+        with self._lock:
+            self.index.remove(patient_id)
+
+
+class DoctorNameIndex:
+    """Doctors are few and rarely change, so the index is simply rebuilt
+    whenever refdata hands back a new doctor list."""
+
+    def __init__(self):
+        self.index = NameIndex()
+        self.display = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        display = refdata.cache.get(get_repository(), "doctors")
+        with self._lock:
+            if display is self.display:
+                return
+            index = NameIndex()
+            for doctor_id, full_name in display.items():
+                index.add(doctor_id, full_name)
+            self.index = index
+            self.display = display
+
+    def search(self, term, limit=50, prefix=False):
+        self.refresh()
+        with self._lock:
+            return self.index.search(term, limit, prefix)
+
+    def suggest(self, term, limit=10):
+        # Served entirely from the cached list: (doctor_id, full_name) pairs.
+        self.refresh()
+        with self._lock:
+            if term.strip():
+                ids = self.index.search(term, limit, prefix=True)
+            else:
+                ids = sorted(self.display, key=lambda k: fold(self.display[k]))[:limit]
+            return [(k, self.display[k]) for k in ids]
+
+
+patients = PatientNameIndex()
+doctors = DoctorNameIndex()
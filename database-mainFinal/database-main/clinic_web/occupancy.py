@@ -0,0 +1,243 @@
+"""Room occupancy over a date window.
+
+For every (room, day) the engine keeps the room's busy time that day as
+sorted, non-overlapping intervals. They are built from appointment_room +
+appointment in one range query per window: each room's bookings are
+sorted by start and coalesced with a sweep line (slots.merge_busy), since
+rooms, unlike doctors, may hold overlapping bookings, and the merged
+intervals are then cut at midnight. Occupancy by day and by hour of day,
+the free/busy calendar and "available now" are all read off those
+intervals, clipped to opening hours (slots.DEFAULT_DAY_START/END).
+Cancelled appointments do not occupy a room.
+
+Cached days are tagged with their room's version: the highest change_id
+row_change_log holds for that room, which the triggers bump on every
+appointment_room insert/delete and every appointment update (times,
+status) of a booked appointment. Each read first checks the newest room
+change_id; only when it moved are the per-room versions read again, and a
+room whose version moved has all its days reloaded. Other workers' writes
+are therefore seen on the next read, with no TTL.
+
+The window query is an index range on appointment.starts_at; bookings
+starting more than LOOKBACK before the window are not looked at, so a
+booking longer than that only counts from the window it starts in.
+"""
+import bisect
+import datetime
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+import refdata
+import slots
+
+LOOKBACK = datetime.timedelta(hours=int(os.environ.get("CLINIC_OCCUPANCY_LOOKBACK_HOURS", 24)))
+MAX_CACHED_DAYS = int(os.environ.get("CLINIC_OCCUPANCY_CACHE_DAYS", 20000))
+MAX_WINDOW_DAYS = 62
+HOUR = datetime.timedelta(hours=1)
+
+
+def midnight(day):
+    return datetime.datetime.combine(day, datetime.time())
+
+
+def days_between(start_day, end_day):
+    """Days in [start_day, end_day)."""
+    return [start_day + datetime.timedelta(days=n) for n in range((end_day - start_day).days)]
+
+
+def week_of(day):
+    """Monday of ``day``'s week."""
+    return day - datetime.timedelta(days=day.weekday())
+
+
+class OccupancyCache:
+    def __init__(self, max_days=MAX_CACHED_DAYS):
+        self.max_days = max_days
+        self.days = OrderedDict()   # (room_id, day) -> (version, busy intervals)
+        self.versions = {}          # room_id -> version of its cached days
+        self.latest = None          # newest room change_id seen
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _sync(self, repo):
+        latest = repo.room_version()
+        with self._lock:
+            if self.pid != os.getpid():
+                self.days.clear()
+                self.versions = {}
+                self.latest = None
+                self.pid = os.getpid()
+            if latest == self.latest:
+                return dict(self.versions)
+        versions = dict(repo.room_versions())
+        with self._lock:
+            self.versions = versions
+            self.latest = latest
+            return dict(versions)
+
+    def _load(self, repo, room_ids, days):
+        start, end = midnight(days[0]), midnight(days[-1] + datetime.timedelta(days=1))
+        found = {(room_id, day): [] for room_id in room_ids for day in days}
+        bookings = defaultdict(list)
+        for room_id, starts_at, ends_at in repo.room_bookings(start, end, start - LOOKBACK):
+            if room_id in room_ids:
+                # Clipping keeps the list sorted by start.
+                bookings[room_id].append((max(starts_at, start), min(ends_at, end)))
+        for room_id, intervals in bookings.items():
+            for busy_start, busy_end in slots.merge_busy(intervals):
+                while busy_start < busy_end:
+                    piece_end = min(busy_end, midnight(busy_start.date() + datetime.timedelta(days=1)))
+                    found[(room_id, busy_start.date())].append((busy_start, piece_end))
+                    busy_start = piece_end
+        return found
+
+    def busy(self, repo, start_day, end_day, room_ids=None):
+        """{room_id: {day: [(start, end)]}} for the days in [start_day, end_day)."""
+        if room_ids is None:
+            room_ids = list(refdata.cache.get(repo, "rooms"))
+        days = days_between(start_day, end_day)
+        versions = self._sync(repo)
+        result = {room_id: {} for room_id in room_ids}
+        missing = set()
+        with self._lock:
+            for room_id in room_ids:
+                for day in days:
+                    entry = self.days.get((room_id, day))
+                    if entry is not None and entry[0] == versions.get(room_id):
+                        self.days.move_to_end((room_id, day))
+                        result[room_id][day] = entry[1]
+                        self.hits += 1
+                    else:
+                        missing.add(room_id)
+        if missing and days:
+            loaded = self._load(repo, missing, days)
+            with self._lock:
+                self.misses += len(loaded)
+                for (room_id, day), intervals in loaded.items():
+                    result[room_id][day] = intervals
+                    # Loaded under ``versions``; a change that raced with the
+                    # load has moved the room's version, so the next read
+                    # ignores these entries.
+                    self.days[(room_id, day)] = (versions.get(room_id), intervals)
+                    self.days.move_to_end((room_id, day))
+                while len(self.days) > self.max_days:
+                    self.days.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"days": len(self.days), "rooms": len(self.versions), "hits": self.hits,
+                    "misses": self.misses, "latest_change_id": self.latest}
+
+
+cache = OccupancyCache()
+
+
+# ------- reading the intervals --------
+
+def _overlap(intervals, start, end):
+    total = datetime.timedelta(0)
+    for busy_start, busy_end in intervals:
+        if busy_start >= end:
+            break
+        if busy_end > start:
+            total += min(busy_end, end) - max(busy_start, start)
+    return total
+
+
+def _percent(part, whole):
+    return round(part / whole * 100, 1) if whole else 0.0
+
+
+def opening_hours(day, day_start=slots.DEFAULT_DAY_START, day_end=slots.DEFAULT_DAY_END):
+    return datetime.datetime.combine(day, day_start), datetime.datetime.combine(day, day_end)
+
+
+def day_percent(intervals, day):
+    """Share of the day's opening hours the room is busy."""
+    opens, closes = opening_hours(day)
+    return _percent(_overlap(intervals, opens, closes), closes - opens)
+
+
+def hourly_percent(by_day):
+    """[(hour, percent)] for each opening hour, averaged over the days."""
+    if not by_day:
+        return []
+    opens, closes = opening_hours(datetime.date.min)
+    hours = []
+    moment = opens
+    while moment < closes:
+        busy = sum((_overlap(intervals, *_shift(moment, day)) for day, intervals in by_day.items()),
+                   datetime.timedelta(0))
+        hours.append((moment.hour, _percent(busy, HOUR * len(by_day))))
+        moment += HOUR
+    return hours
+
+
+def _shift(moment, day):
+    # The hour starting at ``moment``'s time of day on ``day``.
+    start = datetime.datetime.combine(day, moment.time())
+    return start, start + HOUR
+
+
+def calendar(intervals, day):
+    """[(start, end, busy)] covering the day's opening hours."""
+    opens, closes = opening_hours(day)
+    segments = []
+    cursor = opens
+    for busy_start, busy_end in intervals:
+        busy_start, busy_end = max(busy_start, opens), min(busy_end, closes)
+        if busy_start >= busy_end:
+            continue
+        if busy_start > cursor:
+            segments.append((cursor, busy_start, False))
+        segments.append((busy_start, busy_end, True))
+        cursor = busy_end
+    if cursor < closes:
+        segments.append((cursor, closes, False))
+    return segments
+
+
+def report(repo, start_day, end_day, room_ids=None):
+    """{room_id: {"percent", "days": {day: percent}, "hours": [(hour, percent)],
+    "calendar": {day: segments}}} for the window."""
+    busy = cache.busy(repo, start_day, end_day, room_ids)
+    result = {}
+    for room_id, by_day in busy.items():
+        opened = sum((opening_hours(day)[1] - opening_hours(day)[0] for day in by_day),
+                     datetime.timedelta(0))
+        used = sum((_overlap(intervals, *opening_hours(day)) for day, intervals in by_day.items()),
+                   datetime.timedelta(0))
+        result[room_id] = {
+            "percent": _percent(used, opened),
+            "days": {day: day_percent(intervals, day) for day, intervals in sorted(by_day.items())},
+            "hours": hourly_percent(by_day),
+            "calendar": {day: calendar(intervals, day) for day, intervals in sorted(by_day.items())},
+        }
+    return result
+
+
+def available_now(repo, now=None, room_ids=None):
+    """{room_id: None if free at ``now``, else when it frees up}."""
+    now = now or datetime.datetime.now()
+    today = now.date()
+    busy = cache.busy(repo, today, today + datetime.timedelta(days=2), room_ids)
+    result = {}
+    for room_id, by_day in busy.items():
+        # Today's and tomorrow's intervals in order; a booking running past
+        # midnight is two pieces that touch.
+        intervals = by_day.get(today, []) + by_day.get(today + datetime.timedelta(days=1), [])
+        pos = bisect.bisect_right(intervals, (now, datetime.datetime.max)) - 1
+        if pos < 0 or intervals[pos][1] <= now:
+            result[room_id] = None
+            continue
+        free_at = intervals[pos][1]
+        for start, end in intervals[pos + 1:]:
+            if start > free_at:
+                break
+            free_at = max(free_at, end)
+        result[room_id] = free_at
+    return result
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import datetime
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Page:
+    def __init__(self, rows, next_token=None, prev_token=None, limit=DEFAULT_PAGE_SIZE):
+        self.rows = rows
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.limit = limit
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return datetime.date.fromisoformat(value["d"])
+        raise ValueError("Unknown cursor value")
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, width):
+    # Tampered or stale tokens fall back to the first page instead of erroring.
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [_decode_value(v) for v in json.loads(raw)]
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if len(values) != width:
+        return None
+    return values
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _seek_predicate(columns, op):
+    # (a, b) < (x, y) expanded as  a <= x AND (a < x OR b < y)  so MySQL can
+    # use a range scan on the leading column of the composite index.
+    if len(columns) == 1:
+        return "%s %s %%s" % (columns[0], op)
+    rest = _seek_predicate(columns[1:], op)
+    return "%s %s= %%s AND (%s %s %%s OR (%s = %%s AND %s))" % (
+        columns[0], op, columns[0], op, columns[0], rest)
+
+
+def _seek_params(values):
+    if len(values) == 1:
+        return [values[0]]
+    return [values[0], values[0], values[0]] + _seek_params(values[1:])
+
+
+def fetch_page(cursor, select_sql, columns, key_index, where=None, params=(),
+               descending=True, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """Run a keyset-paginated query.
+
+    ``select_sql`` is the SELECT ... FROM ... JOIN part, ``columns`` the
+    ordering key (which must be unique as a whole) and ``key_index`` the
+    positions of those columns in each result row.  ``after``/``before`` are
+    tokens produced by a previous page.
+    """
+    where = list(where or [])
+    params = list(params)
+
+    after_values = decode_cursor(after, len(columns))
+    before_values = None if after_values else decode_cursor(before, len(columns))
+    backwards = before_values is not None
+    seek_values = after_values or before_values
+
+    # Walking backwards flips both the comparison and the sort order; the
+    # rows are reversed again below so templates always see the same order.
+    ascending = descending == backwards
+    if seek_values:
+        predicate = _seek_predicate(columns, ">" if ascending else "<")
+        where.append("(%s)" % predicate)
+        params.extend(_seek_params(seek_values))
+
+    sql = select_sql
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    direction = "ASC" if ascending else "DESC"
+    sql += " ORDER BY " + ", ".join("%s %s" % (c, direction) for c in columns)
+    sql += " LIMIT %s"
+    params.append(limit + 1)
+
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if backwards:
+        rows.reverse()
+
+    def key(row):
+        return encode_cursor([row[i] for i in key_index])
+
+    next_token = prev_token = None
+    if rows:
+        if backwards:
+            next_token = key(rows[-1])
+            prev_token = key(rows[0]) if has_more else None
+        else:
+            next_token = key(rows[-1]) if has_more else None
+            prev_token = key(rows[0]) if seek_values else None
+
+    return Page(rows, next_token, prev_token, limit)
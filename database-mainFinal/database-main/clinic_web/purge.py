@@ -0,0 +1,246 @@
+"""Archive or purge old appointments with everything that hangs off them.
+
+    python purge.py run --status cancelled --older-than-years 3
+    python purge.py run --before 2020-01-01 --purge-only --chunk 200
+    python purge.py resume                  # continue interrupted jobs
+    python purge.py jobs                    # list jobs and their progress
+
+A run is a purge_job row. It walks the matching appointments in
+(starts_at, appt_id) order, a chunk per transaction: the chunk's
+appointments are write-locked, their lab results, lab tests, prescriptions,
+bills, room assignments and the appointments themselves are copied to the
+*_archive tables (skipped with --purge-only) and deleted with one statement
+per table, and the job's position is saved before the commit. A job that
+is interrupted, killed or loses its connection therefore resumes after
+its last committed chunk; a chunk is either fully moved or not at all.
+SIGINT/SIGTERM stop the job after the chunk in progress.
+
+The per-row audit triggers are switched off for the job's connection (as
+in CLINIC_AUDIT_MODE=app); each chunk writes one audit_log row instead,
+entity_name 'purge_job'. The other triggers still run, so the billing
+summaries, revenue rollups, work queues and change logs stay correct.
+
+Throttling, to bound lock time and replication lag:
+  * chunks shrink (halving, down to MIN_CHUNK) while one takes longer
+    than --target-seconds, and grow back up to --chunk;
+  * after each chunk the job sleeps so that it holds locks at most
+    --max-duty of the time (and at least --pause seconds);
+  * with CLINIC_REPLICA_HOST set (MySQL), it also waits while the
+    replica reports more than --max-lag seconds behind.
+"""
+import argparse
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+
+import mysql.connector
+
+import db
+from repository import get_repository
+
+CHUNK = int(os.environ.get("CLINIC_PURGE_CHUNK", 500))
+MIN_CHUNK = 10
+TARGET_SECONDS = float(os.environ.get("CLINIC_PURGE_TARGET_SECONDS", 1.0))
+MAX_DUTY = float(os.environ.get("CLINIC_PURGE_MAX_DUTY", 0.5))
+PAUSE = float(os.environ.get("CLINIC_PURGE_PAUSE", 0.0))
+MAX_LAG = float(os.environ.get("CLINIC_PURGE_MAX_LAG", 5.0))
+REPLICA_HOST = os.environ.get("CLINIC_REPLICA_HOST")
+LAG_POLL = 1.0
+
+
+# ------- throttling --------
+
+class Throttle:
+    def __init__(self, chunk=CHUNK, target_seconds=TARGET_SECONDS, max_duty=MAX_DUTY,
+                 pause=PAUSE, max_lag=MAX_LAG, stop=None):
+        self.max_chunk = chunk
+        self.chunk = chunk
+        self.target_seconds = target_seconds
+        self.max_duty = max_duty
+        self.pause = pause
+        self.max_lag = max_lag
+        self.stop = stop or threading.Event()
+        self._replica = None
+
+    def replica_lag(self):
+        """Seconds the replica is behind, or None when there is none to ask."""
+        if not REPLICA_HOST or db.BACKEND != "mysql":
+            return None
+        try:
+            if self._replica is None:
+                self._replica = mysql.connector.connect(**dict(db.DB_CONFIG, host=REPLICA_HOST))
+            cursor = self._replica.cursor(dictionary=True)
+            cursor.execute("SHOW REPLICA STATUS")
+            row = cursor.fetchone()
+            cursor.close()
+        except db.Error:
+            self._replica = None
+            return None
+        if not row:
+            return None
+        return row.get("Seconds_Behind_Source")
+
+    def after_chunk(self, seconds):
+        if seconds > self.target_seconds:
+            self.chunk = max(MIN_CHUNK, self.chunk // 2)
+        elif seconds < self.target_seconds / 4:
+            self.chunk = min(self.max_chunk, self.chunk * 2)
+        rest = max(self.pause, seconds * (1 - self.max_duty) / self.max_duty if self.max_duty < 1 else 0)
+        if self.stop.wait(rest):
+            return
+        while True:
+            lag = self.replica_lag()
+            # NULL means replication is stopped; wait for it as well.
+            if self._replica is None or (lag is not None and lag <= self.max_lag):
+                return
+            if self.stop.wait(LAG_POLL):
+                return
+
+
+# ------- jobs --------
+
+def _details(ids, first, last, removed):
+    return "%d appointments %s .. %s: %s" % (
+        len(ids), first, last, ", ".join("%s %d" % (table, count) for table, count in removed.items()))
+
+
+def run_job(repo, job, throttle, max_chunks=None, report=None):
+    """Move the job's remaining chunks; True once it is done, False if
+    stopped (throttle.stop or max_chunks) before that."""
+    job_id, status, before, archive = job[0], job[1], job[2], bool(job[3])
+    after = (job[5], job[6]) if job[6] is not None else None
+    db.set_trigger_audit(repo.conn, False)
+    try:
+        chunks = 0
+        while not throttle.stop.is_set() and (max_chunks is None or chunks < max_chunks):
+            started = time.monotonic()
+            rows = repo.purge_candidates(status, before, after, throttle.chunk)
+            if not rows:
+                repo.save_purge_progress(job_id, after, 0, 0, done=True)
+                repo.commit()
+                return True
+            ids = [appt_id for appt_id, _ in rows]
+            removed = repo.delete_appointments(ids, job_id if archive else None)
+            last = (rows[-1][1], rows[-1][0])
+            repo.log_purge_chunk(job_id, "ARCHIVE" if archive else "PURGE",
+                                 _details(ids, rows[0][1], rows[-1][1], removed))
+            repo.save_purge_progress(job_id, last, len(ids), sum(removed.values()))
+            repo.commit()
+            after = last
+            chunks += 1
+            seconds = time.monotonic() - started
+            if report:
+                report(job_id, len(ids), removed, seconds)
+            throttle.after_chunk(seconds)
+        return False
+    except BaseException:
+        repo.rollback()
+        raise
+    finally:
+        db.set_trigger_audit(repo.conn, db.AUDIT_MODE != "app")
+
+
+def start_job(repo, status, before, archive):
+    job_id = repo.create_purge_job(status, before, archive)
+    repo.commit()
+    return repo.purge_job(job_id)
+
+
+# ------- CLI --------
+
+def _cutoff(args):
+    if args.before:
+        return datetime.datetime.combine(datetime.date.fromisoformat(args.before), datetime.time())
+    today = datetime.date.today()
+    try:
+        day = today.replace(year=today.year - args.older_than_years)
+    except ValueError:      # 29 February
+        day = today.replace(year=today.year - args.older_than_years, day=28)
+    return datetime.datetime.combine(day, datetime.time())
+
+
+def _print_job(job):
+    job_id, status, before, archive, state, last_starts_at, _, appointments, rows, started, updated = job
+    print("job %d  %-8s %s appointments%s before %s: %d appointments, %d rows; last %s; updated %s"
+          % (job_id, state, "archive" if archive else "purge",
+             " (%s)" % status if status else "", before, appointments, rows,
+             last_starts_at or "-", updated or started))
+
+
+def _report(job_id, count, removed, seconds):
+    print("job %d: %d appointments, %d rows in %.2fs" % (job_id, count, sum(removed.values()), seconds),
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive or purge old appointments in chunks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="start a new job")
+    run.add_argument("--status", help="only appointments with this status (e.g. cancelled)")
+    when = run.add_mutually_exclusive_group(required=True)
+    when.add_argument("--older-than-years", type=int)
+    when.add_argument("--before", help="appointments starting before this day, YYYY-MM-DD")
+    run.add_argument("--purge-only", action="store_true", help="delete without archiving")
+
+    resume = commands.add_parser("resume", help="continue unfinished jobs")
+    resume.add_argument("--job", type=int, help="only this job")
+
+    for command in (run, resume):
+        command.add_argument("--chunk", type=int, default=CHUNK, help="appointments per transaction, at most")
+        command.add_argument("--target-seconds", type=float, default=TARGET_SECONDS)
+        command.add_argument("--max-duty", type=float, default=MAX_DUTY)
+        command.add_argument("--pause", type=float, default=PAUSE)
+        command.add_argument("--max-lag", type=float, default=MAX_LAG)
+        command.add_argument("--max-chunks", type=int, help="stop after this many chunks")
+
+    commands.add_parser("jobs", help="list jobs")
+    args = parser.parse_args()
+    if args.command != "jobs" and not 0 < args.max_duty <= 1:
+        parser.error("--max-duty must be in (0, 1]")
+
+    repo = get_repository(db.get_pool().acquire())
+    try:
+        if args.command == "jobs":
+            for job in repo.purge_jobs():
+                _print_job(job)
+            return 0
+
+        if args.command == "run":
+            try:
+                before = _cutoff(args)
+            except ValueError as e:
+                parser.error(str(e))
+            jobs = [start_job(repo, args.status, before, not args.purge_only)]
+        else:
+            jobs = repo.purge_jobs("running")
+            repo.rollback()
+            if args.job is not None:
+                jobs = [job for job in jobs if job[0] == args.job]
+            if not jobs:
+                print("no unfinished jobs")
+                return 0
+
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        throttle = Throttle(args.chunk, args.target_seconds, args.max_duty, args.pause,
+                            args.max_lag, stop)
+        for job in jobs:
+            done = run_job(repo, job, throttle, args.max_chunks, _report)
+            _print_job(repo.purge_job(job[0]))
+            repo.rollback()
+            if not done:
+                print("job %d stopped; continue it with: python purge.py resume --job %d"
+                      % (job[0], job[0]))
+                return 1
+        return 0
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+# Per-worker cache of reference data: doctor names, rooms, the medication
+# catalog and medication forms.
+#
+# Every dataset belongs to an entity whose change counter lives in
+# entity_version; triggers on doctor, clinic_room and the medication tables
+# bump it on any write, whoever makes it. A cached dataset is served while
+# its entity's version is unchanged. The versions themselves are one tiny
+# query, re-read at most every POLL_INTERVAL seconds, so changes from other
+# workers or from outside the app show up within that interval. This
+# worker's own writes call changed() after committing and are visible on the
+# very next read.
+
+POLL_INTERVAL = float(os.environ.get("CLINIC_REFDATA_POLL", 1.0))
+
+
+def _doctors(repo):
+    return dict(repo.load_doctors())
+
+
+def _rooms(repo):
+    return {row[0]: row for row in repo.load_rooms()}
+
+
+def _medication_forms(repo):
+    return dict(repo.load_medication_forms())
+
+
+def _medication_info(repo):
+    # med_id -> (med_name, strength, variant_id) of its first variant
+    info = {}
+    for med_id, med_name, strength, variant_id in repo.load_medication_variants():
+        if med_id not in info or info[med_id][2] is None:
+            info[med_id] = (med_name, strength, variant_id)
+    return info
+
+
+# dataset -> (entity, loader taking a repository)
+DATASETS = {
+    "doctors": ("doctor", _doctors),
+    "rooms": ("room", _rooms),
+    "medications": ("medication", lambda repo: repo.load_medication_catalog()),
+    "medication_forms": ("medication", _medication_forms),
+    "medication_info": ("medication", _medication_info),
+}
+
+
+class ReferenceCache:
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._versions = {}
+        self._checked_at = None
+        self._entries = {}        # dataset -> (version, value)
+        self._hits = 0
+        self._loads = 0
+        self._lock = threading.Lock()
+
+    def _current_versions(self, repo):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.poll_interval:
+            self._versions = dict(repo.entity_versions())
+            self._checked_at = now
+        return self._versions
+
+    def versions(self, repo):
+        with self._lock:
+            return dict(self._current_versions(repo))
+
+    def get(self, repo, dataset, require=()):
+        """Cached ``dataset``; reloaded if its entity moved on, or if any key
+        in ``require`` is missing (e.g. a doctor added moments ago)."""
+        entity, loader = DATASETS[dataset]
+        with self._lock:
+            version = self._current_versions(repo).get(entity, 0)
+            entry = self._entries.get(dataset)
+            if entry is not None and entry[0] == version and all(k in entry[1] for k in require):
+                self._hits += 1
+                return entry[1]
+            value = loader(repo)
+            self._entries[dataset] = (version, value)
+            self._loads += 1
+            return value
+
+    def changed(self, entity):
+        # The trigger has already bumped the stored version; dropping the
+        # local copy just skips waiting for the next poll.
+        with self._lock:
+            for dataset, (owner, _) in DATASETS.items():
+                if owner == entity:
+                    self._entries.pop(dataset, None)
+            self._checked_at = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "versions": dict(self._versions),
+                "cached": sorted(self._entries),
+                "hits": self._hits,
+                "loads": self._loads,
+            }
+
+
+cache = ReferenceCache()
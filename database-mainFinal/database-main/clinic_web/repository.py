@@ -0,0 +1,970 @@
+import abc
+import datetime
+
+import audit
+import billing_summary
+import db
+import occupancy
+import refdata
+import revenue_rollup
+import work_queue
+from db import get_connection
+from pagination import fetch_page, page_size
+
+# Data access for the web routes.
+#
+# Routes ask get_repository() for a Repository bound to the request's
+# connection and call its methods instead of writing SQL inline. The SQL in
+# Repository is portable between MySQL and the embedded SQLite engine
+# (sqlite_backend.py); the two subclasses hold what is not: row locking,
+# hi/lo id reservation and per-session settings, and they are the place to
+# tune a statement for one engine's planner without touching the other.
+#
+# Methods never commit on their own; the route decides with commit() or
+# rollback(), exactly as it did with the raw connection.
+#
+# With CLINIC_AUDIT_MODE=app the write methods also collect the audit_log
+# records the triggers would have written (reading the old values first
+# where a trigger would use OLD); commit() hands them to audit.py.
+#
+# Doctor names, rooms and the medication catalog come from refdata.cache,
+# so list queries select doctor_id and the name is filled in afterwards
+# instead of joining doctor on every row.
+
+# Rows that hang off an appointment, children first: (table, columns,
+# condition). "{ids}" stands for the placeholders of the appt_id list.
+# delete_appointments() runs one statement per table for a whole list.
+APPOINTMENT_CASCADE = [
+    ("lab_test_result", "result_id, test_id, result_detail",
+     "test_id IN (SELECT test_id FROM lab_test WHERE appt_id IN ({ids}))"),
+    ("lab_test", "test_id, appt_id, test_name, status, test_date", "appt_id IN ({ids})"),
+    ("prescription", "rx_id, appt_id, variant_id, dosage, route, frequency, instructions, quantity",
+     "appt_id IN ({ids})"),
+    ("billing", "bill_id, appt_id, amount, payment_status, payment_method, billing_date",
+     "appt_id IN ({ids})"),
+    ("appointment_room", "appt_id, room_id", "appt_id IN ({ids})"),
+    ("appointment", "appt_id, patient_id, doctor_id, starts_at, ends_at, status, reason",
+     "appt_id IN ({ids})"),
+]
+
+
+class Repository(abc.ABC):
+    dialect = None
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.audit = []     # records waiting for commit()
+
+    # ------- plumbing --------
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def _all(self, sql, params=None):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def _one(self, sql, params=None):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        cursor.fetchall()
+        cursor.close()
+        return row
+
+    def _run(self, sql, params=None):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def _page(self, sql, limit=None, **kwargs):
+        cursor = self.conn.cursor()
+        page = fetch_page(cursor, sql, limit=page_size(limit), **kwargs)
+        cursor.close()
+        return page
+
+    def _doctor_names(self, rows, index):
+        # Replace the doctor_id at ``index`` with the cached name.
+        names = refdata.cache.get(self, "doctors", require={row[index] for row in rows})
+        return [row[:index] + (names.get(row[index], "Unknown"),) + row[index + 1:]
+                for row in rows]
+
+    def commit(self):
+        self.conn.commit()
+        if self.audit:
+            audit.submit(self.audit)
+            self.audit = []
+
+    def rollback(self):
+        self.conn.rollback()
+        self.audit = []
+
+    def close(self):
+        self.conn.close()
+
+    # ------- dialect hooks --------
+
+    @abc.abstractmethod
+    def lock_row(self, table, column, key):
+        """Hold a write lock covering ``table.column = key`` until commit."""
+
+    @abc.abstractmethod
+    def appointment_times(self, appt_id, lock=False):
+        """(starts_at, ends_at) of an appointment, share-locked if ``lock``."""
+
+    @abc.abstractmethod
+    def reserve_ids(self, name, count, table, column, offset):
+        """Move sequence ``name`` on by ``count``; returns the new next_id."""
+
+    @abc.abstractmethod
+    def advance_sequence(self, name, floor):
+        """Move sequence ``name`` up to ``floor`` unless it is already past it."""
+
+    def begin_export(self, write_timeout):
+        pass
+
+    def end_export(self):
+        pass
+
+    def audit_partitions(self):
+        """[(name, lower, upper)] bounds of audit_log's range partitions."""
+        return []
+
+    def add_audit_partitions(self, months):
+        """Partitions for the given first-of-month dates; returns those added."""
+        return []
+
+    @abc.abstractmethod
+    def _delete_audit_chunk(self, start, end, max_log_id, chunk):
+        """Delete up to ``chunk`` audit_log rows of [start, end) with
+        log_id <= max_log_id; returns how many went."""
+
+    @abc.abstractmethod
+    def _compact_row_changes(self, low, high):
+        """Delete the row_change_log rows in change_id [low, high] that a
+        newer row for the same (entity, entity_id) supersedes."""
+
+    @abc.abstractmethod
+    def purge_candidates(self, status, before, after, limit):
+        """Write-lock and return the next ``limit`` (appt_id, starts_at) of
+        appointments starting before ``before`` (with ``status`` unless
+        None), in (starts_at, appt_id) order after position ``after``."""
+
+    # ------- reference data loaders (see refdata.py) --------
+
+    def entity_versions(self):
+        return self._all("SELECT entity, version FROM entity_version")
+
+    def load_doctors(self):
+        return self._all("SELECT doctor_id, full_name FROM doctor")
+
+    def load_rooms(self):
+        return self._all("SELECT room_id, room_name, room_type, notes FROM clinic_room ORDER BY room_id")
+
+    def load_medication_forms(self):
+        return self._all("SELECT form_name, form_id FROM medication_form")
+
+    def load_medication_variants(self):
+        return self._all("""
+            SELECT m.med_id, m.med_name, mv.strength, mv.variant_id
+            FROM medication m
+            LEFT JOIN medication_variant mv ON mv.med_id = m.med_id
+            ORDER BY m.med_id, mv.variant_id
+        """)
+
+    # ------- row versions (row_change_log, see httpcache.py) --------
+
+    def bill_version(self, bill_id):
+        # The bill, its appointment and its patient; None if the bill is gone.
+        return self._one("""
+            SELECT (SELECT MAX(change_id) FROM row_change_log
+                    WHERE entity = 'billing' AND entity_id = b.bill_id),
+                   (SELECT MAX(change_id) FROM row_change_log
+                    WHERE entity = 'appointment' AND entity_id = b.appt_id),
+                   (SELECT MAX(change_id) FROM row_change_log
+                    WHERE entity = 'patient' AND entity_id = a.patient_id)
+            FROM billing b
+            JOIN appointment a ON a.appt_id = b.appt_id
+            WHERE b.bill_id = %s
+        """, (bill_id,))
+
+    def room_version(self, room_id=None):
+        # One room's schedule, or (room_id=None) the assignments of all rooms.
+        if room_id is None:
+            return self._one("SELECT MAX(change_id) FROM row_change_log WHERE entity = 'room'")[0]
+        return self._one("""
+            SELECT MAX(change_id) FROM row_change_log WHERE entity = 'room' AND entity_id = %s
+        """, (room_id,))[0]
+
+    def room_versions(self):
+        # (room_id, version) for every room with logged changes
+        return self._all("""
+            SELECT entity_id, MAX(change_id) FROM row_change_log
+            WHERE entity = 'room'
+            GROUP BY entity_id
+        """)
+
+    def load_medication_catalog(self):
+        return self._all("""
+            SELECT m.med_id, m.med_name, mf.form_name, mv.strength, m.notes
+            FROM medication m
+            LEFT JOIN medication_variant mv ON mv.med_id = m.med_id
+            LEFT JOIN medication_form mf ON mf.form_id = mv.form_id
+            ORDER BY m.med_name
+        """)
+
+    # ------- patients --------
+
+    def patients_page(self, after=None, before=None, limit=None):
+        return self._page(
+            "SELECT patient_id, full_name, email, phone FROM patient",
+            columns=["patient_id"], key_index=[0], descending=False,
+            after=after, before=before, limit=limit)
+
+    def add_patient(self, patient_id, full_name, email, phone):
+        self._run("""
+            INSERT INTO patient (patient_id, full_name, email, phone)
+            VALUES (%s, %s, %s, %s)
+        """, (patient_id, full_name, email, phone))
+
+    def patients_by_ids(self, patient_ids):
+        """(patient_id, full_name, email, phone) rows in ``patient_ids`` order."""
+        if not patient_ids:
+            return []
+        rows = self._all("""
+            SELECT patient_id, full_name, email, phone
+            FROM patient
+            WHERE patient_id IN (%s)
+        """ % ", ".join(["%s"] * len(patient_ids)), list(patient_ids))
+        found = {row[0]: row for row in rows}
+        return [found[pid] for pid in patient_ids if pid in found]
+
+    def delete_patient(self, patient_id):
+        self._run("DELETE FROM patient WHERE patient_id = %s", (patient_id,))
+
+    # ------- appointments --------
+
+    def appointments_page(self, after=None, before=None, limit=None):
+        page = self._page("""
+            SELECT a.appt_id,
+                   p.full_name AS patient_name,
+                   a.doctor_id,
+                   a.starts_at,
+                   a.ends_at,
+                   a.status,
+                   a.reason
+            FROM appointment a
+            JOIN patient p ON a.patient_id = p.patient_id
+        """, columns=["a.starts_at", "a.appt_id"], key_index=[3, 0],
+            after=after, before=before, limit=limit)
+        page.rows = self._doctor_names(page.rows, 2)
+        return page
+
+    def add_appointment(self, appt_id, patient_id, doctor_id, starts_at, ends_at, reason,
+                        status="scheduled"):
+        self._run("""
+            INSERT INTO appointment (appt_id, patient_id, doctor_id, starts_at, ends_at, status, reason)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (appt_id, patient_id, doctor_id, starts_at, ends_at, status, reason))
+        if audit.ENABLED:
+            self.audit.append(audit.appointment_inserted(appt_id, patient_id, doctor_id))
+
+    def delete_appointment(self, appt_id):
+        if audit.ENABLED:
+            self.lock_row("appointment", "appt_id", appt_id)
+            bills = self._all("SELECT bill_id FROM billing WHERE appt_id = %s", (appt_id,))
+            prescriptions = self._all("SELECT rx_id FROM prescription WHERE appt_id = %s", (appt_id,))
+            appointment = self._one("SELECT patient_id FROM appointment WHERE appt_id = %s", (appt_id,))
+
+        # Remove dependent records first to avoid FK constraint errors
+        self.delete_appointments([appt_id])
+
+        if audit.ENABLED:
+            self.audit += [audit.bill_deleted(bill_id, appt_id) for (bill_id,) in bills]
+            self.audit += [audit.prescription_deleted(rx_id, appt_id) for (rx_id,) in prescriptions]
+            if appointment:
+                self.audit.append(audit.appointment_deleted(appt_id, appointment[0]))
+
+    def delete_appointments(self, appt_ids, archive_job=None):
+        """Delete the appointments and every row hanging off them, one
+        statement per table. With ``archive_job`` the rows are copied to the
+        <table>_archive tables first. Returns {table: rows deleted}."""
+        ids = ", ".join(["%s"] * len(appt_ids))
+        removed = {}
+        for table, columns, condition in APPOINTMENT_CASCADE:
+            condition = condition.format(ids=ids)
+            if archive_job is not None:
+                self._run("INSERT INTO %s_archive (job_id, %s) SELECT %%s, %s FROM %s WHERE %s"
+                          % (table, columns, columns, table, condition),
+                          [archive_job] + list(appt_ids))
+            removed[table] = self._run("DELETE FROM %s WHERE %s" % (table, condition), list(appt_ids))
+        return removed
+
+    def appointments_for_doctors(self, doctor_ids, limit):
+        return self._doctor_names(self._all("""
+            SELECT a.appt_id, p.full_name, a.doctor_id, a.starts_at, a.status
+            FROM appointment a
+            JOIN patient p ON p.patient_id = a.patient_id
+            WHERE a.doctor_id IN (%s)
+            ORDER BY a.starts_at DESC
+            LIMIT %%s
+        """ % ", ".join(["%s"] * len(doctor_ids)), list(doctor_ids) + [limit]), 2)
+
+    def appointments_between(self, starts_at, ends_at, doctor_ids=None, limit=None):
+        """Appointments starting in [starts_at, ends_at), newest first."""
+        where = ["a.starts_at >= %s", "a.starts_at < %s"]
+        params = [starts_at, ends_at]
+        if doctor_ids is not None:
+            # With the doctor known this is a range scan per doctor on
+            # idx_appointment_doctor_starts.
+            where.insert(0, "a.doctor_id IN (%s)" % ", ".join(["%s"] * len(doctor_ids)))
+            params = list(doctor_ids) + params
+        sql = """
+            SELECT a.appt_id, p.full_name, a.doctor_id, a.starts_at, a.status
+            FROM appointment a
+            JOIN patient p ON p.patient_id = a.patient_id
+            WHERE %s
+            ORDER BY a.starts_at DESC
+        """ % " AND ".join(where)
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return self._doctor_names(self._all(sql, params), 2)
+
+    def upcoming_appointments(self, starts_at, ends_at, limit=20):
+        return self._doctor_names(self._all("""
+            SELECT a.starts_at, p.full_name, a.doctor_id, a.reason, a.status
+            FROM appointment a
+            JOIN patient p ON p.patient_id = a.patient_id
+            WHERE a.starts_at >= %s
+            AND a.starts_at < %s
+            ORDER BY a.starts_at ASC
+            LIMIT %s
+        """, (starts_at, ends_at, limit)), 2)
+
+    def pending_page(self, kind, args):
+        cursor = self.conn.cursor()
+        page = work_queue.pending_page(cursor, kind, args)
+        cursor.close()
+        return page
+
+    # ------- billing --------
+
+    def bills_page(self, after=None, before=None, limit=None):
+        page = self._page("""
+            SELECT b.bill_id, b.appt_id, p.full_name AS patient_name,
+                   a.doctor_id, a.starts_at, b.amount,
+                   b.payment_status, b.payment_method, b.billing_date
+            FROM billing b
+            JOIN appointment a ON a.appt_id = b.appt_id
+            JOIN patient p ON p.patient_id = a.patient_id
+        """, columns=["b.billing_date", "b.bill_id"], key_index=[8, 0],
+            after=after, before=before, limit=limit)
+        page.rows = self._doctor_names(page.rows, 3)
+        return page
+
+    def billing_totals(self):
+        cursor = self.conn.cursor()
+        row = billing_summary.totals(cursor)
+        cursor.close()
+        return row
+
+    def receivables(self):
+        cursor = self.conn.cursor()
+        rows = billing_summary.receivables(cursor)
+        cursor.close()
+        return rows
+
+    def add_bill(self, bill_id, appt_id, amount, payment_status, payment_method, billing_date=None):
+        self._run("""
+            INSERT INTO billing (bill_id, appt_id, amount, payment_status, payment_method, billing_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (bill_id, appt_id, amount, payment_status, payment_method,
+              billing_date or datetime.date.today()))
+        if audit.ENABLED:
+            self.audit.append(audit.bill_inserted(bill_id, amount, payment_status))
+
+    def update_bill(self, bill_id, amount, payment_status, payment_method):
+        old = None
+        if audit.ENABLED:
+            self.lock_row("billing", "bill_id", bill_id)
+            old = self._one("SELECT payment_status FROM billing WHERE bill_id = %s", (bill_id,))
+        self._run("""
+            UPDATE billing
+            SET amount = %s, payment_status = %s, payment_method = %s
+            WHERE bill_id = %s
+        """, (amount, payment_status, payment_method, bill_id))
+        if old is not None:
+            self.audit.append(audit.bill_updated(bill_id, old[0], payment_status))
+
+    def bill_for_edit(self, bill_id):
+        row = self._one("""
+            SELECT b.bill_id, a.appt_id, p.patient_id, p.full_name, p.email, p.phone,
+                   a.doctor_id, a.starts_at, a.reason,
+                   b.amount, b.payment_status, b.payment_method, b.billing_date
+            FROM billing b
+            JOIN appointment a ON a.appt_id = b.appt_id
+            JOIN patient p ON p.patient_id = a.patient_id
+            WHERE b.bill_id = %s
+        """, (bill_id,))
+        return self._doctor_names([row], 6)[0] if row else None
+
+    def bill_details(self, bill_id):
+        return self._one("""
+            SELECT b.bill_id, a.appt_id, p.patient_id, p.full_name, p.email, p.phone, p.address,
+                   d.full_name AS doctor_name, d.email AS doctor_email, a.starts_at, a.reason,
+                   b.amount, b.payment_method, b.billing_date,
+                   CASE WHEN b.payment_status = 'paid' THEN 'PAID' ELSE 'PENDING' END AS status
+            FROM billing b
+            JOIN appointment a ON a.appt_id = b.appt_id
+            JOIN patient p ON p.patient_id = a.patient_id
+            JOIN doctor d ON d.doctor_id = a.doctor_id
+            WHERE b.bill_id = %s
+        """, (bill_id,))
+
+    def delete_bill(self, bill_id):
+        bill = None
+        if audit.ENABLED:
+            self.lock_row("billing", "bill_id", bill_id)
+            bill = self._one("SELECT appt_id FROM billing WHERE bill_id = %s", (bill_id,))
+        self._run("DELETE FROM billing WHERE bill_id = %s", (bill_id,))
+        if bill is not None:
+            self.audit.append(audit.bill_deleted(bill_id, bill[0]))
+
+    # ------- revenue reports (revenue_daily / revenue_monthly) --------
+
+    def _revenue(self, reader, *args):
+        cursor = self.conn.cursor()
+        rows = reader(cursor, *args)
+        cursor.close()
+        return rows
+
+    def revenue_by_month(self, start, end):
+        return self._revenue(revenue_rollup.months, start, end)
+
+    def revenue_by_day(self, start, end):
+        return self._revenue(revenue_rollup.days, start, end)
+
+    def revenue_by_method(self, start, end):
+        return self._revenue(revenue_rollup.by_method, start, end)
+
+    def revenue_top_doctors(self, start, end, limit=10):
+        # (doctor_id, doctor name, total, bills)
+        return self._doctor_names(self._revenue(revenue_rollup.top_doctors, start, end, limit), 1)
+
+    # ------- audit log --------
+
+    def audit_page(self, entity=None, entity_id=None, action=None, since=None, until=None,
+                   after=None, before=None, limit=None):
+        where = []
+        params = []
+        for column, value in (("entity_name", entity), ("entity_id", entity_id), ("action", action)):
+            if value is not None:
+                where.append("%s = %%s" % column)
+                params.append(value)
+        if since is not None:
+            where.append("performed_at >= %s")
+            params.append(since)
+        if until is not None:
+            where.append("performed_at < %s")
+            params.append(until)
+        return self._page("""
+            SELECT log_id, entity_name, entity_id, action, performed_at, details
+            FROM audit_log
+        """, columns=["performed_at", "log_id"], key_index=[4, 0], where=where, params=params,
+            after=after, before=before, limit=limit)
+
+    def oldest_audit(self):
+        row = self._one("SELECT performed_at FROM audit_log ORDER BY performed_at LIMIT 1")
+        return row[0] if row else None
+
+    def audit_range_stats(self, start, end):
+        """(rows, highest log_id) with start <= performed_at < end."""
+        return self._one("""
+            SELECT COUNT(*), MAX(log_id) FROM audit_log
+            WHERE performed_at >= %s AND performed_at < %s
+        """, (start, end))
+
+    def purge_audit_range(self, start, end, max_log_id, chunk=5000):
+        # Rows above max_log_id arrived after the range was archived: keep them
+        # for the next run. Commits per chunk to keep each transaction short.
+        deleted = 0
+        while True:
+            count = self._delete_audit_chunk(start, end, max_log_id, chunk)
+            self.commit()
+            deleted += count
+            if count < chunk:
+                return deleted
+
+    # ------- bulk archive / purge jobs (see purge.py) --------
+
+    def _purge_candidates_sql(self, status, before, after, limit):
+        where = ["starts_at < %s"]
+        params = [before]
+        if status is not None:
+            where.append("status = %s")
+            params.append(status)
+        if after is not None:
+            where.append("(starts_at > %s OR (starts_at = %s AND appt_id > %s))")
+            params += [after[0], after[0], after[1]]
+        return ("""
+            SELECT appt_id, starts_at FROM appointment
+            WHERE %s
+            ORDER BY starts_at, appt_id
+            LIMIT %%s
+        """ % " AND ".join(where), params + [limit])
+
+    def create_purge_job(self, status, before, archive):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            INSERT INTO purge_job (appt_status, starts_before, archive)
+            VALUES (%s, %s, %s)
+        """, (status, before, int(archive)))
+        job_id = cursor.lastrowid
+        cursor.close()
+        return job_id
+
+    _PURGE_JOB = """
+        SELECT job_id, appt_status, starts_before, archive, state, last_starts_at,
+               last_appt_id, appointments, rows_removed, started_at, updated_at
+        FROM purge_job
+    """
+
+    def purge_jobs(self, state=None):
+        """(job_id, appt_status, starts_before, archive, state, last_starts_at,
+        last_appt_id, appointments, rows_removed, started_at, updated_at)."""
+        if state is None:
+            return self._all(self._PURGE_JOB + " ORDER BY job_id")
+        return self._all(self._PURGE_JOB + " WHERE state = %s ORDER BY job_id", (state,))
+
+    def purge_job(self, job_id):
+        return self._one(self._PURGE_JOB + " WHERE job_id = %s", (job_id,))
+
+    def save_purge_progress(self, job_id, last, appointments, rows_removed, done=False):
+        self._run("""
+            UPDATE purge_job
+            SET last_starts_at = %s, last_appt_id = %s,
+                appointments = appointments + %s, rows_removed = rows_removed + %s,
+                state = %s, updated_at = %s
+            WHERE job_id = %s
+        """, (last[0] if last else None, last[1] if last else None, appointments, rows_removed,
+              "done" if done else "running", datetime.datetime.now(), job_id))
+
+    def log_purge_chunk(self, job_id, action, details):
+        # One audit_log row per chunk in place of the per-row audit triggers.
+        self._run("""
+            INSERT INTO audit_log (entity_name, entity_id, action, details, performed_at)
+            VALUES ('purge_job', %s, %s, %s, %s)
+        """, (job_id, action, details, datetime.datetime.now()))
+
+    # ------- change log retention (see change_log.py) --------
+
+    def change_log_prune_point(self, table, before):
+        """Highest change_id of ``table`` to prune: rows older than
+        ``before``, but never the newest row. None if the log is empty."""
+        newest = self._one("SELECT MAX(change_id) FROM %s" % table)[0]
+        if newest is None:
+            return None
+        kept = self._one("""
+            SELECT change_id FROM %s WHERE changed_at >= %%s
+            ORDER BY change_id LIMIT 1
+        """ % table, (before,))
+        return min(newest, kept[0] if kept else newest) - 1
+
+    def prune_change_log(self, table, through, chunk=5000):
+        # Walks change_id ranges and commits per chunk to keep each
+        # transaction short.
+        low = self._one("SELECT MIN(change_id) FROM %s" % table)[0]
+        deleted = 0
+        while low is not None and low <= through:
+            high = min(low + chunk - 1, through)
+            deleted += self._run("DELETE FROM %s WHERE change_id >= %%s AND change_id <= %%s" % table,
+                                 (low, high))
+            self.commit()
+            low = high + 1
+        return deleted
+
+    def compact_row_change_log(self, chunk=5000):
+        # A row's version is its highest change_id, so only superseded rows
+        # go and no version changes. The newest row overall is never
+        # superseded, so change_id keeps counting up.
+        low, newest = self._one("SELECT MIN(change_id), MAX(change_id) FROM row_change_log")
+        deleted = 0
+        while low is not None and low < newest:
+            high = min(low + chunk - 1, newest - 1)
+            deleted += self._compact_row_changes(low, high)
+            self.commit()
+            low = high + 1
+        return deleted
+
+    # ------- medications --------
+
+    def medications(self):
+        return refdata.cache.get(self, "medications")
+
+    def add_medication(self, med_id, variant_id, med_name, notes, form_name, strength):
+        self._run("""
+            INSERT INTO medication (med_id, med_name, notes)
+            VALUES (%s, %s, %s)
+        """, (med_id, med_name, notes))
+
+        # Get or create form
+        form_id = refdata.cache.get(self, "medication_forms").get(form_name)
+        if form_id is None:
+            cursor = self.conn.cursor()
+            cursor.execute("INSERT INTO medication_form (form_name) VALUES (%s)", (form_name,))
+            form_id = cursor.lastrowid
+            cursor.close()
+
+        self._run("""
+            INSERT INTO medication_variant (variant_id, med_id, form_id, strength)
+            VALUES (%s, %s, %s, %s)
+        """, (variant_id, med_id, form_id, strength))
+
+    def medication_info(self, med_id):
+        """(med_name, strength, variant_id) of the medication's first variant."""
+        return refdata.cache.get(self, "medication_info", require=(med_id,)).get(med_id)
+
+    def first_variant(self, med_id):
+        info = self.medication_info(med_id)
+        return info[2] if info else None
+
+    def add_prescription(self, rx_id, appt_id, variant_id, dosage, route, frequency,
+                         instructions, quantity):
+        self._run("""
+            INSERT INTO prescription (rx_id, appt_id, variant_id, dosage, route, frequency, instructions, quantity)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (rx_id, appt_id, variant_id, dosage, route, frequency, instructions, quantity))
+        if audit.ENABLED:
+            self.audit.append(audit.prescription_inserted(rx_id, variant_id, quantity))
+
+    def delete_medication(self, med_id):
+        # Delete prescriptions referencing variants of this medication, all
+        # variants in one statement
+        variants = "SELECT variant_id FROM medication_variant WHERE med_id = %s"
+        if audit.ENABLED:
+            # Locking the variants holds off new prescriptions for them.
+            self.lock_row("medication_variant", "med_id", med_id)
+            self.audit += [audit.prescription_deleted(rx_id, appt_id) for rx_id, appt_id in self._all(
+                "SELECT rx_id, appt_id FROM prescription WHERE variant_id IN (%s)" % variants,
+                (med_id,))]
+        self._run("DELETE FROM prescription WHERE variant_id IN (%s)" % variants, (med_id,))
+
+        # Delete variants then medication
+        self._run("DELETE FROM medication_variant WHERE med_id = %s", (med_id,))
+        self._run("DELETE FROM medication WHERE med_id = %s", (med_id,))
+
+    # ------- rooms --------
+
+    def rooms(self):
+        """(room_id, room_name, room_type, notes, appointments_count) per room."""
+        counts = dict(self._all("""
+            SELECT room_id, COUNT(*) FROM appointment_room GROUP BY room_id
+        """))
+        return [room + (counts.get(room[0], 0),)
+                for room in refdata.cache.get(self, "rooms").values()]
+
+    def add_room(self, room_id, room_name, room_type, notes):
+        self._run("""
+            INSERT INTO clinic_room (room_id, room_name, room_type, notes)
+            VALUES (%s, %s, %s, %s)
+        """, (room_id, room_name, room_type, notes))
+
+    def room_name(self, room_id):
+        room = refdata.cache.get(self, "rooms", require=(room_id,)).get(room_id)
+        return room[1] if room else None
+
+    def assign_room(self, appt_id, room_id):
+        self._run("""
+            INSERT INTO appointment_room (appt_id, room_id)
+            VALUES (%s, %s)
+        """, (appt_id, room_id))
+
+    def room_schedule(self, room_id, start, end):
+        """The room's appointments starting in [start, end), in order."""
+        return self._doctor_names(self._all("""
+            SELECT a.appt_id, p.full_name, a.doctor_id, a.starts_at, a.ends_at, a.status
+            FROM appointment a
+            JOIN appointment_room ar ON ar.appt_id = a.appt_id
+            JOIN patient p ON p.patient_id = a.patient_id
+            WHERE ar.room_id = %s AND a.starts_at >= %s AND a.starts_at < %s
+            ORDER BY a.starts_at
+        """, (room_id, start, end)), 2)
+
+    def room_bookings(self, start, end, since):
+        """(room_id, starts_at, ends_at) of every booking overlapping
+        [start, end) that started after ``since``, by room and start."""
+        return self._all("""
+            SELECT ar.room_id, a.starts_at, a.ends_at
+            FROM appointment a
+            JOIN appointment_room ar ON ar.appt_id = a.appt_id
+            WHERE a.starts_at >= %s AND a.starts_at < %s AND a.ends_at > %s
+              AND a.status <> 'cancelled'
+            ORDER BY ar.room_id, a.starts_at
+        """, (since, end, start))
+
+    def delete_room(self, room_id):
+        # Remove any room assignments first
+        self._run("DELETE FROM appointment_room WHERE room_id = %s", (room_id,))
+        self._run("DELETE FROM clinic_room WHERE room_id = %s", (room_id,))
+
+    # ------- dashboard --------
+
+    def dashboard_counters(self, day_start, day_end, now=None):
+        """Scalar dashboard counters in one round trip, in this order:
+        total_patients, total_appointments, today_appointments,
+        scheduled_count, completed_count, available_rooms, total_medications,
+        total_doctors, total_rooms, unpaid_bills."""
+        # The status counters share one pass over appointment; today's count
+        # is an index range on starts_at. A room is available when no
+        # booking covers ``now`` (see occupancy.py for the lookback).
+        now = now or datetime.datetime.now()
+        return self._one("""
+            SELECT p.total_patients,
+                   a.total_appointments, t.today_appointments,
+                   a.scheduled_count, a.completed_count,
+                   r.available_rooms, m.total_medications, d.total_doctors,
+                   r.total_rooms, b.unpaid_bills
+            FROM (SELECT COUNT(*) AS total_patients FROM patient) p
+            CROSS JOIN (
+                SELECT COUNT(*) AS total_appointments,
+                       COALESCE(SUM(status = 'scheduled'), 0) AS scheduled_count,
+                       COALESCE(SUM(status = 'completed'), 0) AS completed_count
+                FROM appointment
+            ) a
+            CROSS JOIN (
+                SELECT COUNT(*) AS today_appointments
+                FROM appointment
+                WHERE starts_at >= %s AND starts_at < %s
+            ) t
+            CROSS JOIN (
+                SELECT COUNT(*) AS total_rooms,
+                       COALESCE(SUM(r.room_id NOT IN (
+                           SELECT DISTINCT ar.room_id
+                           FROM appointment_room ar
+                           JOIN appointment a ON a.appt_id = ar.appt_id
+                           WHERE a.starts_at >= %s AND a.starts_at <= %s AND a.ends_at > %s
+                             AND a.status <> 'cancelled'
+                       )), 0) AS available_rooms
+                FROM clinic_room r
+            ) r
+            CROSS JOIN (SELECT COUNT(*) AS total_medications FROM medication) m
+            CROSS JOIN (SELECT COUNT(*) AS total_doctors FROM doctor) d
+            CROSS JOIN (
+                SELECT COALESCE(SUM(unpaid_count), 0) AS unpaid_bills FROM billing_summary
+            ) b
+        """, (day_start, day_end, now - occupancy.LOOKBACK, now, now))
+
+
+class MySQLRepository(Repository):
+    dialect = "mysql"
+
+    def lock_row(self, table, column, key):
+        self._all("SELECT %s FROM %s WHERE %s = %%s FOR UPDATE" % (column, table, column), (key,))
+
+    def appointment_times(self, appt_id, lock=False):
+        return self._one("""
+            SELECT starts_at, ends_at FROM appointment WHERE appt_id = %s
+        """ + (" FOR SHARE" if lock else ""), (appt_id,))
+
+    def reserve_ids(self, name, count, table, column, offset):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            UPDATE id_sequence
+            SET next_id = LAST_INSERT_ID(next_id + %s)
+            WHERE seq_name = %s
+        """, (count, name))
+        if cursor.rowcount == 0:
+            # First use of a sequence continues from the rows already loaded
+            # (e.g. by inserts.sql). INSERT IGNORE makes concurrent seeding safe.
+            cursor.execute(
+                "INSERT IGNORE INTO id_sequence (seq_name, next_id) "
+                "SELECT %%s, COALESCE(MAX(%s), %%s) + 1 FROM %s" % (column, table),
+                (name, offset))
+            cursor.execute("""
+                UPDATE id_sequence
+                SET next_id = LAST_INSERT_ID(next_id + %s)
+                WHERE seq_name = %s
+            """, (count, name))
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        end = cursor.fetchone()[0]
+        cursor.close()
+        return end
+
+    def advance_sequence(self, name, floor):
+        self._run("""
+            UPDATE id_sequence SET next_id = GREATEST(next_id, %s)
+            WHERE seq_name = %s
+        """, (floor, name))
+
+    def begin_export(self, write_timeout):
+        # Seconds MySQL waits on a slow client before dropping the export.
+        self._run("SET SESSION net_write_timeout = %s", (write_timeout,))
+
+    def end_export(self):
+        self._run("SET SESSION net_write_timeout = DEFAULT")
+
+    def audit_partitions(self):
+        rows = self._all("""
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'audit_log'
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """)
+        partitions = []
+        lower = None
+        for name, description in rows:
+            if name is None or description == "MAXVALUE":
+                continue
+            # TO_DAYS() counts from year 0, Python ordinals from year 1.
+            upper = datetime.date.fromordinal(int(description) - 365)
+            partitions.append((name, lower, upper))
+            lower = upper
+        return partitions
+
+    def add_audit_partitions(self, months):
+        partitions = self.audit_partitions()
+        if not partitions and self._one("""
+                SELECT COUNT(*) FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'audit_log'
+                AND PARTITION_NAME = 'pmax'
+            """)[0] == 0:
+            return []       # audit_log was created without partitioning
+        last = partitions[-1][2] if partitions else None
+        added = [m for m in sorted(months) if last is None or m >= last]
+        if not added:
+            return []
+        # pmax is empty while partitions exist ahead of time, so splitting
+        # it moves no rows.
+        self._run("ALTER TABLE audit_log REORGANIZE PARTITION pmax INTO (%s, "
+                  "PARTITION pmax VALUES LESS THAN MAXVALUE)" % ", ".join(
+                      "PARTITION p%s VALUES LESS THAN (TO_DAYS('%s'))"
+                      % (m.strftime("%Y%m"), next_month(m).isoformat()) for m in added))
+        return added
+
+    def purge_audit_range(self, start, end, max_log_id, chunk=5000):
+        # The partition holding the range goes in one metadata change when it
+        # holds nothing else: no rows arrived since the export and none lie
+        # outside [start, end). Its lower bound is the previous partition's
+        # upper one, which runs back further once that partition is dropped,
+        # so the bounds need not equal the month. Otherwise the rows are
+        # deleted in chunks, and the partition dropped if that emptied it.
+        for name, lower, upper in self.audit_partitions():
+            if upper < end.date():
+                continue
+            if lower is not None and lower >= end.date():
+                break
+            floor = datetime.datetime.combine(lower, datetime.time()) if lower else datetime.datetime.min
+            ceiling = datetime.datetime.combine(upper, datetime.time())
+            others = self.audit_range_stats(floor, start)[0] + self.audit_range_stats(end, ceiling)[0]
+            rows, highest = self.audit_range_stats(start, end)
+            if not others and (highest is None or highest <= max_log_id):
+                self._run("ALTER TABLE audit_log DROP PARTITION %s" % name)
+                return rows
+            deleted = super().purge_audit_range(start, end, max_log_id, chunk)
+            if not self.audit_range_stats(floor, ceiling)[0]:
+                self._run("ALTER TABLE audit_log DROP PARTITION %s" % name)
+            return deleted
+        return super().purge_audit_range(start, end, max_log_id, chunk)
+
+    def _delete_audit_chunk(self, start, end, max_log_id, chunk):
+        return self._run("""
+            DELETE FROM audit_log
+            WHERE performed_at >= %s AND performed_at < %s AND log_id <= %s
+            LIMIT %s
+        """, (start, end, max_log_id, chunk))
+
+    def _compact_row_changes(self, low, high):
+        return self._run("""
+            DELETE o FROM row_change_log o
+            JOIN row_change_log n
+              ON n.entity = o.entity AND n.entity_id = o.entity_id AND n.change_id > o.change_id
+            WHERE o.change_id BETWEEN %s AND %s
+        """, (low, high))
+
+    def purge_candidates(self, status, before, after, limit):
+        # Locks the chunk's appointments (and the scanned index range), so
+        # no bill, prescription or room can be added to them until commit.
+        sql, params = self._purge_candidates_sql(status, before, after, limit)
+        return self._all(sql + " FOR UPDATE", params)
+
+
+class SQLiteRepository(Repository):
+    dialect = "sqlite"
+
+    def lock_row(self, table, column, key):
+        # One writer per database: the write lock covers every row.
+        self.conn.begin_immediate()
+
+    def appointment_times(self, appt_id, lock=False):
+        if lock:
+            self.conn.begin_immediate()
+        return self._one("SELECT starts_at, ends_at FROM appointment WHERE appt_id = %s",
+                         (appt_id,))
+
+    def reserve_ids(self, name, count, table, column, offset):
+        sql = """
+            UPDATE id_sequence SET next_id = next_id + %s
+            WHERE seq_name = %s
+            RETURNING next_id
+        """
+        row = self._one(sql, (count, name))
+        if row is None:
+            self._run(
+                "INSERT OR IGNORE INTO id_sequence (seq_name, next_id) "
+                "SELECT %%s, COALESCE(MAX(%s), %%s) + 1 FROM %s" % (column, table),
+                (name, offset))
+            row = self._one(sql, (count, name))
+        return row[0]
+
+    def advance_sequence(self, name, floor):
+        self._run("UPDATE id_sequence SET next_id = MAX(next_id, %s) WHERE seq_name = %s",
+                  (floor, name))
+
+    def begin_export(self, write_timeout):
+        pass
+
+    def _delete_audit_chunk(self, start, end, max_log_id, chunk):
+        # DELETE ... LIMIT is a compile-time option in SQLite.
+        return self._run("""
+            DELETE FROM audit_log WHERE log_id IN (
+                SELECT log_id FROM audit_log
+                WHERE performed_at >= %s AND performed_at < %s AND log_id <= %s
+                LIMIT %s
+            )
+        """, (start, end, max_log_id, chunk))
+
+    def _compact_row_changes(self, low, high):
+        # No multi-table DELETE in SQLite; the subquery reads the same index.
+        return self._run("""
+            DELETE FROM row_change_log
+            WHERE change_id BETWEEN %s AND %s
+              AND EXISTS (SELECT 1 FROM row_change_log n
+                          WHERE n.entity = row_change_log.entity
+                            AND n.entity_id = row_change_log.entity_id
+                            AND n.change_id > row_change_log.change_id)
+        """, (low, high))
+
+    def purge_candidates(self, status, before, after, limit):
+        self.conn.begin_immediate()
+        return self._all(*self._purge_candidates_sql(status, before, after, limit))
+
+
+def next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+REPOSITORIES = {
+    "mysql": MySQLRepository,
+    "sqlite": SQLiteRepository,
+}
+
+
+def get_repository(conn=None):
+    """Repository for ``conn`` (default: the request's shared connection)."""
+    return REPOSITORIES[db.BACKEND](conn if conn is not None else get_connection())
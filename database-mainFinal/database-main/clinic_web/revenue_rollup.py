@@ -0,0 +1,247 @@
+"""Read, backfill and reconcile the revenue rollup tables.
+
+revenue_daily and revenue_monthly hold billed amounts and bill counts per
+(day or month, doctor, payment method, payment status). The billing triggers
+keep them current through sp_revenue_rollup_apply (triggers.sql section 18),
+so reports read a few hundred rollup rows instead of grouping billing.
+
+Bills loaded with the triggers off, or rollups created after the bills,
+need a backfill. It recomputes one month per transaction from billing, so
+the rest of the rollup stays readable while it runs:
+
+    python revenue_rollup.py                             # report differences
+    python revenue_rollup.py --fix                       # recompute the months that differ
+    python revenue_rollup.py --backfill                  # recompute every month
+    python revenue_rollup.py --backfill --from 2025-01 --to 2025-06
+"""
+import argparse
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from db import get_pool
+
+GROUPS = """
+    FROM billing b
+    JOIN appointment a ON a.appt_id = b.appt_id
+    WHERE b.billing_date >= %s AND b.billing_date < %s
+"""
+KEYS = "a.doctor_id, COALESCE(b.payment_method, ''), COALESCE(b.payment_status, '')"
+
+
+def next_month(day):
+    # Same as repository.next_month; repository imports this module.
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+# ------- reports --------
+
+def _range_sum(cursor, table, column, start, end):
+    cursor.execute("""
+        SELECT {column},
+               SUM(total_amount),
+               SUM(CASE WHEN payment_status = 'paid' THEN total_amount ELSE 0 END),
+               SUM(CASE WHEN payment_status = 'unpaid' THEN total_amount ELSE 0 END),
+               SUM(bills_count)
+        FROM {table}
+        WHERE {column} >= %s AND {column} < %s
+        GROUP BY {column}
+        HAVING SUM(bills_count) > 0
+        ORDER BY {column}
+    """.format(table=table, column=column), (start, end))
+    return [(_as_date(row[0]),) + tuple(_money(v) for v in row[1:4]) + (int(row[4]),)
+            for row in cursor.fetchall()]
+
+
+def months(cursor, start, end):
+    """[(month, total, paid, unpaid, bills)] for months in [start, end)."""
+    return _range_sum(cursor, "revenue_monthly", "month", start, end)
+
+
+def days(cursor, start, end):
+    """[(day, total, paid, unpaid, bills)] for days in [start, end)."""
+    return _range_sum(cursor, "revenue_daily", "day", start, end)
+
+
+def top_doctors(cursor, start, end, limit):
+    """[(doctor_id, doctor_id, total, bills)], highest revenue first; the
+    second doctor_id is there to be replaced by the name."""
+    cursor.execute("""
+        SELECT doctor_id, doctor_id, SUM(total_amount) AS total, SUM(bills_count)
+        FROM revenue_monthly
+        WHERE month >= %s AND month < %s
+        GROUP BY doctor_id
+        HAVING SUM(bills_count) > 0
+        ORDER BY total DESC
+        LIMIT %s
+    """, (start, end, limit))
+    return [(row[0], row[1], _money(row[2]), int(row[3])) for row in cursor.fetchall()]
+
+
+def by_method(cursor, start, end):
+    """[(payment_method, total, bills)], highest revenue first."""
+    cursor.execute("""
+        SELECT payment_method, SUM(total_amount) AS total, SUM(bills_count)
+        FROM revenue_monthly
+        WHERE month >= %s AND month < %s
+        GROUP BY payment_method
+        HAVING SUM(bills_count) > 0
+        ORDER BY total DESC
+    """, (start, end))
+    return [(row[0], _money(row[1]), int(row[2])) for row in cursor.fetchall()]
+
+
+# ------- backfill and reconcile --------
+
+def _money(value):
+    # SQLite sums DECIMAL columns as floats; compare both backends in cents.
+    return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+
+def _as_date(value):
+    # Aggregates and expressions come back as text from SQLite.
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _edge(cursor, table, column, order):
+    # Plain column reads, not MIN()/MAX(), so SQLite returns dates too.
+    cursor.execute("SELECT %s FROM %s ORDER BY %s %s LIMIT 1" % (column, table, column, order))
+    row = cursor.fetchone()
+    return _as_date(row[0]) if row else None
+
+
+def month_span(cursor):
+    """(first month, month after the last) covered by billing or the rollup."""
+    firsts = [d for d in (_edge(cursor, "billing", "billing_date", "ASC"),
+                          _edge(cursor, "revenue_daily", "day", "ASC")) if d]
+    lasts = [d for d in (_edge(cursor, "billing", "billing_date", "DESC"),
+                         _edge(cursor, "revenue_daily", "day", "DESC")) if d]
+    if not firsts:
+        return None, None
+    return min(firsts).replace(day=1), next_month(max(lasts))
+
+
+def backfill_month(conn, month):
+    # INSERT ... SELECT locks the month's billing rows it reads, so billing
+    # writes for that month wait for the commit instead of being counted
+    # twice or lost.
+    end = next_month(month)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM revenue_daily WHERE day >= %s AND day < %s", (month, end))
+    cursor.execute("DELETE FROM revenue_monthly WHERE month = %s", (month,))
+    cursor.execute("""
+        INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+        SELECT b.billing_date, {keys}, SUM(b.amount), COUNT(*)
+        {groups}
+        GROUP BY b.billing_date, {keys}
+    """.format(keys=KEYS, groups=GROUPS), (month, end))
+    cursor.execute("""
+        INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+        SELECT %s, {keys}, SUM(b.amount), COUNT(*)
+        {groups}
+        GROUP BY {keys}
+    """.format(keys=KEYS, groups=GROUPS), (month, month, end))
+    conn.commit()
+    cursor.close()
+
+
+def backfill(conn, start=None, end=None):
+    """Recompute every month in [start, end); defaults to the whole history."""
+    cursor = conn.cursor()
+    first, last = month_span(cursor)
+    cursor.close()
+    conn.commit()
+    start = start or first
+    end = end or last
+    done = []
+    month = start
+    while month is not None and month < end:
+        backfill_month(conn, month)
+        done.append(month)
+        month = next_month(month)
+    return done
+
+
+def reconcile(conn):
+    """[(table, key, expected, found)] where the rollups disagree with billing;
+    keys are (day or month, doctor_id, method, status)."""
+    cursor = conn.cursor()
+    first, last = month_span(cursor)
+    if first is None:
+        cursor.close()
+        return []
+    cursor.execute("""
+        SELECT b.billing_date, {keys}, SUM(b.amount), COUNT(*)
+        {groups}
+        GROUP BY b.billing_date, {keys}
+    """.format(keys=KEYS, groups=GROUPS), (first, last))
+    expected = {"revenue_daily": {}, "revenue_monthly": defaultdict(lambda: (Decimal("0.00"), 0))}
+    for day, doctor_id, method, status, amount, count in cursor.fetchall():
+        day = _as_date(day)
+        expected["revenue_daily"][(day, doctor_id, method, status)] = (_money(amount), int(count))
+        key = (day.replace(day=1), doctor_id, method, status)
+        total, bills = expected["revenue_monthly"][key]
+        expected["revenue_monthly"][key] = (total + _money(amount), bills + int(count))
+
+    diffs = []
+    zero = (Decimal("0.00"), 0)
+    for table, column in (("revenue_daily", "day"), ("revenue_monthly", "month")):
+        cursor.execute("""
+            SELECT {column}, doctor_id, payment_method, payment_status, total_amount, bills_count
+            FROM {table}
+        """.format(table=table, column=column))
+        actual = {(_as_date(row[0]),) + tuple(row[1:4]): (_money(row[4]), int(row[5]))
+                  for row in cursor.fetchall()}
+        want_all = expected[table]
+        for key in sorted(set(want_all) | set(actual), key=lambda k: (k[0], k[1], k[2], k[3])):
+            want = want_all.get(key, zero)
+            have = actual.get(key, zero)
+            if want != have:
+                diffs.append((table, key, want, have))
+    cursor.close()
+    conn.commit()
+    return diffs
+
+
+def _parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m").date() if value else None
+    except ValueError:
+        raise argparse.ArgumentTypeError("months must be YYYY-MM, got %r" % value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check, repair or backfill the revenue rollups.")
+    parser.add_argument("--fix", action="store_true", help="recompute the months that differ")
+    parser.add_argument("--backfill", action="store_true", help="recompute months from billing")
+    parser.add_argument("--from", dest="start", type=_parse_month, help="first month, YYYY-MM")
+    parser.add_argument("--to", dest="end", type=_parse_month, help="last month, YYYY-MM (inclusive)")
+    args = parser.parse_args()
+
+    conn = get_pool().acquire()
+    try:
+        if args.backfill:
+            done = backfill(conn, args.start, next_month(args.end) if args.end else None)
+            print("backfilled %d months" % len(done))
+            return 0
+        diffs = reconcile(conn)
+        for table, key, want, have in diffs[:50]:
+            print("%s %s: expected %s, found %s" % (table, key, want, have))
+        if not diffs:
+            print("revenue rollups match")
+        elif args.fix:
+            months_to_fix = sorted({key[0].replace(day=1) for _, key, _, _ in diffs})
+            for month in months_to_fix:
+                backfill_month(conn, month)
+            print("recomputed %d months (%d differences)" % (len(months_to_fix), len(diffs)))
+    finally:
+        conn.close()
+    return 1 if diffs and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
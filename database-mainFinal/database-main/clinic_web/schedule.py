@@ -0,0 +1,315 @@
+import bisect
+import datetime
+import os
+import threading
+import time
+
+from repository import get_repository
+
+# In-memory busy-interval index per doctor and per room.
+#
+# Each key keeps its appointments as arrays sorted by start time. Doctors can
+# never hold overlapping appointments (trg_appt_before_insert), but rooms can,
+# so lookups also track the longest interval stored under each key: anything
+# starting more than that before the probe cannot overlap it. A conflict check
+# is therefore two bisections plus the handful of neighbours in between.
+#
+# Workers keep each other's indexes current through schedule_change_log, which
+# triggers fill on every appointment and appointment_room write. Booking
+# checks first take a row lock on the doctor (or room) and then replay the
+# log, so two workers can never both see the same slot as free; the overlap
+# trigger stays in place as a backstop for writers outside the app.
+#
+# Cancelled appointments still hold their doctor (the trigger counts them)
+# but not their rooms, which occupancy.py and the room availability queries
+# treat as free: they are indexed without rooms, and cancelling one drops it
+# from its rooms on the next replay.
+
+HORIZON_DAYS = int(os.environ.get("CLINIC_SCHEDULE_HORIZON_DAYS", 30))
+POLL_INTERVAL = float(os.environ.get("CLINIC_SCHEDULE_POLL", 1.0))
+LOAD_BATCH = 10000
+
+
+class Conflict:
+    def __init__(self, appt_id, starts_at, ends_at):
+        self.appt_id = appt_id
+        self.starts_at = starts_at
+        self.ends_at = ends_at
+
+    def __repr__(self):
+        return "Conflict(%r, %s, %s)" % (self.appt_id, self.starts_at, self.ends_at)
+
+    def describe(self):
+        return "appointment #%s (%s - %s)" % (
+            self.appt_id, self.starts_at.strftime("%Y-%m-%d %H:%M"),
+            self.ends_at.strftime("%Y-%m-%d %H:%M"))
+
+
+class IntervalIndex:
+    def __init__(self):
+        self.starts = []
+        self.items = []            # (starts_at, appt_id, ends_at), sorted
+        self.longest = datetime.timedelta(0)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, appt_id, starts_at, ends_at):
+        item = (starts_at, appt_id, ends_at)
+        pos = bisect.bisect_left(self.items, item)
+        self.items.insert(pos, item)
+        self.starts.insert(pos, starts_at)
+        self.longest = max(self.longest, ends_at - starts_at)
+
+    def remove(self, appt_id, starts_at, ends_at):
+        pos = bisect.bisect_left(self.items, (starts_at, appt_id, ends_at))
+        if pos < len(self.items) and self.items[pos][1] == appt_id:
+            del self.items[pos]
+            del self.starts[pos]
+
+    def overlapping(self, starts_at, ends_at):
+        lo = bisect.bisect_left(self.starts, starts_at - self.longest)
+        hi = bisect.bisect_left(self.starts, ends_at)
+        return [Conflict(appt_id, s, e)
+                for s, appt_id, e in self.items[lo:hi] if e > starts_at]
+
+    def busy(self, starts_at, ends_at):
+        # Sorted (start, end) pairs intersecting the window.
+        lo = bisect.bisect_left(self.starts, starts_at - self.longest)
+        hi = bisect.bisect_left(self.starts, ends_at)
+        return [(s, e) for s, _, e in self.items[lo:hi] if e > starts_at]
+
+
+class ScheduleIndex:
+    def __init__(self, horizon_days=HORIZON_DAYS):
+        self.horizon = datetime.timedelta(days=horizon_days)
+        self.loaded_from = None
+        self.doctors = {}
+        self.rooms = {}
+        self.appointments = {}     # appt_id -> (doctor_id, starts_at, ends_at, room ids)
+        self.last_change_id = 0
+        self.last_poll = 0.0
+        self.pid = os.getpid()
+        self._lock = threading.RLock()
+
+    # ---- loading and change replay ----
+
+    def _reset(self):
+        self.loaded_from = None
+        self.doctors = {}
+        self.rooms = {}
+        self.appointments = {}
+        self.last_change_id = 0
+        self.pid = os.getpid()
+
+    def _put(self, appt_id, doctor_id, starts_at, ends_at, rooms):
+        self._drop(appt_id)
+        # Open-ended appointments never match the trigger's overlap test,
+        # so they are not indexed either.
+        if ends_at is None:
+            return
+        self.appointments[appt_id] = (doctor_id, starts_at, ends_at, set(rooms))
+        self.doctors.setdefault(doctor_id, IntervalIndex()).add(appt_id, starts_at, ends_at)
+        for room_id in rooms:
+            self.rooms.setdefault(room_id, IntervalIndex()).add(appt_id, starts_at, ends_at)
+
+    def _drop(self, appt_id):
+        entry = self.appointments.pop(appt_id, None)
+        if entry is None:
+            return
+        doctor_id, starts_at, ends_at, rooms = entry
+        self.doctors[doctor_id].remove(appt_id, starts_at, ends_at)
+        for room_id in rooms:
+            self.rooms[room_id].remove(appt_id, starts_at, ends_at)
+
+    def warm(self, conn):
+        with self._lock:
+            self._reset()
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM schedule_change_log")
+            self.last_change_id = cursor.fetchone()[0]
+
+            loaded_from = datetime.datetime.now() - self.horizon
+            cursor.execute("""
+                SELECT a.appt_id, a.doctor_id, a.starts_at, a.ends_at, ar.room_id
+                FROM appointment a
+                LEFT JOIN appointment_room ar ON ar.appt_id = a.appt_id
+                                             AND a.status <> 'cancelled'
+                WHERE a.ends_at >= %s
+                ORDER BY a.appt_id
+            """, (loaded_from,))
+            current = None
+            rooms = []
+            while True:
+                rows = cursor.fetchmany(LOAD_BATCH)
+                if not rows:
+                    break
+                for appt_id, doctor_id, starts_at, ends_at, room_id in rows:
+                    if current is not None and current[0] != appt_id:
+                        self._put(*current, rooms)
+                        rooms = []
+                    current = (appt_id, doctor_id, starts_at, ends_at)
+                    if room_id is not None:
+                        rooms.append(room_id)
+            if current is not None:
+                self._put(*current, rooms)
+            cursor.close()
+            self.loaded_from = loaded_from
+            self.last_poll = time.monotonic()
+
+    def catch_up(self, conn):
+        with self._lock:
+            if self.loaded_from is None or self.pid != os.getpid():
+                self.warm(conn)
+            cursor = conn.cursor()
+            # change_log.py prunes old rows but keeps the newest; if the
+            # oldest row left is past our position, changes we never saw
+            # are gone.
+            cursor.execute("SELECT MIN(change_id) FROM schedule_change_log")
+            oldest = cursor.fetchone()[0]
+            if oldest is not None and oldest > self.last_change_id + 1:
+                self.warm(conn)
+            cursor.execute("""
+                SELECT change_id, appt_id FROM schedule_change_log
+                WHERE change_id > %s ORDER BY change_id
+            """, (self.last_change_id,))
+            changes = cursor.fetchall()
+            if changes:
+                self.last_change_id = changes[-1][0]
+                appt_ids = sorted({appt_id for _, appt_id in changes})
+                placeholders = ", ".join(["%s"] * len(appt_ids))
+                cursor.execute("""
+                    SELECT a.appt_id, a.doctor_id, a.starts_at, a.ends_at, ar.room_id
+                    FROM appointment a
+                    LEFT JOIN appointment_room ar ON ar.appt_id = a.appt_id
+                                                 AND a.status <> 'cancelled'
+                    WHERE a.appt_id IN (%s)
+                """ % placeholders, appt_ids)
+                current = {}
+                for appt_id, doctor_id, starts_at, ends_at, room_id in cursor.fetchall():
+                    entry = current.setdefault(appt_id, [doctor_id, starts_at, ends_at, []])
+                    if room_id is not None:
+                        entry[3].append(room_id)
+                for appt_id in appt_ids:
+                    if appt_id in current:
+                        self._put(appt_id, *current[appt_id])
+                    else:
+                        self._drop(appt_id)
+            cursor.close()
+            self.last_poll = time.monotonic()
+
+    def refresh(self, conn):
+        # Read-only callers tolerate POLL_INTERVAL of lag from other workers.
+        with self._lock:
+            if (self.loaded_from is not None and self.pid == os.getpid()
+                    and time.monotonic() - self.last_poll < POLL_INTERVAL):
+                return
+            self.catch_up(conn)
+
+    # ---- queries ----
+
+    def _covers(self, starts_at):
+        return self.loaded_from is not None and starts_at >= self.loaded_from
+
+    def _db_conflicts(self, conn, column, key, starts_at, ends_at):
+        # Probes older than the in-memory horizon go straight to the table.
+        cursor = conn.cursor()
+        if column == "doctor_id":
+            cursor.execute("""
+                SELECT appt_id, starts_at, ends_at FROM appointment
+                WHERE doctor_id = %s AND starts_at < %s AND ends_at > %s
+                ORDER BY starts_at
+            """, (key, ends_at, starts_at))
+        else:
+            cursor.execute("""
+                SELECT a.appt_id, a.starts_at, a.ends_at
+                FROM appointment_room ar
+                JOIN appointment a ON a.appt_id = ar.appt_id
+                WHERE ar.room_id = %s AND a.starts_at < %s AND a.ends_at > %s
+                  AND a.status <> 'cancelled'
+                ORDER BY a.starts_at
+            """, (key, ends_at, starts_at))
+        rows = cursor.fetchall()
+        cursor.close()
+        return [Conflict(*row) for row in rows]
+
+    def doctor_conflicts(self, conn, doctor_id, starts_at, ends_at, lock=False, exclude=None):
+        """Appointments of ``doctor_id`` overlapping [starts_at, ends_at).
+
+        With ``lock=True`` this must be the first statement of the booking
+        transaction: the doctor row stays locked until commit, so the insert
+        that follows cannot race with another worker's check.
+        """
+        return self._conflicts(conn, "doctor_id", doctor_id, starts_at, ends_at, lock, exclude)
+
+    def room_conflicts(self, conn, room_id, starts_at, ends_at, lock=False, exclude=None):
+        return self._conflicts(conn, "room_id", room_id, starts_at, ends_at, lock, exclude)
+
+    def _conflicts(self, conn, column, key, starts_at, ends_at, lock, exclude):
+        if lock:
+            table = "doctor" if column == "doctor_id" else "clinic_room"
+            get_repository(conn).lock_row(table, column, key)
+            self.catch_up(conn)
+        else:
+            self.refresh(conn)
+
+        with self._lock:
+            if self._covers(starts_at):
+                indexes = self.doctors if column == "doctor_id" else self.rooms
+                index = indexes.get(key)
+                found = index.overlapping(starts_at, ends_at) if index else []
+            else:
+                found = None
+        if found is None:
+            found = self._db_conflicts(conn, column, key, starts_at, ends_at)
+        return [c for c in found if c.appt_id != exclude]
+
+    def busy(self, conn, doctor_id=None, room_id=None, starts_at=None, ends_at=None):
+        """Sorted busy (start, end) pairs for a doctor and/or room in a window."""
+        self.refresh(conn)
+        result = {}
+        with self._lock:
+            covered = self._covers(starts_at)
+            for column, key, indexes in (("doctor_id", doctor_id, self.doctors),
+                                         ("room_id", room_id, self.rooms)):
+                if key is None or not covered:
+                    continue
+                index = indexes.get(key)
+                result[column] = index.busy(starts_at, ends_at) if index else []
+        for column, key in (("doctor_id", doctor_id), ("room_id", room_id)):
+            if key is not None and column not in result:
+                result[column] = [(c.starts_at, c.ends_at) for c in
+                                  self._db_conflicts(conn, column, key, starts_at, ends_at)]
+        return result.get("doctor_id"), result.get("room_id")
+
+    # ---- local writes ----
+
+    def booked(self, appt_id, doctor_id, starts_at, ends_at):
+        with self._lock:
+            if self.loaded_from is not None:
+                entry = self.appointments.get(appt_id)
+                rooms = entry[3] if entry else ()
+                self._put(appt_id, doctor_id, starts_at, ends_at, rooms)
+
+    def room_assigned(self, appt_id, room_id):
+        with self._lock:
+            entry = self.appointments.get(appt_id)
+            if entry is not None and room_id not in entry[3]:
+                self._put(appt_id, entry[0], entry[1], entry[2], entry[3] | {room_id})
+
+    def removed(self, appt_id):
+        with self._lock:
+            self._drop(appt_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "appointments": len(self.appointments),
+                "doctors": len(self.doctors),
+                "rooms": len(self.rooms),
+                "loaded_from": self.loaded_from.isoformat() if self.loaded_from else None,
+                "last_change_id": self.last_change_id,
+            }
+
+
+schedule = ScheduleIndex()
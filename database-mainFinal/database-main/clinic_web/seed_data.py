@@ -0,0 +1,300 @@
+"""Fill an empty clinic schema with seeded synthetic data.
+
+Every table in tables.sql gets rows, in foreign key order, generated from one
+random.Random(seed) so the same arguments always produce the same database.
+Rows are streamed into executemany() chunks, so memory stays flat at any
+scale; the triggers run as they would for the app, keeping the audit log,
+change logs, billing summaries and pending_work consistent.
+
+Appointments are laid out on a 30 minute grid (08:00-18:00) per doctor and
+never overlap for the same doctor, so trg_appt_before_insert accepts them.
+The newest appointments run to --until (default: 30 days from today; pass it
+explicitly for identical runs on different days), so the dashboard and
+assign pages see a realistic mix of past and upcoming work.
+
+    python seed_data.py --patients 1000000 --appointments 10000000 --doctors 2000
+    python seed_data.py --patients 2000 --appointments 20000 --seed 7    # quick dev data
+"""
+import argparse
+import datetime
+import math
+import random
+import sys
+import time
+
+from db import AUDIT_MODE, get_pool, set_trigger_audit
+from ids import allocator
+
+FIRST_NAMES = [
+    "Fatima", "Youssef", "Amina", "Karim", "Laila", "Ahmed", "Sara", "Omar", "Nadia",
+    "Hassan", "Salma", "Mehdi", "Imane", "Rachid", "Khadija", "Hamza", "Zineb", "Anas",
+    "Meryem", "Ilyas", "Hajar", "Adam", "Noura", "Samir", "Ghita", "Yassine", "Houda",
+    "Bilal", "Asmae", "Reda", "Sofia", "Tariq", "Lina", "Walid", "Dounia", "Ayoub",
+]
+LAST_NAMES = [
+    "Alaoui", "Bennani", "Tazi", "El Idrissi", "Berrada", "Chraibi", "Fassi", "Lahlou",
+    "Benjelloun", "Sqalli", "Kettani", "Amrani", "Ouazzani", "Cherkaoui", "Naciri",
+    "Benkirane", "Filali", "Hajji", "Mansouri", "Zerouali", "Skalli", "Bouzid", "Rami",
+    "Jabri", "Ziani", "Guessous", "Lamrani", "Belhaj", "Sebti", "Marrakchi",
+]
+CITIES = ["Ifrane", "Fes", "Rabat", "Marrakech", "Casablanca", "Tangier", "Meknes",
+          "Agadir", "Oujda", "Tetouan", "Kenitra", "El Jadida"]
+SPECIALTIES = ["General Practitioner", "Pediatrics", "Cardiology", "Dermatology",
+               "Orthopedics", "Neurology", "Gynecology", "Ophthalmology", "ENT", "Psychiatry"]
+FORMS = ["Tablet", "Capsule", "Syrup", "Injection", "Cream", "Inhaler"]
+STRENGTHS = ["5mg", "10mg", "20mg", "50mg", "100mg", "250mg", "500mg", "1g"]
+DRUG_PARTS = ["amo", "para", "ibu", "meto", "atro", "clari", "losa", "sima", "ome",
+              "cefa", "dexa", "levo", "pred", "salbu", "war"]
+DRUG_ENDINGS = ["xicillin", "cetamol", "profen", "formin", "vastatin", "thromycin",
+                "rtan", "prazole", "lexin", "methasone", "floxacin", "nisone", "tamol", "farin"]
+ROUTES = ["oral", "intravenous", "intramuscular", "topical", "inhalation", "subcutaneous"]
+PAYMENT_METHODS = ["cash", "card", "insurance", "check", "online"]
+REASONS = ["Checkup", "Follow-up", "Consultation", "Vaccination", "Chest pain", "Fever",
+           "Back pain", "Skin rash", "Headache", "Prescription renewal", "Lab review"]
+LAB_TESTS = ["Complete blood count", "Lipid panel", "HbA1c", "Thyroid panel",
+             "Urinalysis", "Vitamin D", "Liver function", "X-ray"]
+ROOM_TYPES = ["Consultation", "Pediatrics", "Laboratory", "Imaging", "Procedure"]
+
+SLOT_MINUTES = 30
+DAY_START_HOUR = 8
+SLOTS_PER_DAY = 20
+
+INSERTS = {
+    "insurance_plan": "INSERT INTO insurance_plan (plan_id, provider_name, plan_name, coverage_details) VALUES (%s, %s, %s, %s)",
+    "clinic_room": "INSERT INTO clinic_room (room_id, room_name, room_type, notes) VALUES (%s, %s, %s, %s)",
+    "specialty": "INSERT INTO specialty (specialty_id, specialty_name) VALUES (%s, %s)",
+    "patient": "INSERT INTO patient (patient_id, full_name, dob, email, phone, address, plan_id) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+    "doctor": "INSERT INTO doctor (doctor_id, full_name, email, phone) VALUES (%s, %s, %s, %s)",
+    "doctor_specialty": "INSERT INTO doctor_specialty (doctor_id, specialty_id) VALUES (%s, %s)",
+    "medication_form": "INSERT INTO medication_form (form_id, form_name) VALUES (%s, %s)",
+    "medication": "INSERT INTO medication (med_id, med_name, notes) VALUES (%s, %s, %s)",
+    "medication_variant": "INSERT INTO medication_variant (variant_id, med_id, form_id, strength) VALUES (%s, %s, %s, %s)",
+    "appointment": "INSERT INTO appointment (appt_id, patient_id, doctor_id, starts_at, ends_at, status, reason) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+    "appointment_room": "INSERT INTO appointment_room (appt_id, room_id) VALUES (%s, %s)",
+    "prescription": "INSERT INTO prescription (rx_id, appt_id, variant_id, dosage, route, frequency, instructions, quantity) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+    "billing": "INSERT INTO billing (bill_id, appt_id, amount, payment_status, payment_method, billing_date) VALUES (%s, %s, %s, %s, %s, %s)",
+    "lab_test": "INSERT INTO lab_test (test_id, appt_id, test_name, status, test_date) VALUES (%s, %s, %s, %s, %s)",
+    "lab_test_result": "INSERT INTO lab_test_result (test_id, result_detail) VALUES (%s, %s)",
+}
+
+# Children of appointment, flushed after each appointment chunk.
+APPOINTMENT_CHILDREN = ["appointment_room", "prescription", "billing", "lab_test", "lab_test_result"]
+
+
+class Loader:
+    def __init__(self, conn, chunk_size):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.buffers = {table: [] for table in INSERTS}
+        self.counts = {table: 0 for table in INSERTS}
+        self.started = time.monotonic()
+
+    def add(self, table, row):
+        self.buffers[table].append(row)
+
+    def full(self, table):
+        return len(self.buffers[table]) >= self.chunk_size
+
+    def flush(self, *tables):
+        cursor = self.conn.cursor()
+        for table in tables:
+            rows = self.buffers[table]
+            if rows:
+                cursor.executemany(INSERTS[table], rows)
+                self.counts[table] += len(rows)
+                self.buffers[table] = []
+        self.conn.commit()
+        cursor.close()
+
+    def progress(self, label, done, total):
+        elapsed = time.monotonic() - self.started
+        print("%s: %d/%d (%.0f rows/s)" % (label, done, total, done / max(elapsed, 1e-9)),
+              file=sys.stderr)
+
+
+def person_name(rng):
+    return "%s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+
+
+def email_for(name, key, domain):
+    return "%s.%d@%s" % (name.lower().replace(" ", "."), key, domain)
+
+
+def seed_reference(loader, rng, args):
+    providers = ["CNSS", "CNOPS", "AXA Assurance", "Mutuelle Marocaine", "Saham", "Wafa Assurance"]
+    for plan_id in range(1, args.plans + 1):
+        loader.add("insurance_plan", (plan_id, providers[plan_id % len(providers)],
+                                      "Plan %d" % plan_id, "Covers %d%% of costs" % rng.choice([60, 70, 80, 90, 100])))
+    for room_id in range(1, args.rooms + 1):
+        loader.add("clinic_room", (room_id, "Room %d" % room_id, rng.choice(ROOM_TYPES), "Floor %d" % (room_id % 4)))
+    for specialty_id, name in enumerate(SPECIALTIES, 1):
+        loader.add("specialty", (specialty_id, name))
+    for form_id, name in enumerate(FORMS, 1):
+        loader.add("medication_form", (form_id, name))
+    loader.flush("insurance_plan", "clinic_room", "specialty", "medication_form")
+
+    variant_id = 0
+    for med_id in range(1, args.medications + 1):
+        name = "%s%s %d" % (rng.choice(DRUG_PARTS).capitalize(), rng.choice(DRUG_ENDINGS), med_id)
+        loader.add("medication", (med_id, name, None))
+        for form_id, strength in sorted(rng.sample([(f, s) for f in range(1, len(FORMS) + 1)
+                                                    for s in STRENGTHS], rng.randint(1, 3))):
+            variant_id += 1
+            loader.add("medication_variant", (variant_id, med_id, form_id, strength))
+    loader.flush("medication", "medication_variant")
+    return variant_id
+
+
+def seed_people(loader, rng, args):
+    for doctor_id in range(1, args.doctors + 1):
+        name = person_name(rng)
+        loader.add("doctor", (doctor_id, "Dr. " + name, email_for(name, doctor_id, "clinic.com"),
+                              "+2126%08d" % doctor_id))
+        for specialty_id in rng.sample(range(1, len(SPECIALTIES) + 1), rng.choice([1, 1, 1, 2])):
+            loader.add("doctor_specialty", (doctor_id, specialty_id))
+    loader.flush("doctor", "doctor_specialty")
+
+    today = datetime.date.today()
+    for patient_id in range(1, args.patients + 1):
+        name = person_name(rng)
+        dob = today - datetime.timedelta(days=rng.randint(365, 90 * 365))
+        email = email_for(name, patient_id, "example.com") if rng.random() < 0.9 else None
+        plan_id = rng.randint(1, args.plans) if rng.random() < 0.8 else None
+        loader.add("patient", (patient_id, name, dob, email, "+2127%08d" % patient_id,
+                               "%s, Morocco" % rng.choice(CITIES), plan_id))
+        if loader.full("patient"):
+            loader.flush("patient")
+            if patient_id % (loader.chunk_size * 50) == 0:
+                loader.progress("patients", patient_id, args.patients)
+    loader.flush("patient")
+
+
+def appointment_grid(args):
+    """Yield (doctor_id, starts_at) in time order, never twice for a doctor's slot."""
+    # Spread over at least --days, denser only when --occupancy would not fit.
+    slots_per_day = args.doctors * SLOTS_PER_DAY
+    days = max(args.days, int(math.ceil(args.appointments / (slots_per_day * args.occupancy))))
+    occupancy = min(1.0, args.appointments / float(days * slots_per_day))
+    first_day = args.until - datetime.timedelta(days=days - 1)
+    slot_rng = random.Random(args.seed + 1)
+    produced = 0
+    day = first_day
+    while produced < args.appointments:
+        for slot in range(SLOTS_PER_DAY):
+            starts_at = datetime.datetime.combine(day, datetime.time(DAY_START_HOUR)) + \
+                datetime.timedelta(minutes=slot * SLOT_MINUTES)
+            for doctor_id in range(1, args.doctors + 1):
+                if slot_rng.random() >= occupancy:
+                    continue
+                yield doctor_id, starts_at
+                produced += 1
+                if produced >= args.appointments:
+                    return
+        day += datetime.timedelta(days=1)
+
+
+def seed_appointments(loader, rng, args, variant_count):
+    now = datetime.datetime.now()
+    rx_id = bill_id = test_id = 0
+    for appt_id, (doctor_id, starts_at) in enumerate(appointment_grid(args), 1):
+        # Skewed towards low ids so many patients come back repeatedly.
+        patient_id = int(args.patients * rng.random() ** 1.5) + 1
+        ends_at = starts_at + datetime.timedelta(minutes=rng.choice([15, 20, 30]))
+        past = ends_at < now
+        if past:
+            status = "cancelled" if rng.random() < 0.08 else "completed"
+        else:
+            status = "cancelled" if rng.random() < 0.04 else "scheduled"
+        loader.add("appointment", (appt_id, patient_id, doctor_id, starts_at, ends_at,
+                                   status, rng.choice(REASONS)))
+
+        if status != "cancelled":
+            if rng.random() < args.roomed:
+                loader.add("appointment_room", (appt_id, (doctor_id - 1) % args.rooms + 1))
+            if status == "completed" and rng.random() < args.prescribed:
+                rx_id += 1
+                loader.add("prescription", (
+                    rx_id, appt_id, rng.randint(1, variant_count), "%d tablet(s)" % rng.randint(1, 2),
+                    rng.choice(ROUTES), rng.choice(["once daily", "twice daily", "every 8 hours"]),
+                    None, rng.randint(1, 60)))
+            if status == "completed" and rng.random() < args.billed:
+                bill_id += 1
+                paid = rng.random() < 0.75
+                loader.add("billing", (
+                    bill_id, appt_id, "%d.%02d" % (rng.randint(100, 2000), rng.choice([0, 50])),
+                    "paid" if paid else "unpaid", rng.choice(PAYMENT_METHODS), starts_at.date()))
+            if rng.random() < args.lab:
+                test_id += 1
+                lab_done = past and rng.random() < 0.9
+                loader.add("lab_test", (test_id, appt_id, rng.choice(LAB_TESTS),
+                                        "completed" if lab_done else "pending", starts_at.date()))
+                if lab_done:
+                    loader.add("lab_test_result", (test_id, rng.choice(["Normal", "Borderline", "Abnormal"])))
+
+        if loader.full("appointment"):
+            loader.flush("appointment", *APPOINTMENT_CHILDREN)
+            if appt_id % (loader.chunk_size * 50) == 0:
+                loader.progress("appointments", appt_id, args.appointments)
+    loader.flush("appointment", *APPOINTMENT_CHILDREN)
+
+
+def check_empty(conn):
+    cursor = conn.cursor()
+    for table in ("patient", "doctor", "appointment"):
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM %s)" % table)
+        if cursor.fetchone()[0]:
+            cursor.close()
+            raise SystemExit("%s already has rows; seed_data.py expects a freshly created schema" % table)
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a seeded synthetic clinic database.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--appointments", type=int, default=100000)
+    parser.add_argument("--doctors", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--plans", type=int, default=12)
+    parser.add_argument("--medications", type=int, default=300)
+    parser.add_argument("--days", type=int, default=365, help="minimum span of the appointment history")
+    parser.add_argument("--occupancy", type=float, default=0.8, help="maximum share of grid slots booked")
+    parser.add_argument("--billed", type=float, default=0.85, help="share of completed appointments billed")
+    parser.add_argument("--prescribed", type=float, default=0.6, help="share of completed appointments with a prescription")
+    parser.add_argument("--roomed", type=float, default=0.9, help="share of appointments with a room")
+    parser.add_argument("--lab", type=float, default=0.1, help="share of appointments with a lab test")
+    parser.add_argument("--until", type=datetime.date.fromisoformat,
+                        default=datetime.date.today() + datetime.timedelta(days=30),
+                        help="last day of the appointment grid (default: 30 days from today)")
+    parser.add_argument("--chunk", type=int, default=5000, help="rows per executemany and commit")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = get_pool().acquire()
+    # The generated history is audited by the triggers in either audit mode.
+    set_trigger_audit(conn, True)
+    try:
+        check_empty(conn)
+        loader = Loader(conn, args.chunk)
+        variant_count = seed_reference(loader, rng, args)
+        seed_people(loader, rng, args)
+        seed_appointments(loader, rng, args, variant_count)
+    finally:
+        set_trigger_audit(conn, AUDIT_MODE != "app")
+        conn.close()
+
+    # Keep the app's id blocks clear of the generated ids.
+    for sequence, table in (("patient", "patient"), ("appointment", "appointment"),
+                            ("billing", "billing"), ("prescription", "prescription"),
+                            ("medication", "medication"), ("medication_variant", "medication_variant"),
+                            ("clinic_room", "clinic_room")):
+        allocator.advance(sequence, loader.counts[table] + 1)
+
+    elapsed = time.monotonic() - loader.started
+    for table, count in loader.counts.items():
+        print("%-20s %d" % (table, count))
+    print("done in %.1fs" % elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Production server: preforked gunicorn workers with a preloaded, warmed app.
+
+    python serve.py                               # CLINIC_BIND, default 0.0.0.0:8000
+    python serve.py --bind 127.0.0.1:8080 --workers 4 --threads 8
+
+Needs gunicorn (pip install gunicorn); `python app.py` stays the debug
+server for development.
+
+The master imports app.py and compiles every template before forking, so
+workers start with that work done and share the memory copy-on-write. It
+opens no database connections: each worker builds its own pool after the
+fork (db.get_pool is per process), opens POOL_SIZE connections and fills the
+reference data, schedule and name indexes (app.warm_up) before it accepts
+its first connection. Workers default to 2 * cores + 1, each running
+--threads request threads; mind that the database sees up to
+workers * (CLINIC_DB_POOL_SIZE + CLINIC_DB_POOL_MAX_OVERFLOW) connections.
+
+Load balancers and orchestrators should probe /readyz (warm, pool healthy)
+for routing and /healthz for liveness.
+
+Reloading without dropping requests:
+
+    kill -HUP <master>     new workers are forked and warmed, then the old
+                           ones finish their requests and exit
+    kill -USR2 <master>    new code: starts a second master with fresh
+                           workers; once /readyz answers, kill -TERM the old
+                           master (HUP alone keeps the preloaded code)
+
+Old workers get --graceful-timeout seconds to finish in-flight requests.
+"""
+import argparse
+import multiprocessing
+import os
+
+BIND = os.environ.get("CLINIC_BIND", "0.0.0.0:8000")
+WORKERS = int(os.environ.get("CLINIC_WORKERS", 0)) or 2 * multiprocessing.cpu_count() + 1
+THREADS = int(os.environ.get("CLINIC_THREADS", 4))
+TIMEOUT = int(os.environ.get("CLINIC_WORKER_TIMEOUT", 60))
+GRACEFUL_TIMEOUT = int(os.environ.get("CLINIC_GRACEFUL_TIMEOUT", 30))
+# Restart workers now and then so slow leaks cannot build up; the jitter
+# keeps them from all restarting (and warming) at once.
+MAX_REQUESTS = int(os.environ.get("CLINIC_MAX_REQUESTS", 20000))
+
+
+# ------- gunicorn hooks --------
+
+def post_worker_init(worker):
+    # Runs in the worker after the fork and before its accept loop.
+    import app
+    try:
+        app.warm_up()
+    except Exception:
+        # Keep the worker: /readyz reports 503 and retries the warmup.
+        worker.log.exception("worker %s failed to warm up", worker.pid)
+        return
+    worker.log.info("worker %s warm in %.3fs", worker.pid, app.warm_state["seconds"])
+
+
+def options(args):
+    return {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": args.threads,
+        "preload_app": True,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS // 10,
+        "post_worker_init": post_worker_init,
+        "accesslog": "-",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the clinic app under gunicorn.")
+    parser.add_argument("--bind", default=BIND)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--timeout", type=int, default=TIMEOUT)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        parser.error("gunicorn is not installed (pip install gunicorn)")
+
+    class ClinicServer(BaseApplication):
+        def load_config(self):
+            for key, value in options(args).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Called once in the master because of preload_app.
+            import app
+            app.preload_templates()
+            return app.app
+
+    ClinicServer().run()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
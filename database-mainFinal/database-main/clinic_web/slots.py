@@ -0,0 +1,79 @@
+import datetime
+import heapq
+import itertools
+
+# Free-slot search over sorted busy lists.
+#
+# Doctor bookings, room bookings and the clinic's closed hours are each
+# sorted by start, so one heapq.merge walks them together; overlapping busy
+# intervals are coalesced on the fly and every gap between them is cut into
+# slots. The cost is linear in the number of busy intervals in the window,
+# with no per-candidate queries.
+
+DEFAULT_DAY_START = datetime.time(8, 0)
+DEFAULT_DAY_END = datetime.time(18, 0)
+
+
+def closed_hours(window_start, window_end, day_start=DEFAULT_DAY_START, day_end=DEFAULT_DAY_END):
+    """Yield, in order, the intervals outside opening hours within the window."""
+    day = window_start.date() - datetime.timedelta(days=1)
+    while True:
+        close = datetime.datetime.combine(day, day_end)
+        day += datetime.timedelta(days=1)
+        reopen = datetime.datetime.combine(day, day_start)
+        if close >= window_end:
+            return
+        yield close, reopen
+
+
+def merge_busy(*busy_lists):
+    """Merge sorted (start, end) lists into sorted, non-overlapping intervals."""
+    current = None
+    for start, end in heapq.merge(*busy_lists):
+        if current is None:
+            current = [start, end]
+        elif start <= current[1]:
+            current[1] = max(current[1], end)
+        else:
+            yield tuple(current)
+            current = [start, end]
+    if current is not None:
+        yield tuple(current)
+
+
+def _align(moment, step):
+    # Round up to the next multiple of ``step`` since midnight.
+    midnight = datetime.datetime.combine(moment.date(), datetime.time())
+    remainder = (moment - midnight) % step
+    return moment if not remainder else moment + (step - remainder)
+
+
+def free_slots(busy, window_start, window_end, duration, count, step):
+    """Earliest ``count`` free [start, end) slots of ``duration`` in the window.
+
+    Every slot starts on a multiple of ``step`` since midnight, and slots
+    do not overlap: the next candidate is the first step boundary at or
+    after the previous slot's end.
+    """
+    slots = []
+    cursor = window_start
+    for start, end in itertools.chain(busy, [(window_end, window_end)]):
+        gap_end = min(start, window_end)
+        slot_start = _align(cursor, step)
+        while slot_start + duration <= gap_end:
+            slots.append((slot_start, slot_start + duration))
+            if len(slots) >= count:
+                return slots
+            slot_start = _align(slot_start + duration, step)
+        cursor = max(cursor, end)
+        if cursor >= window_end:
+            break
+    return slots
+
+
+def find_slots(doctor_busy, room_busy, window_start, window_end, duration, count,
+               step=datetime.timedelta(minutes=15),
+               day_start=DEFAULT_DAY_START, day_end=DEFAULT_DAY_END):
+    busy = merge_busy(doctor_busy or [], room_busy or [],
+                      closed_hours(window_start, window_end, day_start, day_end))
+    return free_slots(busy, window_start, window_end, duration, count, step)
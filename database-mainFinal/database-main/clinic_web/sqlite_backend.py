@@ -0,0 +1,181 @@
+import datetime
+import os
+import re
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+
+# Embedded SQLite engine behind the same connection / cursor API the app uses
+# with mysql-connector, so the pool, the instrumentation and the repository
+# layer run unchanged in-process (tests, benchmarks, profiling).
+#
+# The schema lives in ../schema_sqlite.sql and mirrors tables.sql with the
+# same CHECKs, plus triggers reproducing triggers.sql: the overlap and
+# start/end checks (same messages), the audit_log entries, the change logs,
+# the billing summaries and pending_work. Statements are written in the
+# mysql-connector paramstyle (%s, %(name)s) and translated here; anything
+# that is not portable SQL goes through repository.SQLiteRepository.
+# Open database files through connect(): the audit triggers call a function
+# it registers on each connection.
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "schema_sqlite.sql")
+BUSY_TIMEOUT_MS = int(os.environ.get("CLINIC_SQLITE_BUSY_TIMEOUT_MS", 10000))
+# Benchmarks only: added to every statement to stand in for the network
+# round trip (and GIL-free wait) of a database server.
+LATENCY_MS = float(os.environ.get("CLINIC_SQLITE_LATENCY_MS", 0))
+
+Error = sqlite3.Error
+
+_PARAM = re.compile(r"%\((\w+)\)s|%s|%%")
+_schema_lock = threading.Lock()
+
+
+def _register_types():
+    sqlite3.register_adapter(datetime.datetime, lambda v: v.isoformat(" "))
+    sqlite3.register_adapter(datetime.date, lambda v: v.isoformat())
+    sqlite3.register_adapter(Decimal, str)
+    sqlite3.register_converter("DATETIME", lambda b: datetime.datetime.fromisoformat(b.decode()))
+    sqlite3.register_converter("DATE", lambda b: datetime.date.fromisoformat(b.decode()[:10]))
+    sqlite3.register_converter("DECIMAL", lambda b: Decimal(b.decode()).quantize(Decimal("0.01")))
+
+
+_register_types()
+
+
+def translate(sql, params):
+    # Like mysql-connector, %% only means a literal % when parameters are
+    # passed; without them the statement is sent as written.
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8")
+    if params is None:
+        return sql
+
+    def replace(match):
+        if match.group(1):
+            return ":" + match.group(1)
+        return "?" if match.group(0) == "%s" else "%"
+
+    return _PARAM.sub(replace, sql)
+
+
+class Cursor:
+    def __init__(self, raw):
+        self._raw = raw
+
+    def execute(self, operation, params=None):
+        if LATENCY_MS:
+            time.sleep(LATENCY_MS / 1000.0)
+        if isinstance(params, list):
+            params = tuple(params)
+        self._raw.execute(translate(operation, params), params if params is not None else ())
+
+    def executemany(self, operation, seq_params):
+        seq_params = [tuple(p) if isinstance(p, list) else p for p in seq_params]
+        if not seq_params:
+            return
+        self._raw.executemany(translate(operation, seq_params[0]), seq_params)
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._raw.lastrowid
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def fetchone(self):
+        return self._raw.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._raw.fetchmany(size)
+
+    def fetchall(self):
+        return self._raw.fetchall()
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def close(self):
+        self._raw.close()
+
+
+class Connection:
+    """sqlite3 connection dressed up as a mysql-connector one."""
+
+    unread_result = False
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._closed = False
+        # Stands in for MySQL's @clinic_app_audit: the audit triggers call
+        # clinic_app_audit() and skip the row when it returns 1.
+        self.app_audit = False
+        raw.create_function("clinic_app_audit", 0, lambda: int(self.app_audit))
+
+    def cursor(self, *args, **kwargs):
+        return Cursor(self._raw.cursor())
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def begin_immediate(self):
+        # SQLite locks the whole database, not rows: taking the write lock
+        # up front is what stands in for SELECT ... FOR UPDATE / FOR SHARE.
+        if not self._raw.in_transaction:
+            self._raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def consume_results(self):
+        pass
+
+    def is_connected(self):
+        return not self._closed
+
+    def close(self):
+        self._closed = True
+        self._raw.close()
+
+    shutdown = close
+
+
+def _has_schema(raw):
+    return raw.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'appointment'"
+    ).fetchone() is not None
+
+
+def init_schema(raw):
+    with _schema_lock:
+        if _has_schema(raw):
+            return
+        with open(SCHEMA_PATH) as f:
+            raw.executescript(f.read())
+        raw.commit()
+
+
+def connect(path):
+    # ":memory:" becomes a named shared-cache database so every pooled
+    # connection of the process sees the same data.
+    uri = path.startswith("file:")
+    if path == ":memory:":
+        path, uri = "file:clinic?mode=memory&cache=shared", True
+    raw = sqlite3.connect(path, uri=uri, detect_types=sqlite3.PARSE_DECLTYPES,
+                          check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000.0)
+    raw.execute("PRAGMA foreign_keys = ON")
+    if not uri:
+        raw.execute("PRAGMA journal_mode = WAL")
+        raw.execute("PRAGMA synchronous = NORMAL")
+    init_schema(raw)
+    return Connection(raw)
@@ -0,0 +1,306 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from flask import g, has_app_context, request
+
+# Per-request SQL instrumentation.
+#
+# Every cursor handed out by db.PooledConnection is wrapped so that execute
+# and fetch calls are timed. A statement's time runs from execute() until its
+# result is exhausted, the cursor runs something else or is closed, or the
+# request ends, so unbuffered reads count their transfer time too. Each
+# request gets a Server-Timing header; each route keeps a reservoir of recent
+# latencies (for percentiles) and fixed-bucket histograms; statements slower
+# than SLOW_QUERY_MS go to the "clinic.slow_sql" logger with their SQL
+# normalised (literals replaced by ?), never with parameter values.
+
+SLOW_QUERY_MS = float(os.environ.get("CLINIC_SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG = os.environ.get("CLINIC_SLOW_QUERY_LOG")
+RESERVOIR_SIZE = 2048
+MAX_STATEMENTS = 500
+# Upper bounds in ms; the last bucket is open-ended.
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+slow_log = logging.getLogger("clinic.slow_sql")
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.INFO)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize(sql):
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8", "replace")
+    sql = _STRING.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def as_dict(self):
+        labels = ["<=%g" % b for b in BUCKETS_MS] + [">%g" % BUCKETS_MS[-1]]
+        return dict(zip(labels, self.counts))
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.queries = 0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)     # (total ms, db ms)
+        self.latency = Histogram()
+        self.db_time = Histogram()
+
+    def add(self, total_ms, db_ms, queries, failed):
+        self.requests += 1
+        self.errors += failed
+        self.queries += queries
+        self.samples.append((total_ms, db_ms))
+        self.latency.add(total_ms)
+        self.db_time.add(db_ms)
+
+    def as_dict(self):
+        totals = sorted(s[0] for s in self.samples)
+        dbs = sorted(s[1] for s in self.samples)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "queries_per_request": round(self.queries / self.requests, 2) if self.requests else 0,
+            "latency_ms": {"p50": _percentile(totals, 0.5), "p95": _percentile(totals, 0.95),
+                           "p99": _percentile(totals, 0.99)},
+            "db_ms": {"p50": _percentile(dbs, 0.5), "p95": _percentile(dbs, 0.95),
+                      "p99": _percentile(dbs, 0.99)},
+            "latency_histogram_ms": self.latency.as_dict(),
+            "db_histogram_ms": self.db_time.as_dict(),
+        }
+
+
+class Registry:
+    """Process-wide aggregates behind /debug/stats."""
+
+    def __init__(self):
+        self.routes = {}
+        self.statements = {}      # normalised sql -> [count, total s, max s, rows]
+        self._lock = threading.Lock()
+
+    def add_request(self, route, total_ms, db_ms, queries, failed):
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.add(total_ms, db_ms, queries, failed)
+
+    def add_statement(self, sql, seconds, rows):
+        with self._lock:
+            entry = self.statements.get(sql)
+            if entry is None:
+                if len(self.statements) >= MAX_STATEMENTS:
+                    sql = "(other)"
+                entry = self.statements.setdefault(sql, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += rows
+
+    def snapshot(self, top=25):
+        with self._lock:
+            routes = {route: stats.as_dict() for route, stats in sorted(self.routes.items())}
+            statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return {
+            "routes": routes,
+            "statements": [{
+                "sql": sql,
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / count, 3),
+                "max_ms": round(longest * 1000, 3),
+                "rows": rows,
+            } for sql, (count, total, longest, rows) in statements],
+        }
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+            self.statements.clear()
+
+
+registry = Registry()
+
+
+class RequestStats:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.open = []
+
+    def finish_statements(self):
+        for statement in self.open:
+            statement.finish()
+        self.open = []
+
+
+def current_stats():
+    return g.get("_sql_stats") if has_app_context() else None
+
+
+class Statement:
+    __slots__ = ("sql", "seconds", "rows", "stats", "done")
+
+    def __init__(self, sql, seconds, stats):
+        self.sql = sql
+        self.seconds = seconds
+        self.rows = 0
+        self.stats = stats
+        self.done = False
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        normalized = normalize(self.sql)
+        registry.add_statement(normalized, self.seconds, self.rows)
+        if self.stats is not None:
+            self.stats.queries += 1
+            self.stats.rows += self.rows
+            self.stats.db_seconds += self.seconds
+        ms = self.seconds * 1000
+        if ms >= SLOW_QUERY_MS:
+            slow_log.warning("%.1f ms rows=%d route=%s sql=%s", ms, self.rows,
+                             self.stats.route if self.stats else "-", normalized)
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._current = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def _finish(self):
+        if self._current is not None:
+            self._current.finish()
+            self._current = None
+
+    def _run(self, method, operation, args, kwargs):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(operation, *args, **kwargs)
+        finally:
+            stats = current_stats()
+            self._current = Statement(operation, time.perf_counter() - started, stats)
+            if stats is not None:
+                stats.open.append(self._current)
+
+    def execute(self, operation, *args, **kwargs):
+        return self._run(self._cursor.execute, operation, args, kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        return self._run(self._cursor.executemany, operation, args, kwargs)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        statement = self._current
+        if statement is not None:
+            statement.seconds += time.perf_counter() - started
+            if result is None or result == []:
+                self._finish()
+            else:
+                statement.rows += len(result) if isinstance(result, list) else 1
+                if method is self._cursor.fetchall:
+                    self._finish()
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+
+def instrument(cursor):
+    return InstrumentedCursor(cursor)
+
+
+# ------- Flask hooks --------
+
+def _route_name():
+    rule = request.url_rule
+    return "%s %s" % (request.method, rule.rule if rule is not None else "<unmatched>")
+
+
+def _start_request():
+    g._sql_stats = RequestStats(_route_name())
+
+
+def _server_timing(response):
+    stats = current_stats()
+    if stats is not None:
+        stats.finish_statements()
+        total_ms = (time.perf_counter() - stats.started) * 1000
+        response.headers.add("Server-Timing", 'db;dur=%.1f;desc="%d queries, %d rows"'
+                             % (stats.db_seconds * 1000, stats.queries, stats.rows))
+        response.headers.add("Server-Timing", "total;dur=%.1f" % total_ms)
+    return response
+
+
+def _record_request(exc=None):
+    stats = g.pop("_sql_stats", None)
+    if stats is None:
+        return
+    stats.finish_statements()
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    registry.add_request(stats.route, total_ms, stats.db_seconds * 1000,
+                         stats.queries, exc is not None)
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_server_timing)
+    app.teardown_request(_record_request)
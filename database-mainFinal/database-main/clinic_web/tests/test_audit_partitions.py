@@ -0,0 +1,103 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repository import MySQLRepository, next_month  # noqa: E402
+
+
+class PartitionedAuditLog(MySQLRepository):
+    """MySQLRepository over an in-memory, month-partitioned audit_log."""
+
+    def __init__(self, months, rows):
+        super().__init__(conn=None)
+        self.uppers = {"p%s" % m.strftime("%Y%m"): next_month(m) for m in months}
+        self.rows = list(rows)      # (log_id, performed_at)
+        self.dropped = []
+        self.chunked = []
+
+    def audit_partitions(self):
+        partitions = []
+        lower = None
+        for name, upper in sorted(self.uppers.items(), key=lambda item: item[1]):
+            partitions.append((name, lower, upper))
+            lower = upper
+        return partitions
+
+    def audit_range_stats(self, start, end):
+        ids = [log_id for log_id, at in self.rows if start <= at < end]
+        return len(ids), max(ids) if ids else None
+
+    def _run(self, sql, params=None):
+        name = sql.split("DROP PARTITION ")[1]
+        lower = ([p[1] for p in self.audit_partitions() if p[0] == name][0]
+                 or datetime.date.min)
+        upper = self.uppers.pop(name)
+        self.rows = [r for r in self.rows if not lower <= r[1].date() < upper]
+        self.dropped.append(name)
+        return 0
+
+    def _delete_audit_chunk(self, start, end, max_log_id, chunk):
+        doomed = [r for r in self.rows if start <= r[1] < end and r[0] <= max_log_id][:chunk]
+        self.rows = [r for r in self.rows if r not in doomed]
+        self.chunked.append(start.date())
+        return len(doomed)
+
+    def commit(self):
+        pass
+
+
+def _month(year, month):
+    return datetime.date(year, month, 1)
+
+
+def _archive(repo, months):
+    for month in months:
+        start = datetime.datetime.combine(month, datetime.time())
+        end = datetime.datetime.combine(next_month(month), datetime.time())
+        _, max_log_id = repo.audit_range_stats(start, end)
+        repo.purge_audit_range(start, end, max_log_id or 0)
+
+
+def test_consecutive_months_each_drop_their_partition():
+    months = [_month(2026, m) for m in range(1, 8)]
+    rows = [(n, datetime.datetime(2026, m, 10, 12)) for n, m in enumerate(range(1, 8), 1)]
+    repo = PartitionedAuditLog(months, rows)
+
+    _archive(repo, months[:6])
+
+    assert repo.dropped == ["p2026%02d" % m for m in range(1, 7)]
+    assert repo.chunked == []
+    assert list(repo.uppers) == ["p202607"]
+    assert repo.rows == [(7, datetime.datetime(2026, 7, 10, 12))]
+
+
+def test_rows_below_the_month_force_chunked_delete_then_drop():
+    months = [_month(2026, 2), _month(2026, 3)]
+    # p202602 is the first partition, so it also holds a January row.
+    rows = [(1, datetime.datetime(2026, 1, 20)), (2, datetime.datetime(2026, 2, 5)),
+            (3, datetime.datetime(2026, 3, 5))]
+    repo = PartitionedAuditLog(months, rows)
+
+    _archive(repo, [_month(2026, 2)])
+    assert repo.dropped == []
+    assert repo.chunked == [_month(2026, 2)]
+    assert (1, datetime.datetime(2026, 1, 20)) in repo.rows
+
+    _archive(repo, [_month(2026, 1)])
+    # Not the partition's month: chunked, and the now empty partition goes.
+    assert repo.dropped == ["p202602"]
+    assert repo.rows == [(3, datetime.datetime(2026, 3, 5))]
+
+
+def test_late_rows_keep_the_partition():
+    months = [_month(2026, 1), _month(2026, 2)]
+    rows = [(1, datetime.datetime(2026, 1, 3)), (2, datetime.datetime(2026, 1, 4))]
+    repo = PartitionedAuditLog(months, rows)
+
+    start, end = datetime.datetime(2026, 1, 1), datetime.datetime(2026, 2, 1)
+    repo.purge_audit_range(start, end, max_log_id=1)
+
+    assert repo.dropped == []
+    assert repo.rows == [(2, datetime.datetime(2026, 1, 4))]
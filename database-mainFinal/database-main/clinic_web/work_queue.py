@@ -0,0 +1,139 @@
+"""Pending-work queues for the add bill, assign medication and assign room pages.
+
+pending_work holds one row per appointment that still needs a bill, a
+prescription or a room. The triggers in triggers.sql (section 15) add the
+rows when an appointment is booked and drop them once the work is done, so
+reading a queue touches only open work, in (kind, starts_at) order, whatever
+the size of the appointment history.
+
+    python work_queue.py            # report queue entries that disagree with the tables
+    python work_queue.py --fix      # rebuild pending_work from the tables
+"""
+import argparse
+import datetime
+import os
+from urllib.parse import urlencode
+
+from db import get_pool
+from pagination import fetch_page, page_size
+
+WINDOW_DAYS = int(os.environ.get("CLINIC_WORK_QUEUE_DAYS", 30))
+
+# queue kind -> table whose rows close the work out
+KINDS = {
+    "bill": "billing",
+    "prescription": "prescription",
+    "room": "appointment_room",
+}
+
+
+def _parse_day(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def window(args):
+    """(since, until, query string) for the ?from=&to= date window.
+
+    Without ``from`` the queue starts WINDOW_DAYS back; ``to`` is inclusive
+    and open-ended when absent.
+    """
+    since = _parse_day(args.get("from"))
+    if since is None:
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        since = today - datetime.timedelta(days=WINDOW_DAYS)
+    until = _parse_day(args.get("to"))
+    if until is not None:
+        until += datetime.timedelta(days=1)
+
+    query = {"from": since.strftime("%Y-%m-%d")}
+    if until is not None:
+        query["to"] = (until - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    return since, until, "&" + urlencode(query)
+
+
+def pending_page(cursor, kind, args):
+    """One page of open ``kind`` work, newest appointment first.
+
+    Rows are (appt_id, patient name, doctor name, starts_at), the shape the
+    assign templates already use.
+    """
+    since, until, _ = window(args)
+    where = ["w.kind = %s", "w.starts_at >= %s"]
+    params = [kind, since]
+    if until is not None:
+        where.append("w.starts_at < %s")
+        params.append(until)
+
+    return fetch_page(cursor, """
+        SELECT w.appt_id, p.full_name, d.full_name, w.starts_at
+        FROM pending_work w
+        JOIN appointment a ON a.appt_id = w.appt_id
+        JOIN patient p ON p.patient_id = a.patient_id
+        JOIN doctor d ON d.doctor_id = a.doctor_id
+    """, columns=["w.starts_at", "w.appt_id"], key_index=[3, 0],
+        where=where, params=params,
+        after=args.get("after"), before=args.get("before"),
+        limit=page_size(args.get("limit")))
+
+
+def _expected(cursor, kind):
+    cursor.execute("""
+        SELECT a.appt_id FROM appointment a
+        WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.appt_id = a.appt_id)
+    """.format(table=KINDS[kind]))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def reconcile(conn):
+    """Return (kind, missing appt_ids, stale appt_ids) for queues that drifted."""
+    cursor = conn.cursor()
+    diffs = []
+    for kind in KINDS:
+        want = _expected(cursor, kind)
+        cursor.execute("SELECT appt_id FROM pending_work WHERE kind = %s", (kind,))
+        have = {row[0] for row in cursor.fetchall()}
+        if want != have:
+            diffs.append((kind, sorted(want - have), sorted(have - want)))
+    cursor.close()
+    return diffs
+
+
+def rebuild(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM pending_work")
+    for kind, table in KINDS.items():
+        cursor.execute("""
+            INSERT INTO pending_work (kind, appt_id, starts_at)
+            SELECT %s, a.appt_id, a.starts_at FROM appointment a
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.appt_id = a.appt_id)
+        """.format(table=table), (kind,))
+    conn.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check pending_work against the appointment tables.")
+    parser.add_argument("--fix", action="store_true", help="rebuild pending_work if it differs")
+    args = parser.parse_args()
+
+    conn = get_pool().acquire()
+    try:
+        diffs = reconcile(conn)
+        for kind, missing, stale in diffs:
+            print("%s: %d missing, %d stale (e.g. missing %s, stale %s)"
+                  % (kind, len(missing), len(stale), missing[:5], stale[:5]))
+        if not diffs:
+            print("pending work queues match")
+        elif args.fix:
+            rebuild(conn)
+            print("rebuilt pending_work (%d queues differed)" % len(diffs))
+    finally:
+        conn.close()
+    return 1 if diffs and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
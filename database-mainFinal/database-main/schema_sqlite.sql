@@ -0,0 +1,1178 @@
+-- Embedded SQLite version of tables.sql + triggers.sql, used by the web app
+-- when CLINIC_DB_BACKEND=sqlite (tests, benchmarks, profiling in-process).
+-- Loaded automatically by clinic_web/sqlite_backend.py on an empty database.
+--
+-- Keep it in step with the MySQL schema: same tables, columns, CHECKs and
+-- trigger behaviour (including the error messages the web app shows).
+-- Differences that are deliberate:
+--   * SQLite does not index foreign keys by itself, so the FK columns the
+--     app joins or filters on get explicit indexes below.
+--   * MySQL stored procedures (sp_billing_summary_apply,
+--     sp_pending_work_sync, sp_entity_version_bump,
+--     sp_revenue_rollup_apply) are inlined into the triggers.
+--   * Defaults use local time like the MySQL server does.
+--   * audit_log is not partitioned; audit_log.py archives it with chunked
+--     deletes instead of dropping partitions.
+--   * The audit triggers test clinic_app_audit(), a per-connection
+--     function registered by sqlite_backend.connect, where MySQL reads the
+--     @clinic_app_audit session variable.
+
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE insurance_plan (
+  plan_id INTEGER PRIMARY KEY,
+  provider_name VARCHAR(150) NOT NULL,
+  plan_name VARCHAR(150),
+  coverage_details VARCHAR(255),
+
+  CONSTRAINT chk_provider_name CHECK (LENGTH(provider_name) > 0)
+);
+
+CREATE TABLE clinic_room (
+  room_id INTEGER PRIMARY KEY,
+  room_name VARCHAR(50) NOT NULL,
+  room_type VARCHAR(100) DEFAULT 'General',
+  notes VARCHAR(255) DEFAULT 'No notes'
+);
+
+CREATE TABLE specialty (
+  specialty_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  specialty_name VARCHAR(100) NOT NULL UNIQUE
+);
+
+CREATE TABLE patient (
+  patient_id INTEGER PRIMARY KEY,
+  full_name VARCHAR(150) NOT NULL,
+  dob DATE DEFAULT NULL,
+  email VARCHAR(255) DEFAULT NULL,
+  phone VARCHAR(30) DEFAULT NULL,
+  address VARCHAR(255) DEFAULT NULL,
+
+  plan_id INTEGER DEFAULT NULL,
+
+  CONSTRAINT fk_patient_plan
+    FOREIGN KEY (plan_id) REFERENCES insurance_plan(plan_id),
+
+  CONSTRAINT chk_patient_email CHECK (email IS NULL OR email LIKE '%@%.%')
+);
+
+CREATE TABLE doctor (
+  doctor_id INTEGER PRIMARY KEY,
+  full_name VARCHAR(150) NOT NULL,
+  email VARCHAR(255) DEFAULT NULL,
+  phone VARCHAR(30) DEFAULT NULL,
+
+  CONSTRAINT chk_doctor_email CHECK (email IS NULL OR email LIKE '%@%.%')
+);
+
+CREATE TABLE doctor_specialty (
+  doctor_id INTEGER NOT NULL,
+  specialty_id INTEGER NOT NULL,
+
+  PRIMARY KEY (doctor_id, specialty_id),
+  CONSTRAINT fk_ds_doctor FOREIGN KEY (doctor_id) REFERENCES doctor(doctor_id),
+  CONSTRAINT fk_ds_specialty FOREIGN KEY (specialty_id) REFERENCES specialty(specialty_id)
+);
+
+CREATE TABLE medication_form (
+  form_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  form_name VARCHAR(50) NOT NULL UNIQUE
+);
+
+CREATE TABLE medication (
+  med_id INTEGER PRIMARY KEY,
+  med_name VARCHAR(150) NOT NULL,
+  notes VARCHAR(255) DEFAULT NULL
+);
+
+CREATE TABLE medication_variant (
+  variant_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  med_id INTEGER NOT NULL,
+  form_id INTEGER NOT NULL,
+  strength VARCHAR(50) NOT NULL,
+
+  UNIQUE (med_id, form_id, strength),
+  CONSTRAINT fk_mv_med FOREIGN KEY (med_id) REFERENCES medication(med_id),
+  CONSTRAINT fk_mv_form FOREIGN KEY (form_id) REFERENCES medication_form(form_id),
+  CONSTRAINT chk_mv_strength CHECK (LENGTH(strength) > 0)
+);
+
+CREATE TABLE appointment (
+  appt_id INTEGER PRIMARY KEY,
+  patient_id INTEGER NOT NULL,
+  doctor_id INTEGER NOT NULL,
+
+  starts_at DATETIME NOT NULL,
+  ends_at DATETIME DEFAULT NULL,
+
+  status VARCHAR(20) DEFAULT 'scheduled',
+  reason VARCHAR(255),
+
+  CONSTRAINT fk_appt_patient FOREIGN KEY(patient_id) REFERENCES patient(patient_id),
+  CONSTRAINT fk_appt_doctor FOREIGN KEY(doctor_id) REFERENCES doctor(doctor_id),
+  CONSTRAINT chk_appt_status CHECK (status IN ('scheduled','completed','cancelled')),
+  CONSTRAINT chk_appt_time CHECK (ends_at IS NULL OR ends_at >= starts_at)
+);
+
+CREATE TABLE appointment_room (
+  appt_id INTEGER NOT NULL,
+  room_id INTEGER NOT NULL,
+
+  PRIMARY KEY (appt_id, room_id),
+  CONSTRAINT fk_ar_appt FOREIGN KEY (appt_id) REFERENCES appointment(appt_id),
+  CONSTRAINT fk_ar_room FOREIGN KEY (room_id) REFERENCES clinic_room(room_id)
+);
+
+CREATE TABLE prescription (
+  rx_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  variant_id INTEGER NOT NULL,
+
+  dosage VARCHAR(100) DEFAULT NULL,
+  route VARCHAR(50) DEFAULT 'oral',
+  frequency VARCHAR(100) DEFAULT 'once daily',
+  instructions VARCHAR(255) DEFAULT NULL,
+
+  quantity INTEGER DEFAULT 0,
+
+  CONSTRAINT fk_rx_appt FOREIGN KEY(appt_id) REFERENCES appointment(appt_id),
+  CONSTRAINT fk_rx_variant FOREIGN KEY(variant_id) REFERENCES medication_variant(variant_id),
+  CONSTRAINT chk_rx_quantity CHECK (quantity >= 0),
+  CONSTRAINT chk_rx_route CHECK (route IN ('oral', 'intravenous', 'intramuscular', 'topical', 'inhalation', 'subcutaneous'))
+);
+
+CREATE TABLE billing (
+  bill_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+
+  amount DECIMAL(10,2) NOT NULL,
+  payment_status VARCHAR(20) DEFAULT 'unpaid',
+  payment_method VARCHAR(50) DEFAULT 'cash',
+
+  -- trg_billing_before_insert fills a missing date in MySQL; SQLite
+  -- triggers cannot change NEW, so the default does it here.
+  billing_date DATE NOT NULL DEFAULT (date('now', 'localtime')),
+
+  CONSTRAINT fk_billing_appt FOREIGN KEY(appt_id) REFERENCES appointment(appt_id),
+  CONSTRAINT chk_billing_amount CHECK (amount >= 0),
+  CONSTRAINT chk_billing_status CHECK (payment_status IN ('paid','unpaid')),
+  CONSTRAINT chk_billing_method CHECK (payment_method IN ('cash', 'card', 'insurance', 'check', 'online'))
+);
+
+CREATE TABLE lab_test (
+  test_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+
+  test_name VARCHAR(150) NOT NULL,
+  status VARCHAR(30) DEFAULT 'pending',
+  test_date DATE,
+
+  CONSTRAINT fk_test_appt FOREIGN KEY(appt_id) REFERENCES appointment(appt_id),
+  CONSTRAINT chk_test_status CHECK (status IN ('pending','completed'))
+);
+
+CREATE TABLE lab_test_result (
+  result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  test_id INTEGER NOT NULL,
+  result_detail VARCHAR(255),
+
+  CONSTRAINT fk_ltr_test FOREIGN KEY (test_id) REFERENCES lab_test(test_id)
+);
+
+CREATE TABLE audit_log (
+  log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  entity_name VARCHAR(64) NOT NULL,
+  entity_id INTEGER DEFAULT NULL,
+  action VARCHAR(16) NOT NULL,
+  performed_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')),
+  details VARCHAR(1024) DEFAULT NULL
+);
+
+CREATE TABLE id_sequence (
+  seq_name VARCHAR(64) PRIMARY KEY,
+  next_id BIGINT NOT NULL
+);
+
+CREATE TABLE patient_change_log (
+  change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  patient_id INTEGER NOT NULL,
+  action VARCHAR(16) NOT NULL,
+  changed_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE schedule_change_log (
+  change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  appt_id INTEGER NOT NULL,
+  changed_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE billing_summary (
+  slot TINYINT PRIMARY KEY,
+  total_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  paid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  unpaid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  bills_count INTEGER NOT NULL DEFAULT 0,
+  unpaid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE billing_summary_patient (
+  patient_id INTEGER PRIMARY KEY,
+  total_billed DECIMAL(14,2) NOT NULL DEFAULT 0,
+  invoices_count INTEGER NOT NULL DEFAULT 0,
+  unpaid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  unpaid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE billing_summary_doctor (
+  doctor_id INTEGER PRIMARY KEY,
+  total_billed DECIMAL(14,2) NOT NULL DEFAULT 0,
+  invoices_count INTEGER NOT NULL DEFAULT 0,
+  unpaid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  unpaid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE revenue_daily (
+  day DATE NOT NULL,
+  doctor_id INTEGER NOT NULL,
+  payment_method VARCHAR(50) NOT NULL,
+  payment_status VARCHAR(20) NOT NULL,
+  total_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  bills_count INTEGER NOT NULL DEFAULT 0,
+
+  PRIMARY KEY (day, doctor_id, payment_method, payment_status)
+);
+
+CREATE TABLE revenue_monthly (
+  month DATE NOT NULL,
+  doctor_id INTEGER NOT NULL,
+  payment_method VARCHAR(50) NOT NULL,
+  payment_status VARCHAR(20) NOT NULL,
+  total_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  bills_count INTEGER NOT NULL DEFAULT 0,
+
+  PRIMARY KEY (month, doctor_id, payment_method, payment_status)
+);
+
+CREATE TABLE pending_work (
+  kind VARCHAR(16) NOT NULL,
+  appt_id INTEGER NOT NULL,
+  starts_at DATETIME NOT NULL,
+
+  PRIMARY KEY (kind, appt_id),
+  CONSTRAINT chk_pending_work_kind CHECK (kind IN ('bill','prescription','room'))
+) WITHOUT ROWID;
+
+CREATE TABLE entity_version (
+  entity VARCHAR(32) PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE row_change_log (
+  change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  entity VARCHAR(32) NOT NULL,
+  entity_id INTEGER NOT NULL,
+  changed_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+-- Bulk archive / purge (clinic_web/purge.py). Each run is a purge_job that
+-- walks matching appointments in (starts_at, appt_id) order, one chunk per
+-- transaction; the chunk's rows are copied to the *_archive tables (unless
+-- it purges only), deleted from every table at once, and the job's position
+-- is saved in the same transaction, so an interrupted job resumes after
+-- its last committed chunk.
+CREATE TABLE purge_job (
+  job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  appt_status VARCHAR(20) DEFAULT NULL,
+  starts_before DATETIME NOT NULL,
+  archive TINYINT NOT NULL DEFAULT 1,
+  state VARCHAR(16) NOT NULL DEFAULT 'running',
+  last_starts_at DATETIME DEFAULT NULL,
+  last_appt_id INTEGER DEFAULT NULL,
+  appointments BIGINT NOT NULL DEFAULT 0,
+  rows_removed BIGINT NOT NULL DEFAULT 0,
+  started_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')),
+  updated_at DATETIME DEFAULT NULL,
+
+  CONSTRAINT chk_purge_job_state CHECK (state IN ('running','done'))
+);
+
+-- Same columns as the live tables plus the job that moved them; no foreign
+-- keys, so any one table can be trimmed or exported on its own.
+CREATE TABLE appointment_archive (
+  appt_id INTEGER PRIMARY KEY,
+  patient_id INTEGER NOT NULL,
+  doctor_id INTEGER NOT NULL,
+  starts_at DATETIME NOT NULL,
+  ends_at DATETIME DEFAULT NULL,
+  status VARCHAR(20),
+  reason VARCHAR(255),
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE appointment_room_archive (
+  appt_id INTEGER NOT NULL,
+  room_id INTEGER NOT NULL,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')),
+
+  PRIMARY KEY (appt_id, room_id)
+);
+
+CREATE TABLE prescription_archive (
+  rx_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  variant_id INTEGER NOT NULL,
+  dosage VARCHAR(100),
+  route VARCHAR(50),
+  frequency VARCHAR(100),
+  instructions VARCHAR(255),
+  quantity INTEGER,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE billing_archive (
+  bill_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  amount DECIMAL(10,2) NOT NULL,
+  payment_status VARCHAR(20),
+  payment_method VARCHAR(50),
+  billing_date DATE NOT NULL,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE lab_test_archive (
+  test_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  test_name VARCHAR(150) NOT NULL,
+  status VARCHAR(30),
+  test_date DATE,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE lab_test_result_archive (
+  result_id INTEGER PRIMARY KEY,
+  test_id INTEGER NOT NULL,
+  result_detail VARCHAR(255),
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+
+-- Same indexes as tables.sql
+CREATE INDEX idx_bsp_unpaid ON billing_summary_patient (unpaid_amount);
+CREATE INDEX idx_pending_work_starts ON pending_work (kind, starts_at, appt_id);
+CREATE INDEX idx_appointment_starts_at ON appointment (starts_at, appt_id);
+CREATE INDEX idx_billing_date ON billing (billing_date, bill_id);
+CREATE INDEX idx_appointment_doctor_starts ON appointment (doctor_id, starts_at);
+CREATE INDEX idx_audit_entity_row ON audit_log (entity_name, entity_id, performed_at, log_id);
+CREATE INDEX idx_audit_entity_time ON audit_log (entity_name, performed_at, log_id);
+CREATE INDEX idx_audit_time ON audit_log (performed_at, log_id);
+CREATE INDEX idx_revenue_monthly_doctor ON revenue_monthly (doctor_id, month);
+CREATE INDEX idx_row_change_row ON row_change_log (entity, entity_id, change_id);
+CREATE INDEX idx_row_change_entity ON row_change_log (entity, change_id);
+CREATE INDEX idx_appointment_archive_starts ON appointment_archive (starts_at);
+CREATE INDEX idx_appointment_archive_job ON appointment_archive (job_id);
+CREATE INDEX idx_prescription_archive_appt ON prescription_archive (appt_id);
+CREATE INDEX idx_billing_archive_appt ON billing_archive (appt_id);
+CREATE INDEX idx_lab_test_archive_appt ON lab_test_archive (appt_id);
+CREATE INDEX idx_lab_test_result_archive_test ON lab_test_result_archive (test_id);
+
+-- Foreign key columns (InnoDB creates these implicitly)
+CREATE INDEX idx_appointment_patient ON appointment (patient_id);
+CREATE INDEX idx_appointment_room_room ON appointment_room (room_id);
+CREATE INDEX idx_prescription_appt ON prescription (appt_id);
+CREATE INDEX idx_prescription_variant ON prescription (variant_id);
+CREATE INDEX idx_billing_appt ON billing (appt_id);
+CREATE INDEX idx_lab_test_appt ON lab_test (appt_id);
+CREATE INDEX idx_lab_test_result_test ON lab_test_result (test_id);
+CREATE INDEX idx_medication_variant_form ON medication_variant (form_id);
+CREATE INDEX idx_patient_plan ON patient (plan_id);
+CREATE INDEX idx_doctor_specialty_specialty ON doctor_specialty (specialty_id);
+
+
+/* 1) Reject missing or inverted times and overlapping appointments
+      for the same doctor. */
+CREATE TRIGGER trg_appt_before_insert
+BEFORE INSERT ON appointment
+FOR EACH ROW
+BEGIN
+  SELECT RAISE(ABORT, 'Start time and end time are required')
+  WHERE NEW.starts_at IS NULL OR NEW.ends_at IS NULL;
+
+  SELECT RAISE(ABORT, 'End time must be after the start time')
+  WHERE NEW.ends_at <= NEW.starts_at;
+
+  /* A doctor's appointments never overlap, so each one ends before the
+     next starts and only the latest one starting before NEW.ends_at can
+     reach NEW: one descending probe of idx_appointment_doctor_starts
+     rather than a scan of the doctor's whole history. */
+  SELECT RAISE(ABORT, 'This doctor already has an appointment during the selected time range')
+  FROM (
+    SELECT starts_at, ends_at FROM appointment
+    WHERE doctor_id = NEW.doctor_id
+      AND starts_at < NEW.ends_at
+    ORDER BY starts_at DESC
+    LIMIT 1
+  ) a
+  WHERE a.starts_at >= NEW.starts_at OR a.ends_at > NEW.starts_at;
+END;
+
+/* 2) Reject negative billing amounts (the missing date is a column default). */
+CREATE TRIGGER trg_billing_before_insert
+BEFORE INSERT ON billing
+FOR EACH ROW
+WHEN NEW.amount < 0
+BEGIN
+  SELECT RAISE(ABORT, 'Billing amount cannot be negative');
+END;
+
+
+/* 3 - 11) audit_log entries, unless the app writes them (audit.py) */
+CREATE TRIGGER trg_appointment_after_insert
+AFTER INSERT ON appointment
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('appointment', NEW.appt_id, 'INSERT',
+          'patient=' || NEW.patient_id || ',doctor=' || NEW.doctor_id);
+END;
+
+CREATE TRIGGER trg_appointment_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('appointment', NEW.appt_id, 'UPDATE',
+          'status:' || OLD.status || '->' || NEW.status);
+END;
+
+CREATE TRIGGER trg_appointment_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('appointment', OLD.appt_id, 'DELETE',
+          'deleted appointment for patient=' || OLD.patient_id);
+END;
+
+CREATE TRIGGER trg_billing_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('billing', NEW.bill_id, 'INSERT',
+          'amount=' || printf('%.2f', NEW.amount) || ',status=' || NEW.payment_status);
+END;
+
+CREATE TRIGGER trg_billing_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('billing', NEW.bill_id, 'UPDATE',
+          'status:' || OLD.payment_status || '->' || NEW.payment_status);
+END;
+
+CREATE TRIGGER trg_billing_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('billing', OLD.bill_id, 'DELETE',
+          'deleted billing for appt=' || OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_prescription_after_insert
+AFTER INSERT ON prescription
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('prescription', NEW.rx_id, 'INSERT',
+          'variant=' || NEW.variant_id || ',quantity=' || NEW.quantity);
+END;
+
+CREATE TRIGGER trg_prescription_after_update
+AFTER UPDATE ON prescription
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('prescription', NEW.rx_id, 'UPDATE',
+          'quantity:' || OLD.quantity || '->' || NEW.quantity);
+END;
+
+CREATE TRIGGER trg_prescription_after_delete
+AFTER DELETE ON prescription
+FOR EACH ROW
+WHEN NOT clinic_app_audit()
+BEGIN
+  INSERT INTO audit_log(entity_name, entity_id, action, details)
+  VALUES ('prescription', OLD.rx_id, 'DELETE',
+          'deleted prescription for appt=' || OLD.appt_id);
+END;
+
+
+/* 12) patient_change_log */
+CREATE TRIGGER trg_patient_after_insert
+AFTER INSERT ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO patient_change_log(patient_id, action) VALUES (NEW.patient_id, 'INSERT');
+END;
+
+CREATE TRIGGER trg_patient_after_update
+AFTER UPDATE ON patient
+FOR EACH ROW
+WHEN NEW.full_name IS NOT OLD.full_name OR NEW.patient_id <> OLD.patient_id
+BEGIN
+  INSERT INTO patient_change_log(patient_id, action) VALUES (OLD.patient_id, 'UPDATE');
+  INSERT INTO patient_change_log(patient_id, action)
+  SELECT NEW.patient_id, 'UPDATE' WHERE NEW.patient_id <> OLD.patient_id;
+END;
+
+CREATE TRIGGER trg_patient_after_delete
+AFTER DELETE ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO patient_change_log(patient_id, action) VALUES (OLD.patient_id, 'DELETE');
+END;
+
+
+/* 13) schedule_change_log */
+CREATE TRIGGER trg_appointment_schedule_after_insert
+AFTER INSERT ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (NEW.appt_id);
+END;
+
+CREATE TRIGGER trg_appointment_schedule_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+WHEN NEW.starts_at IS NOT OLD.starts_at OR NEW.ends_at IS NOT OLD.ends_at
+     OR NEW.doctor_id <> OLD.doctor_id OR NEW.appt_id <> OLD.appt_id
+     OR NEW.status IS NOT OLD.status
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (OLD.appt_id);
+  INSERT INTO schedule_change_log(appt_id)
+  SELECT NEW.appt_id WHERE NEW.appt_id <> OLD.appt_id;
+END;
+
+CREATE TRIGGER trg_appointment_schedule_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_appointment_room_after_insert
+AFTER INSERT ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (NEW.appt_id);
+END;
+
+CREATE TRIGGER trg_appointment_room_after_delete
+AFTER DELETE ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (OLD.appt_id);
+END;
+
+
+/* 14) Billing summaries (sp_billing_summary_apply inlined). An update is
+       applied as the removal of the old row plus the insert of the new one;
+       an appointment that changes patient or doctor moves its bills. */
+CREATE TRIGGER trg_billing_summary_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO billing_summary (slot, total_amount, paid_amount, unpaid_amount, bills_count, unpaid_count)
+  VALUES (NEW.bill_id % 16, NEW.amount,
+          CASE WHEN NEW.payment_status = 'paid' THEN NEW.amount ELSE 0 END,
+          CASE WHEN NEW.payment_status = 'unpaid' THEN NEW.amount ELSE 0 END,
+          1, NEW.payment_status = 'unpaid')
+  ON CONFLICT (slot) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    paid_amount = ROUND(paid_amount + excluded.paid_amount, 2),
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    bills_count = bills_count + excluded.bills_count,
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+
+  INSERT INTO billing_summary_patient (patient_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+  SELECT a.patient_id, NEW.amount, 1,
+         CASE WHEN NEW.payment_status = 'unpaid' THEN NEW.amount ELSE 0 END,
+         NEW.payment_status = 'unpaid'
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (patient_id) DO UPDATE SET
+    total_billed = ROUND(total_billed + excluded.total_billed, 2),
+    invoices_count = invoices_count + excluded.invoices_count,
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+
+  INSERT INTO billing_summary_doctor (doctor_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+  SELECT a.doctor_id, NEW.amount, 1,
+         CASE WHEN NEW.payment_status = 'unpaid' THEN NEW.amount ELSE 0 END,
+         NEW.payment_status = 'unpaid'
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (doctor_id) DO UPDATE SET
+    total_billed = ROUND(total_billed + excluded.total_billed, 2),
+    invoices_count = invoices_count + excluded.invoices_count,
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+END;
+
+CREATE TRIGGER trg_billing_summary_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  UPDATE billing_summary SET
+    total_amount = ROUND(total_amount - OLD.amount, 2),
+    paid_amount = ROUND(paid_amount - CASE WHEN OLD.payment_status = 'paid' THEN OLD.amount ELSE 0 END, 2),
+    unpaid_amount = ROUND(unpaid_amount - CASE WHEN OLD.payment_status = 'unpaid' THEN OLD.amount ELSE 0 END, 2),
+    bills_count = bills_count - 1,
+    unpaid_count = unpaid_count - (OLD.payment_status = 'unpaid')
+  WHERE slot = OLD.bill_id % 16;
+
+  UPDATE billing_summary_patient SET
+    total_billed = ROUND(total_billed - OLD.amount, 2),
+    invoices_count = invoices_count - 1,
+    unpaid_amount = ROUND(unpaid_amount - CASE WHEN OLD.payment_status = 'unpaid' THEN OLD.amount ELSE 0 END, 2),
+    unpaid_count = unpaid_count - (OLD.payment_status = 'unpaid')
+  WHERE patient_id = (SELECT patient_id FROM appointment WHERE appt_id = OLD.appt_id);
+
+  UPDATE billing_summary_doctor SET
+    total_billed = ROUND(total_billed - OLD.amount, 2),
+    invoices_count = invoices_count - 1,
+    unpaid_amount = ROUND(unpaid_amount - CASE WHEN OLD.payment_status = 'unpaid' THEN OLD.amount ELSE 0 END, 2),
+    unpaid_count = unpaid_count - (OLD.payment_status = 'unpaid')
+  WHERE doctor_id = (SELECT doctor_id FROM appointment WHERE appt_id = OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_billing_summary_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+WHEN NEW.amount IS NOT OLD.amount OR NEW.payment_status IS NOT OLD.payment_status
+     OR NEW.appt_id <> OLD.appt_id OR NEW.bill_id <> OLD.bill_id
+BEGIN
+  UPDATE billing_summary SET
+    total_amount = ROUND(total_amount - OLD.amount, 2),
+    paid_amount = ROUND(paid_amount - CASE WHEN OLD.payment_status = 'paid' THEN OLD.amount ELSE 0 END, 2),
+    unpaid_amount = ROUND(unpaid_amount - CASE WHEN OLD.payment_status = 'unpaid' THEN OLD.amount ELSE 0 END, 2),
+    bills_count = bills_count - 1,
+    unpaid_count = unpaid_count - (OLD.payment_status = 'unpaid')
+  WHERE slot = OLD.bill_id % 16;
+
+  UPDATE billing_summary_patient SET
+    total_billed = ROUND(total_billed - OLD.amount, 2),
+    invoices_count = invoices_count - 1,
+    unpaid_amount = ROUND(unpaid_amount - CASE WHEN OLD.payment_status = 'unpaid' THEN OLD.amount ELSE 0 END, 2),
+    unpaid_count = unpaid_count - (OLD.payment_status = 'unpaid')
+  WHERE patient_id = (SELECT patient_id FROM appointment WHERE appt_id = OLD.appt_id);
+
+  UPDATE billing_summary_doctor SET
+    total_billed = ROUND(total_billed - OLD.amount, 2),
+    invoices_count = invoices_count - 1,
+    unpaid_amount = ROUND(unpaid_amount - CASE WHEN OLD.payment_status = 'unpaid' THEN OLD.amount ELSE 0 END, 2),
+    unpaid_count = unpaid_count - (OLD.payment_status = 'unpaid')
+  WHERE doctor_id = (SELECT doctor_id FROM appointment WHERE appt_id = OLD.appt_id);
+
+  INSERT INTO billing_summary (slot, total_amount, paid_amount, unpaid_amount, bills_count, unpaid_count)
+  VALUES (NEW.bill_id % 16, NEW.amount,
+          CASE WHEN NEW.payment_status = 'paid' THEN NEW.amount ELSE 0 END,
+          CASE WHEN NEW.payment_status = 'unpaid' THEN NEW.amount ELSE 0 END,
+          1, NEW.payment_status = 'unpaid')
+  ON CONFLICT (slot) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    paid_amount = ROUND(paid_amount + excluded.paid_amount, 2),
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    bills_count = bills_count + excluded.bills_count,
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+
+  INSERT INTO billing_summary_patient (patient_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+  SELECT a.patient_id, NEW.amount, 1,
+         CASE WHEN NEW.payment_status = 'unpaid' THEN NEW.amount ELSE 0 END,
+         NEW.payment_status = 'unpaid'
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (patient_id) DO UPDATE SET
+    total_billed = ROUND(total_billed + excluded.total_billed, 2),
+    invoices_count = invoices_count + excluded.invoices_count,
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+
+  INSERT INTO billing_summary_doctor (doctor_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+  SELECT a.doctor_id, NEW.amount, 1,
+         CASE WHEN NEW.payment_status = 'unpaid' THEN NEW.amount ELSE 0 END,
+         NEW.payment_status = 'unpaid'
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (doctor_id) DO UPDATE SET
+    total_billed = ROUND(total_billed + excluded.total_billed, 2),
+    invoices_count = invoices_count + excluded.invoices_count,
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+END;
+
+
+CREATE TRIGGER trg_appointment_billing_summary_patient_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+WHEN NEW.patient_id <> OLD.patient_id
+BEGIN
+  INSERT INTO billing_summary_patient (patient_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+  SELECT m.patient_id, m.sign * b.amount, m.sign,
+         CASE WHEN b.payment_status = 'unpaid' THEN m.sign * b.amount ELSE 0 END,
+         CASE WHEN b.payment_status = 'unpaid' THEN m.sign ELSE 0 END
+  FROM billing b,
+       (SELECT OLD.patient_id AS patient_id, -1 AS sign UNION ALL SELECT NEW.patient_id, 1) m
+  WHERE b.appt_id = NEW.appt_id
+  ON CONFLICT (patient_id) DO UPDATE SET
+    total_billed = ROUND(total_billed + excluded.total_billed, 2),
+    invoices_count = invoices_count + excluded.invoices_count,
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+END;
+
+CREATE TRIGGER trg_appointment_billing_summary_doctor_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+WHEN NEW.doctor_id <> OLD.doctor_id
+BEGIN
+  INSERT INTO billing_summary_doctor (doctor_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+  SELECT m.doctor_id, m.sign * b.amount, m.sign,
+         CASE WHEN b.payment_status = 'unpaid' THEN m.sign * b.amount ELSE 0 END,
+         CASE WHEN b.payment_status = 'unpaid' THEN m.sign ELSE 0 END
+  FROM billing b,
+       (SELECT OLD.doctor_id AS doctor_id, -1 AS sign UNION ALL SELECT NEW.doctor_id, 1) m
+  WHERE b.appt_id = NEW.appt_id
+  ON CONFLICT (doctor_id) DO UPDATE SET
+    total_billed = ROUND(total_billed + excluded.total_billed, 2),
+    invoices_count = invoices_count + excluded.invoices_count,
+    unpaid_amount = ROUND(unpaid_amount + excluded.unpaid_amount, 2),
+    unpaid_count = unpaid_count + excluded.unpaid_count;
+END;
+
+
+/* 15) pending_work (sp_pending_work_sync inlined) */
+CREATE TRIGGER trg_appointment_pending_after_insert
+AFTER INSERT ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO pending_work (kind, appt_id, starts_at)
+  VALUES ('bill', NEW.appt_id, NEW.starts_at),
+         ('prescription', NEW.appt_id, NEW.starts_at),
+         ('room', NEW.appt_id, NEW.starts_at);
+END;
+
+CREATE TRIGGER trg_appointment_pending_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+WHEN NEW.starts_at <> OLD.starts_at OR NEW.appt_id <> OLD.appt_id
+BEGIN
+  UPDATE pending_work SET appt_id = NEW.appt_id, starts_at = NEW.starts_at
+  WHERE appt_id = OLD.appt_id;
+END;
+
+CREATE TRIGGER trg_appointment_pending_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE appt_id = OLD.appt_id;
+END;
+
+CREATE TRIGGER trg_billing_pending_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'bill' AND appt_id = NEW.appt_id;
+END;
+
+CREATE TRIGGER trg_billing_pending_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+WHEN NEW.appt_id <> OLD.appt_id
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'bill' AND appt_id = NEW.appt_id;
+  INSERT OR IGNORE INTO pending_work (kind, appt_id, starts_at)
+  SELECT 'bill', appt_id, starts_at FROM appointment
+  WHERE appt_id = OLD.appt_id
+    AND NOT EXISTS (SELECT 1 FROM billing WHERE appt_id = OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_billing_pending_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  INSERT OR IGNORE INTO pending_work (kind, appt_id, starts_at)
+  SELECT 'bill', appt_id, starts_at FROM appointment
+  WHERE appt_id = OLD.appt_id
+    AND NOT EXISTS (SELECT 1 FROM billing WHERE appt_id = OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_prescription_pending_after_insert
+AFTER INSERT ON prescription
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'prescription' AND appt_id = NEW.appt_id;
+END;
+
+CREATE TRIGGER trg_prescription_pending_after_update
+AFTER UPDATE ON prescription
+FOR EACH ROW
+WHEN NEW.appt_id <> OLD.appt_id
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'prescription' AND appt_id = NEW.appt_id;
+  INSERT OR IGNORE INTO pending_work (kind, appt_id, starts_at)
+  SELECT 'prescription', appt_id, starts_at FROM appointment
+  WHERE appt_id = OLD.appt_id
+    AND NOT EXISTS (SELECT 1 FROM prescription WHERE appt_id = OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_prescription_pending_after_delete
+AFTER DELETE ON prescription
+FOR EACH ROW
+BEGIN
+  INSERT OR IGNORE INTO pending_work (kind, appt_id, starts_at)
+  SELECT 'prescription', appt_id, starts_at FROM appointment
+  WHERE appt_id = OLD.appt_id
+    AND NOT EXISTS (SELECT 1 FROM prescription WHERE appt_id = OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_appointment_room_pending_after_insert
+AFTER INSERT ON appointment_room
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'room' AND appt_id = NEW.appt_id;
+END;
+
+CREATE TRIGGER trg_appointment_room_pending_after_delete
+AFTER DELETE ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT OR IGNORE INTO pending_work (kind, appt_id, starts_at)
+  SELECT 'room', appt_id, starts_at FROM appointment
+  WHERE appt_id = OLD.appt_id
+    AND NOT EXISTS (SELECT 1 FROM appointment_room WHERE appt_id = OLD.appt_id);
+END;
+
+
+/* 16) entity_version (sp_entity_version_bump inlined) */
+CREATE TRIGGER trg_doctor_version_after_insert
+AFTER INSERT ON doctor
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('doctor', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_doctor_version_after_update
+AFTER UPDATE ON doctor
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('doctor', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_doctor_version_after_delete
+AFTER DELETE ON doctor
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('doctor', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_clinic_room_version_after_insert
+AFTER INSERT ON clinic_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('room', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_clinic_room_version_after_update
+AFTER UPDATE ON clinic_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('room', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_clinic_room_version_after_delete
+AFTER DELETE ON clinic_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('room', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_version_after_insert
+AFTER INSERT ON medication
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_version_after_update
+AFTER UPDATE ON medication
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_version_after_delete
+AFTER DELETE ON medication
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_variant_version_after_insert
+AFTER INSERT ON medication_variant
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_variant_version_after_update
+AFTER UPDATE ON medication_variant
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_variant_version_after_delete
+AFTER DELETE ON medication_variant
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_form_version_after_insert
+AFTER INSERT ON medication_form
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_form_version_after_update
+AFTER UPDATE ON medication_form
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER trg_medication_form_version_after_delete
+AFTER DELETE ON medication_form
+FOR EACH ROW
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES ('medication', 1)
+  ON CONFLICT (entity) DO UPDATE SET version = version + 1;
+END;
+
+
+/* 17) row_change_log */
+CREATE TRIGGER trg_billing_rowlog_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', NEW.bill_id);
+END;
+
+CREATE TRIGGER trg_billing_rowlog_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', OLD.bill_id);
+  INSERT INTO row_change_log(entity, entity_id)
+  SELECT 'billing', NEW.bill_id WHERE NEW.bill_id <> OLD.bill_id;
+END;
+
+CREATE TRIGGER trg_billing_rowlog_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', OLD.bill_id);
+END;
+
+CREATE TRIGGER trg_appointment_rowlog_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('appointment', OLD.appt_id);
+  INSERT INTO row_change_log(entity, entity_id)
+  SELECT 'appointment', NEW.appt_id WHERE NEW.appt_id <> OLD.appt_id;
+  INSERT INTO row_change_log(entity, entity_id)
+  SELECT 'room', room_id FROM appointment_room WHERE appt_id IN (OLD.appt_id, NEW.appt_id);
+END;
+
+CREATE TRIGGER trg_appointment_rowlog_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('appointment', OLD.appt_id);
+END;
+
+CREATE TRIGGER trg_patient_rowlog_after_update
+AFTER UPDATE ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('patient', OLD.patient_id);
+  INSERT INTO row_change_log(entity, entity_id)
+  SELECT 'patient', NEW.patient_id WHERE NEW.patient_id <> OLD.patient_id;
+  INSERT INTO row_change_log(entity, entity_id)
+  SELECT DISTINCT 'room', ar.room_id
+  FROM appointment a
+  JOIN appointment_room ar ON ar.appt_id = a.appt_id
+  WHERE a.patient_id = NEW.patient_id AND NEW.full_name IS NOT OLD.full_name;
+END;
+
+CREATE TRIGGER trg_patient_rowlog_after_delete
+AFTER DELETE ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('patient', OLD.patient_id);
+END;
+
+CREATE TRIGGER trg_appointment_room_rowlog_after_insert
+AFTER INSERT ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('room', NEW.room_id);
+END;
+
+CREATE TRIGGER trg_appointment_room_rowlog_after_delete
+AFTER DELETE ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('room', OLD.room_id);
+END;
+
+
+/* 18) Revenue rollups (sp_revenue_rollup_apply inlined). An update is
+       applied as the removal of the old row plus the insert of the new one;
+       a reassigned appointment moves its bills to the new doctor. */
+CREATE TRIGGER trg_billing_revenue_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT NEW.billing_date, a.doctor_id, COALESCE(NEW.payment_method, ''), COALESCE(NEW.payment_status, ''),
+         NEW.amount, 1
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (day, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+
+  INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT date(NEW.billing_date, 'start of month'), a.doctor_id, COALESCE(NEW.payment_method, ''), COALESCE(NEW.payment_status, ''),
+         NEW.amount, 1
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (month, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+END;
+
+CREATE TRIGGER trg_billing_revenue_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+WHEN NEW.amount IS NOT OLD.amount OR NEW.payment_status IS NOT OLD.payment_status
+     OR NEW.payment_method IS NOT OLD.payment_method
+     OR NEW.billing_date <> OLD.billing_date OR NEW.appt_id <> OLD.appt_id
+BEGIN
+  INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT OLD.billing_date, a.doctor_id, COALESCE(OLD.payment_method, ''), COALESCE(OLD.payment_status, ''),
+         -OLD.amount, -1
+  FROM appointment a WHERE a.appt_id = OLD.appt_id
+  ON CONFLICT (day, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+
+  INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT date(OLD.billing_date, 'start of month'), a.doctor_id, COALESCE(OLD.payment_method, ''), COALESCE(OLD.payment_status, ''),
+         -OLD.amount, -1
+  FROM appointment a WHERE a.appt_id = OLD.appt_id
+  ON CONFLICT (month, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+
+  INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT NEW.billing_date, a.doctor_id, COALESCE(NEW.payment_method, ''), COALESCE(NEW.payment_status, ''),
+         NEW.amount, 1
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (day, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+
+  INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT date(NEW.billing_date, 'start of month'), a.doctor_id, COALESCE(NEW.payment_method, ''), COALESCE(NEW.payment_status, ''),
+         NEW.amount, 1
+  FROM appointment a WHERE a.appt_id = NEW.appt_id
+  ON CONFLICT (month, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+END;
+
+CREATE TRIGGER trg_billing_revenue_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT OLD.billing_date, a.doctor_id, COALESCE(OLD.payment_method, ''), COALESCE(OLD.payment_status, ''),
+         -OLD.amount, -1
+  FROM appointment a WHERE a.appt_id = OLD.appt_id
+  ON CONFLICT (day, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+
+  INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT date(OLD.billing_date, 'start of month'), a.doctor_id, COALESCE(OLD.payment_method, ''), COALESCE(OLD.payment_status, ''),
+         -OLD.amount, -1
+  FROM appointment a WHERE a.appt_id = OLD.appt_id
+  ON CONFLICT (month, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+END;
+
+CREATE TRIGGER trg_appointment_revenue_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+WHEN NEW.doctor_id <> OLD.doctor_id
+BEGIN
+  INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT b.billing_date, m.doctor_id, COALESCE(b.payment_method, ''), COALESCE(b.payment_status, ''),
+         m.sign * b.amount, m.sign
+  FROM billing b,
+       (SELECT OLD.doctor_id AS doctor_id, -1 AS sign UNION ALL SELECT NEW.doctor_id, 1) m
+  WHERE b.appt_id = NEW.appt_id
+  ON CONFLICT (day, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+
+  INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+  SELECT date(b.billing_date, 'start of month'), m.doctor_id, COALESCE(b.payment_method, ''), COALESCE(b.payment_status, ''),
+         m.sign * b.amount, m.sign
+  FROM billing b,
+       (SELECT OLD.doctor_id AS doctor_id, -1 AS sign UNION ALL SELECT NEW.doctor_id, 1) m
+  WHERE b.appt_id = NEW.appt_id
+  ON CONFLICT (month, doctor_id, payment_method, payment_status) DO UPDATE SET
+    total_amount = ROUND(total_amount + excluded.total_amount, 2),
+    bills_count = bills_count + excluded.bills_count;
+END;
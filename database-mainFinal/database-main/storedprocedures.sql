@@ -47,16 +47,18 @@ BEGIN
   SET out_appt_id = LAST_INSERT_ID();
 END$$
 
--- (d) Monthly revenue report stored procedure
+-- (d) Monthly revenue report stored procedure; reads the revenue_monthly
+--     rollup (a primary key range) instead of grouping the year's bills
 CREATE PROCEDURE sp_get_monthly_revenue(IN in_year INT)
 BEGIN
-  SELECT DATE_FORMAT(billing_date, '%Y-%m') AS month,
-         COUNT(*) AS invoices_count,
-         SUM(amount) AS total_revenue
-  FROM billing
-  WHERE YEAR(billing_date) = in_year
-  GROUP BY month
-  ORDER BY month;
+  SELECT DATE_FORMAT(r.month, '%Y-%m') AS month,
+         SUM(r.bills_count) AS invoices_count,
+         SUM(r.total_amount) AS total_revenue
+  FROM revenue_monthly r
+  WHERE r.month >= MAKEDATE(in_year, 1) AND r.month < MAKEDATE(in_year + 1, 1)
+  GROUP BY r.month
+  HAVING SUM(r.bills_count) > 0
+  ORDER BY r.month;
 END$$
 
 -- (e) Top N doctors by revenue
@@ -68,4 +70,138 @@ BEGIN
   LIMIT in_limit;
 END$$
 
+-- (f) Apply one billing row to the summary tables; called by the billing
+--     triggers with sign = 1 for the new row and -1 for the old one
+CREATE PROCEDURE sp_billing_summary_apply(
+  IN in_bill_id INT,
+  IN in_appt_id INT,
+  IN in_amount DECIMAL(10,2),
+  IN in_status VARCHAR(20),
+  IN in_sign INT
+)
+BEGIN
+  DECLARE v_patient INT DEFAULT NULL;
+  DECLARE v_doctor INT DEFAULT NULL;
+  DECLARE v_amount DECIMAL(14,2);
+  DECLARE v_unpaid DECIMAL(14,2);
+  DECLARE v_paid DECIMAL(14,2);
+  DECLARE v_unpaid_count INT;
+
+  SET v_amount = in_sign * in_amount;
+  SET v_unpaid = IF(in_status = 'unpaid', v_amount, 0);
+  SET v_paid = IF(in_status = 'paid', v_amount, 0);
+  SET v_unpaid_count = IF(in_status = 'unpaid', in_sign, 0);
+
+  SELECT patient_id, doctor_id INTO v_patient, v_doctor
+  FROM appointment WHERE appt_id = in_appt_id;
+
+  INSERT INTO billing_summary (slot, total_amount, paid_amount, unpaid_amount, bills_count, unpaid_count)
+  VALUES (in_bill_id % 16, v_amount, v_paid, v_unpaid, in_sign, v_unpaid_count)
+  ON DUPLICATE KEY UPDATE
+    total_amount = total_amount + VALUES(total_amount),
+    paid_amount = paid_amount + VALUES(paid_amount),
+    unpaid_amount = unpaid_amount + VALUES(unpaid_amount),
+    bills_count = bills_count + VALUES(bills_count),
+    unpaid_count = unpaid_count + VALUES(unpaid_count);
+
+  IF v_patient IS NOT NULL THEN
+    INSERT INTO billing_summary_patient (patient_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+    VALUES (v_patient, v_amount, in_sign, v_unpaid, v_unpaid_count)
+    ON DUPLICATE KEY UPDATE
+      total_billed = total_billed + VALUES(total_billed),
+      invoices_count = invoices_count + VALUES(invoices_count),
+      unpaid_amount = unpaid_amount + VALUES(unpaid_amount),
+      unpaid_count = unpaid_count + VALUES(unpaid_count);
+
+    INSERT INTO billing_summary_doctor (doctor_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+    VALUES (v_doctor, v_amount, in_sign, v_unpaid, v_unpaid_count)
+    ON DUPLICATE KEY UPDATE
+      total_billed = total_billed + VALUES(total_billed),
+      invoices_count = invoices_count + VALUES(invoices_count),
+      unpaid_amount = unpaid_amount + VALUES(unpaid_amount),
+      unpaid_count = unpaid_count + VALUES(unpaid_count);
+  END IF;
+END$$
+
+-- (g) Recompute one pending_work entry after a bill, prescription or room
+--     assignment for the appointment was removed or moved
+CREATE PROCEDURE sp_pending_work_sync(
+  IN in_kind VARCHAR(16),
+  IN in_appt_id INT
+)
+BEGIN
+  DECLARE v_done INT DEFAULT 0;
+
+  IF in_kind = 'bill' THEN
+    SELECT EXISTS(SELECT 1 FROM billing WHERE appt_id = in_appt_id) INTO v_done;
+  ELSEIF in_kind = 'prescription' THEN
+    SELECT EXISTS(SELECT 1 FROM prescription WHERE appt_id = in_appt_id) INTO v_done;
+  ELSE
+    SELECT EXISTS(SELECT 1 FROM appointment_room WHERE appt_id = in_appt_id) INTO v_done;
+  END IF;
+
+  IF v_done THEN
+    DELETE FROM pending_work WHERE kind = in_kind AND appt_id = in_appt_id;
+  ELSE
+    INSERT IGNORE INTO pending_work (kind, appt_id, starts_at)
+    SELECT in_kind, appt_id, starts_at FROM appointment WHERE appt_id = in_appt_id;
+  END IF;
+END$$
+
+-- (h) Bump the change counter of a cached reference entity
+CREATE PROCEDURE sp_entity_version_bump(
+  IN in_entity VARCHAR(32)
+)
+BEGIN
+  INSERT INTO entity_version (entity, version) VALUES (in_entity, 1)
+  ON DUPLICATE KEY UPDATE version = version + 1;
+END$$
+
+-- (i) Apply one billing row to revenue_daily and revenue_monthly; called by
+--     the billing triggers with sign = 1 for the new row and -1 for the old one
+CREATE PROCEDURE sp_revenue_rollup_apply(
+  IN in_appt_id INT,
+  IN in_day DATE,
+  IN in_method VARCHAR(50),
+  IN in_status VARCHAR(20),
+  IN in_amount DECIMAL(10,2),
+  IN in_sign INT
+)
+BEGIN
+  DECLARE v_doctor INT DEFAULT NULL;
+
+  SELECT doctor_id INTO v_doctor FROM appointment WHERE appt_id = in_appt_id;
+
+  IF v_doctor IS NOT NULL THEN
+    INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+    VALUES (in_day, v_doctor, COALESCE(in_method, ''), COALESCE(in_status, ''),
+            in_sign * in_amount, in_sign)
+    ON DUPLICATE KEY UPDATE
+      total_amount = total_amount + VALUES(total_amount),
+      bills_count = bills_count + VALUES(bills_count);
+
+    INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+    VALUES (in_day - INTERVAL (DAYOFMONTH(in_day) - 1) DAY, v_doctor,
+            COALESCE(in_method, ''), COALESCE(in_status, ''), in_sign * in_amount, in_sign)
+    ON DUPLICATE KEY UPDATE
+      total_amount = total_amount + VALUES(total_amount),
+      bills_count = bills_count + VALUES(bills_count);
+  END IF;
+END$$
+
+-- (j) Top N doctors by revenue within one year, from the monthly rollup
+CREATE PROCEDURE sp_get_top_doctors_for_year(IN in_year INT, IN in_limit INT)
+BEGIN
+  SELECT r.doctor_id, d.full_name,
+         SUM(r.total_amount) AS total_billed,
+         SUM(r.bills_count) AS invoices_count
+  FROM revenue_monthly r
+  JOIN doctor d ON d.doctor_id = r.doctor_id
+  WHERE r.month >= MAKEDATE(in_year, 1) AND r.month < MAKEDATE(in_year + 1, 1)
+  GROUP BY r.doctor_id, d.full_name
+  HAVING SUM(r.bills_count) > 0
+  ORDER BY total_billed DESC
+  LIMIT in_limit;
+END$$
+
 DELIMITER ;
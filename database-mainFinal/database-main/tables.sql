@@ -176,14 +176,258 @@ CREATE TABLE lab_test_result (
   CONSTRAINT fk_ltr_test FOREIGN KEY (test_id) REFERENCES lab_test(test_id)
 );
 
+-- Partitioned by month on performed_at: p<YYYYMM> partitions are added a few
+-- months ahead and archived to compressed files by clinic_web/audit_log.py
+-- (run it from cron), so pmax stays empty. MySQL wants the partitioning
+-- column in every unique key, hence the two-column primary key.
+-- The indexes serve the /audit filters, newest first:
+--   entity + id (+ time range), entity + time range, time range.
 CREATE TABLE IF NOT EXISTS audit_log (
-  log_id INTEGER PRIMARY KEY AUTO_INCREMENT,
+  log_id INTEGER NOT NULL AUTO_INCREMENT,
   entity_name VARCHAR(64) NOT NULL,
   entity_id INTEGER DEFAULT NULL,
   action VARCHAR(16) NOT NULL,
   performed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  details VARCHAR(1024) DEFAULT NULL
+  details VARCHAR(1024) DEFAULT NULL,
+
+  PRIMARY KEY (log_id, performed_at),
+  INDEX idx_audit_entity_row (entity_name, entity_id, performed_at, log_id),
+  INDEX idx_audit_entity_time (entity_name, performed_at, log_id),
+  INDEX idx_audit_time (performed_at, log_id)
+)
+PARTITION BY RANGE (TO_DAYS(performed_at)) (
+  PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Hi/lo sequences used by the web app to hand out primary keys in blocks.
+-- next_id is the first id not yet reserved; rows are seeded from MAX(id)
+-- on first use.
+CREATE TABLE id_sequence (
+  seq_name VARCHAR(64) PRIMARY KEY,
+  next_id BIGINT NOT NULL
+);
+-- Append-only feed of patient inserts/renames/deletes (filled by triggers),
+-- polled by the web app to keep its in-memory name index current.
+-- clinic_web/change_log.py (cron) deletes rows older than a retention window
+-- (24 hours by default) but always keeps the newest; a worker whose position
+-- is older than the oldest row left rebuilds its index from patient.
+CREATE TABLE patient_change_log (
+  change_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  patient_id INTEGER NOT NULL,
+  action VARCHAR(16) NOT NULL,
+  changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+-- Appointments whose time, doctor, status or rooms changed (filled by triggers),
+-- replayed by each web worker into its in-memory schedule index.
+-- Pruned by clinic_web/change_log.py like patient_change_log; a worker that
+-- fell behind the oldest row left reloads its schedule index.
+CREATE TABLE schedule_change_log (
+  change_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  appt_id INTEGER NOT NULL,
+  changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+-- Billing totals maintained incrementally by the billing triggers
+-- (sp_billing_summary_apply) and by the appointment trigger when a billed
+-- appointment changes patient or doctor; checked by
+-- clinic_web/billing_summary.py.
+-- The global totals are spread over 16 slots (bill_id % 16) so concurrent
+-- billing writes do not all queue on one row; readers SUM the slots.
+CREATE TABLE billing_summary (
+  slot TINYINT PRIMARY KEY,
+  total_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  paid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  unpaid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  bills_count INTEGER NOT NULL DEFAULT 0,
+  unpaid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE billing_summary_patient (
+  patient_id INTEGER PRIMARY KEY,
+  total_billed DECIMAL(14,2) NOT NULL DEFAULT 0,
+  invoices_count INTEGER NOT NULL DEFAULT 0,
+  unpaid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  unpaid_count INTEGER NOT NULL DEFAULT 0,
+
+  INDEX idx_bsp_unpaid (unpaid_amount)
+);
+
+CREATE TABLE billing_summary_doctor (
+  doctor_id INTEGER PRIMARY KEY,
+  total_billed DECIMAL(14,2) NOT NULL DEFAULT 0,
+  invoices_count INTEGER NOT NULL DEFAULT 0,
+  unpaid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  unpaid_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Revenue per (day or month, doctor, payment method, payment status),
+-- maintained by the billing triggers (sp_revenue_rollup_apply) and by the
+-- appointment trigger when a billed appointment changes doctor. Reports read
+-- these instead of grouping billing. month is the first day of the month; a
+-- NULL method or status is stored as ''. Backfill and check with
+-- clinic_web/revenue_rollup.py.
+CREATE TABLE revenue_daily (
+  day DATE NOT NULL,
+  doctor_id INTEGER NOT NULL,
+  payment_method VARCHAR(50) NOT NULL,
+  payment_status VARCHAR(20) NOT NULL,
+  total_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  bills_count INTEGER NOT NULL DEFAULT 0,
+
+  PRIMARY KEY (day, doctor_id, payment_method, payment_status)
+);
+
+CREATE TABLE revenue_monthly (
+  month DATE NOT NULL,
+  doctor_id INTEGER NOT NULL,
+  payment_method VARCHAR(50) NOT NULL,
+  payment_status VARCHAR(20) NOT NULL,
+  total_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+  bills_count INTEGER NOT NULL DEFAULT 0,
+
+  PRIMARY KEY (month, doctor_id, payment_method, payment_status),
+  INDEX idx_revenue_monthly_doctor (doctor_id, month)
+);
+
+-- Appointments still waiting for a bill, a prescription or a room, one row
+-- per (kind, appointment). Filled by the appointment triggers and emptied by
+-- the billing / prescription / appointment_room triggers, so the assign pages
+-- read only open work instead of anti-joining the whole history.
+-- Rebuild with: python clinic_web/work_queue.py --fix
+CREATE TABLE pending_work (
+  kind VARCHAR(16) NOT NULL,
+  appt_id INTEGER NOT NULL,
+  starts_at DATETIME NOT NULL,
+
+  PRIMARY KEY (kind, appt_id),
+  INDEX idx_pending_work_starts (kind, starts_at, appt_id),
+  CONSTRAINT chk_pending_work_kind CHECK (kind IN ('bill','prescription','room'))
+);
+
+-- Change counters for reference data (doctors, rooms, the medication
+-- catalog), bumped by triggers on every write. Web workers cache that data
+-- in memory and reload an entity when its version moves.
+CREATE TABLE entity_version (
+  entity VARCHAR(32) PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0
+);
+-- Append-only feed of changes to the rows behind the bill details, room
+-- schedule and rooms pages (filled by triggers). The highest change_id
+-- logged for a row is its version, which the web app turns into an ETag.
+-- clinic_web/change_log.py (cron) compacts it to the newest row per
+-- (entity, entity_id), which leaves every version as it was.
+CREATE TABLE row_change_log (
+  change_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  entity VARCHAR(32) NOT NULL,
+  entity_id INTEGER NOT NULL,
+  changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_row_change_row (entity, entity_id, change_id),
+  INDEX idx_row_change_entity (entity, change_id)
+);
+
+-- Bulk archive / purge (clinic_web/purge.py). Each run is a purge_job that
+-- walks matching appointments in (starts_at, appt_id) order, one chunk per
+-- transaction; the chunk's rows are copied to the *_archive tables (unless
+-- it purges only), deleted from every table at once, and the job's position
+-- is saved in the same transaction, so an interrupted job resumes after
+-- its last committed chunk.
+CREATE TABLE purge_job (
+  job_id INTEGER PRIMARY KEY AUTO_INCREMENT,
+  appt_status VARCHAR(20) DEFAULT NULL,
+  starts_before DATETIME NOT NULL,
+  archive TINYINT NOT NULL DEFAULT 1,
+  state VARCHAR(16) NOT NULL DEFAULT 'running',
+  last_starts_at DATETIME DEFAULT NULL,
+  last_appt_id INTEGER DEFAULT NULL,
+  appointments BIGINT NOT NULL DEFAULT 0,
+  rows_removed BIGINT NOT NULL DEFAULT 0,
+  started_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at DATETIME DEFAULT NULL,
+
+  CONSTRAINT chk_purge_job_state CHECK (state IN ('running','done'))
+);
+
+-- Same columns as the live tables plus the job that moved them; no foreign
+-- keys, so any one table can be trimmed or exported on its own.
+CREATE TABLE appointment_archive (
+  appt_id INTEGER PRIMARY KEY,
+  patient_id INTEGER NOT NULL,
+  doctor_id INTEGER NOT NULL,
+  starts_at DATETIME NOT NULL,
+  ends_at DATETIME DEFAULT NULL,
+  status VARCHAR(20),
+  reason VARCHAR(255),
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_appointment_archive_starts (starts_at),
+  INDEX idx_appointment_archive_job (job_id)
+);
+
+CREATE TABLE appointment_room_archive (
+  appt_id INTEGER NOT NULL,
+  room_id INTEGER NOT NULL,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (appt_id, room_id)
+);
+
+CREATE TABLE prescription_archive (
+  rx_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  variant_id INTEGER NOT NULL,
+  dosage VARCHAR(100),
+  route VARCHAR(50),
+  frequency VARCHAR(100),
+  instructions VARCHAR(255),
+  quantity INTEGER,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_prescription_archive_appt (appt_id)
+);
+
+CREATE TABLE billing_archive (
+  bill_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  amount DECIMAL(10,2) NOT NULL,
+  payment_status VARCHAR(20),
+  payment_method VARCHAR(50),
+  billing_date DATE NOT NULL,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_billing_archive_appt (appt_id)
+);
+
+CREATE TABLE lab_test_archive (
+  test_id INTEGER PRIMARY KEY,
+  appt_id INTEGER NOT NULL,
+  test_name VARCHAR(150) NOT NULL,
+  status VARCHAR(30),
+  test_date DATE,
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_lab_test_archive_appt (appt_id)
+);
+
+CREATE TABLE lab_test_result_archive (
+  result_id INTEGER PRIMARY KEY,
+  test_id INTEGER NOT NULL,
+  result_detail VARCHAR(255),
+  job_id INTEGER NOT NULL,
+  archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_lab_test_result_archive_test (test_id)
 );
 
 
+-- Indexes backing keyset pagination on the list pages
+-- (patient pages seek on the primary key)
+CREATE INDEX idx_appointment_starts_at ON appointment (starts_at, appt_id);
+CREATE INDEX idx_billing_date ON billing (billing_date, bill_id);
 
+-- Date-range appointment search, optionally scoped to a doctor
+CREATE INDEX idx_appointment_doctor_starts ON appointment (doctor_id, starts_at);
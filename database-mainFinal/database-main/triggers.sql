@@ -59,6 +59,10 @@ BEGIN
 END$$
 
 
+/* Triggers 3 - 11 do nothing for sessions that set @clinic_app_audit:
+   with CLINIC_AUDIT_MODE=app the web app writes those audit_log rows
+   itself, in batches (clinic_web/audit.py). */
+
 /* ----------------------------------------------------------
    3 Log every new appointment inserted into the audit_log table.
 -----------------------------------------------------------*/
@@ -67,9 +71,11 @@ CREATE TRIGGER trg_appointment_after_insert
 AFTER INSERT ON appointment
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('appointment', NEW.appt_id, 'INSERT',
-          CONCAT('patient=', NEW.patient_id, ',doctor=', NEW.doctor_id));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('appointment', NEW.appt_id, 'INSERT',
+            CONCAT('patient=', NEW.patient_id, ',doctor=', NEW.doctor_id));
+  END IF;
 END$$
 
 
@@ -81,9 +87,11 @@ CREATE TRIGGER trg_appointment_after_update
 AFTER UPDATE ON appointment
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('appointment', NEW.appt_id, 'UPDATE',
-          CONCAT('status:', OLD.status, '->', NEW.status));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('appointment', NEW.appt_id, 'UPDATE',
+            CONCAT('status:', OLD.status, '->', NEW.status));
+  END IF;
 END$$
 
 
@@ -95,9 +103,11 @@ CREATE TRIGGER trg_appointment_after_delete
 AFTER DELETE ON appointment
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('appointment', OLD.appt_id, 'DELETE',
-          CONCAT('deleted appointment for patient=', OLD.patient_id));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('appointment', OLD.appt_id, 'DELETE',
+            CONCAT('deleted appointment for patient=', OLD.patient_id));
+  END IF;
 END$$
 
 
@@ -109,9 +119,11 @@ CREATE TRIGGER trg_billing_after_insert
 AFTER INSERT ON billing
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('billing', NEW.bill_id, 'INSERT',
-          CONCAT('amount=', NEW.amount, ',status=', NEW.payment_status));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('billing', NEW.bill_id, 'INSERT',
+            CONCAT('amount=', NEW.amount, ',status=', NEW.payment_status));
+  END IF;
 END$$
 
 
@@ -123,9 +135,11 @@ CREATE TRIGGER trg_billing_after_update
 AFTER UPDATE ON billing
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('billing', NEW.bill_id, 'UPDATE',
-          CONCAT('status:', OLD.payment_status, '->', NEW.payment_status));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('billing', NEW.bill_id, 'UPDATE',
+            CONCAT('status:', OLD.payment_status, '->', NEW.payment_status));
+  END IF;
 END$$
 
 
@@ -137,9 +151,11 @@ CREATE TRIGGER trg_billing_after_delete
 AFTER DELETE ON billing
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('billing', OLD.bill_id, 'DELETE',
-          CONCAT('deleted billing for appt=', OLD.appt_id));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('billing', OLD.bill_id, 'DELETE',
+            CONCAT('deleted billing for appt=', OLD.appt_id));
+  END IF;
 END$$
 
 
@@ -151,9 +167,11 @@ CREATE TRIGGER trg_prescription_after_insert
 AFTER INSERT ON prescription
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('prescription', NEW.rx_id, 'INSERT',
-          CONCAT('variant=', NEW.variant_id, ',quantity=', NEW.quantity));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('prescription', NEW.rx_id, 'INSERT',
+            CONCAT('variant=', NEW.variant_id, ',quantity=', NEW.quantity));
+  END IF;
 END$$
 
 
@@ -165,9 +183,11 @@ CREATE TRIGGER trg_prescription_after_update
 AFTER UPDATE ON prescription
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('prescription', NEW.rx_id, 'UPDATE',
-          CONCAT('quantity:', OLD.quantity, '->', NEW.quantity));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('prescription', NEW.rx_id, 'UPDATE',
+            CONCAT('quantity:', OLD.quantity, '->', NEW.quantity));
+  END IF;
 END$$
 
 
@@ -179,9 +199,571 @@ CREATE TRIGGER trg_prescription_after_delete
 AFTER DELETE ON prescription
 FOR EACH ROW
 BEGIN
-  INSERT INTO audit_log(entity_name, entity_id, action, details)
-  VALUES ('prescription', OLD.rx_id, 'DELETE',
-          CONCAT('deleted prescription for appt=', OLD.appt_id));
+  IF @clinic_app_audit IS NULL THEN
+    INSERT INTO audit_log(entity_name, entity_id, action, details)
+    VALUES ('prescription', OLD.rx_id, 'DELETE',
+            CONCAT('deleted prescription for appt=', OLD.appt_id));
+  END IF;
+END$$
+
+
+/* ----------------------------------------------------------
+   12 Feed patient inserts, renames and deletes to
+      patient_change_log for the web app's name search index.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_patient_after_insert $$
+CREATE TRIGGER trg_patient_after_insert
+AFTER INSERT ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO patient_change_log(patient_id, action)
+  VALUES (NEW.patient_id, 'INSERT');
+END$$
+
+DROP TRIGGER IF EXISTS trg_patient_after_update $$
+CREATE TRIGGER trg_patient_after_update
+AFTER UPDATE ON patient
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.full_name <=> OLD.full_name) OR NEW.patient_id <> OLD.patient_id THEN
+    INSERT INTO patient_change_log(patient_id, action)
+    VALUES (OLD.patient_id, 'UPDATE');
+    IF NEW.patient_id <> OLD.patient_id THEN
+      INSERT INTO patient_change_log(patient_id, action)
+      VALUES (NEW.patient_id, 'UPDATE');
+    END IF;
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_patient_after_delete $$
+CREATE TRIGGER trg_patient_after_delete
+AFTER DELETE ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO patient_change_log(patient_id, action)
+  VALUES (OLD.patient_id, 'DELETE');
+END$$
+
+
+/* ----------------------------------------------------------
+   13 Feed appointment and room-assignment changes to
+      schedule_change_log for the web app's schedule index.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_appointment_schedule_after_insert $$
+CREATE TRIGGER trg_appointment_schedule_after_insert
+AFTER INSERT ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (NEW.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_schedule_after_update $$
+CREATE TRIGGER trg_appointment_schedule_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.starts_at <=> OLD.starts_at) OR NOT (NEW.ends_at <=> OLD.ends_at)
+     OR NEW.doctor_id <> OLD.doctor_id OR NEW.appt_id <> OLD.appt_id
+     OR NOT (NEW.status <=> OLD.status) THEN
+    INSERT INTO schedule_change_log(appt_id) VALUES (OLD.appt_id);
+    IF NEW.appt_id <> OLD.appt_id THEN
+      INSERT INTO schedule_change_log(appt_id) VALUES (NEW.appt_id);
+    END IF;
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_schedule_after_delete $$
+CREATE TRIGGER trg_appointment_schedule_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (OLD.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_room_after_insert $$
+CREATE TRIGGER trg_appointment_room_after_insert
+AFTER INSERT ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (NEW.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_room_after_delete $$
+CREATE TRIGGER trg_appointment_room_after_delete
+AFTER DELETE ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO schedule_change_log(appt_id) VALUES (OLD.appt_id);
+END$$
+
+
+/* ----------------------------------------------------------
+   14 Keep billing_summary, billing_summary_patient and
+      billing_summary_doctor in step with every billing write, and
+      move a bill's amounts when its appointment changes patient or
+      doctor.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_billing_summary_after_insert $$
+CREATE TRIGGER trg_billing_summary_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  CALL sp_billing_summary_apply(NEW.bill_id, NEW.appt_id, NEW.amount, NEW.payment_status, 1);
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_summary_after_update $$
+CREATE TRIGGER trg_billing_summary_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.amount <=> OLD.amount) OR NOT (NEW.payment_status <=> OLD.payment_status)
+     OR NEW.appt_id <> OLD.appt_id OR NEW.bill_id <> OLD.bill_id THEN
+    CALL sp_billing_summary_apply(OLD.bill_id, OLD.appt_id, OLD.amount, OLD.payment_status, -1);
+    CALL sp_billing_summary_apply(NEW.bill_id, NEW.appt_id, NEW.amount, NEW.payment_status, 1);
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_summary_after_delete $$
+CREATE TRIGGER trg_billing_summary_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  CALL sp_billing_summary_apply(OLD.bill_id, OLD.appt_id, OLD.amount, OLD.payment_status, -1);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_billing_summary_after_update $$
+CREATE TRIGGER trg_appointment_billing_summary_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+BEGIN
+  IF NEW.patient_id <> OLD.patient_id THEN
+    INSERT INTO billing_summary_patient (patient_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+    SELECT m.patient_id, m.sign * b.amount, m.sign,
+           IF(b.payment_status = 'unpaid', m.sign * b.amount, 0),
+           IF(b.payment_status = 'unpaid', m.sign, 0)
+    FROM billing b
+    JOIN (SELECT OLD.patient_id AS patient_id, -1 AS sign
+          UNION ALL SELECT NEW.patient_id, 1) m
+    WHERE b.appt_id = NEW.appt_id
+    ON DUPLICATE KEY UPDATE
+      total_billed = total_billed + VALUES(total_billed),
+      invoices_count = invoices_count + VALUES(invoices_count),
+      unpaid_amount = unpaid_amount + VALUES(unpaid_amount),
+      unpaid_count = unpaid_count + VALUES(unpaid_count);
+  END IF;
+
+  IF NEW.doctor_id <> OLD.doctor_id THEN
+    INSERT INTO billing_summary_doctor (doctor_id, total_billed, invoices_count, unpaid_amount, unpaid_count)
+    SELECT m.doctor_id, m.sign * b.amount, m.sign,
+           IF(b.payment_status = 'unpaid', m.sign * b.amount, 0),
+           IF(b.payment_status = 'unpaid', m.sign, 0)
+    FROM billing b
+    JOIN (SELECT OLD.doctor_id AS doctor_id, -1 AS sign
+          UNION ALL SELECT NEW.doctor_id, 1) m
+    WHERE b.appt_id = NEW.appt_id
+    ON DUPLICATE KEY UPDATE
+      total_billed = total_billed + VALUES(total_billed),
+      invoices_count = invoices_count + VALUES(invoices_count),
+      unpaid_amount = unpaid_amount + VALUES(unpaid_amount),
+      unpaid_count = unpaid_count + VALUES(unpaid_count);
+  END IF;
+END$$
+
+
+/* ----------------------------------------------------------
+   15 Maintain pending_work: appointments waiting for a bill,
+      a prescription or a room.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_appointment_pending_after_insert $$
+CREATE TRIGGER trg_appointment_pending_after_insert
+AFTER INSERT ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO pending_work (kind, appt_id, starts_at)
+  VALUES ('bill', NEW.appt_id, NEW.starts_at),
+         ('prescription', NEW.appt_id, NEW.starts_at),
+         ('room', NEW.appt_id, NEW.starts_at);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_pending_after_update $$
+CREATE TRIGGER trg_appointment_pending_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+BEGIN
+  IF NEW.starts_at <> OLD.starts_at OR NEW.appt_id <> OLD.appt_id THEN
+    UPDATE pending_work SET appt_id = NEW.appt_id, starts_at = NEW.starts_at
+    WHERE appt_id = OLD.appt_id;
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_pending_after_delete $$
+CREATE TRIGGER trg_appointment_pending_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE appt_id = OLD.appt_id;
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_pending_after_insert $$
+CREATE TRIGGER trg_billing_pending_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'bill' AND appt_id = NEW.appt_id;
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_pending_after_update $$
+CREATE TRIGGER trg_billing_pending_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+BEGIN
+  IF NEW.appt_id <> OLD.appt_id THEN
+    CALL sp_pending_work_sync('bill', OLD.appt_id);
+    CALL sp_pending_work_sync('bill', NEW.appt_id);
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_pending_after_delete $$
+CREATE TRIGGER trg_billing_pending_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  CALL sp_pending_work_sync('bill', OLD.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_prescription_pending_after_insert $$
+CREATE TRIGGER trg_prescription_pending_after_insert
+AFTER INSERT ON prescription
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'prescription' AND appt_id = NEW.appt_id;
+END$$
+
+DROP TRIGGER IF EXISTS trg_prescription_pending_after_update $$
+CREATE TRIGGER trg_prescription_pending_after_update
+AFTER UPDATE ON prescription
+FOR EACH ROW
+BEGIN
+  IF NEW.appt_id <> OLD.appt_id THEN
+    CALL sp_pending_work_sync('prescription', OLD.appt_id);
+    CALL sp_pending_work_sync('prescription', NEW.appt_id);
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_prescription_pending_after_delete $$
+CREATE TRIGGER trg_prescription_pending_after_delete
+AFTER DELETE ON prescription
+FOR EACH ROW
+BEGIN
+  CALL sp_pending_work_sync('prescription', OLD.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_room_pending_after_insert $$
+CREATE TRIGGER trg_appointment_room_pending_after_insert
+AFTER INSERT ON appointment_room
+FOR EACH ROW
+BEGIN
+  DELETE FROM pending_work WHERE kind = 'room' AND appt_id = NEW.appt_id;
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_room_pending_after_delete $$
+CREATE TRIGGER trg_appointment_room_pending_after_delete
+AFTER DELETE ON appointment_room
+FOR EACH ROW
+BEGIN
+  CALL sp_pending_work_sync('room', OLD.appt_id);
+END$$
+
+
+/* ----------------------------------------------------------
+   16 Bump entity_version whenever reference data changes, so
+      every web worker reloads its cached copy.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_doctor_version_after_insert $$
+CREATE TRIGGER trg_doctor_version_after_insert
+AFTER INSERT ON doctor
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('doctor');
+END$$
+
+DROP TRIGGER IF EXISTS trg_doctor_version_after_update $$
+CREATE TRIGGER trg_doctor_version_after_update
+AFTER UPDATE ON doctor
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('doctor');
+END$$
+
+DROP TRIGGER IF EXISTS trg_doctor_version_after_delete $$
+CREATE TRIGGER trg_doctor_version_after_delete
+AFTER DELETE ON doctor
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('doctor');
+END$$
+
+DROP TRIGGER IF EXISTS trg_clinic_room_version_after_insert $$
+CREATE TRIGGER trg_clinic_room_version_after_insert
+AFTER INSERT ON clinic_room
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('room');
+END$$
+
+DROP TRIGGER IF EXISTS trg_clinic_room_version_after_update $$
+CREATE TRIGGER trg_clinic_room_version_after_update
+AFTER UPDATE ON clinic_room
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('room');
+END$$
+
+DROP TRIGGER IF EXISTS trg_clinic_room_version_after_delete $$
+CREATE TRIGGER trg_clinic_room_version_after_delete
+AFTER DELETE ON clinic_room
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('room');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_version_after_insert $$
+CREATE TRIGGER trg_medication_version_after_insert
+AFTER INSERT ON medication
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_version_after_update $$
+CREATE TRIGGER trg_medication_version_after_update
+AFTER UPDATE ON medication
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_version_after_delete $$
+CREATE TRIGGER trg_medication_version_after_delete
+AFTER DELETE ON medication
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_variant_version_after_insert $$
+CREATE TRIGGER trg_medication_variant_version_after_insert
+AFTER INSERT ON medication_variant
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_variant_version_after_update $$
+CREATE TRIGGER trg_medication_variant_version_after_update
+AFTER UPDATE ON medication_variant
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_variant_version_after_delete $$
+CREATE TRIGGER trg_medication_variant_version_after_delete
+AFTER DELETE ON medication_variant
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_form_version_after_insert $$
+CREATE TRIGGER trg_medication_form_version_after_insert
+AFTER INSERT ON medication_form
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_form_version_after_update $$
+CREATE TRIGGER trg_medication_form_version_after_update
+AFTER UPDATE ON medication_form
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+DROP TRIGGER IF EXISTS trg_medication_form_version_after_delete $$
+CREATE TRIGGER trg_medication_form_version_after_delete
+AFTER DELETE ON medication_form
+FOR EACH ROW
+BEGIN
+  CALL sp_entity_version_bump('medication');
+END$$
+
+
+/* ----------------------------------------------------------
+   17 Feed row_change_log for the web app's ETags: bills,
+      appointments and patients by id, and each room whose
+      schedule page shows the changed row.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_billing_rowlog_after_insert $$
+CREATE TRIGGER trg_billing_rowlog_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', NEW.bill_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_rowlog_after_update $$
+CREATE TRIGGER trg_billing_rowlog_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', OLD.bill_id);
+  IF NEW.bill_id <> OLD.bill_id THEN
+    INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', NEW.bill_id);
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_rowlog_after_delete $$
+CREATE TRIGGER trg_billing_rowlog_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('billing', OLD.bill_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_rowlog_after_update $$
+CREATE TRIGGER trg_appointment_rowlog_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('appointment', OLD.appt_id);
+  IF NEW.appt_id <> OLD.appt_id THEN
+    INSERT INTO row_change_log(entity, entity_id) VALUES ('appointment', NEW.appt_id);
+  END IF;
+  INSERT INTO row_change_log(entity, entity_id)
+  SELECT 'room', room_id FROM appointment_room WHERE appt_id IN (OLD.appt_id, NEW.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_rowlog_after_delete $$
+CREATE TRIGGER trg_appointment_rowlog_after_delete
+AFTER DELETE ON appointment
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('appointment', OLD.appt_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_patient_rowlog_after_update $$
+CREATE TRIGGER trg_patient_rowlog_after_update
+AFTER UPDATE ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('patient', OLD.patient_id);
+  IF NEW.patient_id <> OLD.patient_id THEN
+    INSERT INTO row_change_log(entity, entity_id) VALUES ('patient', NEW.patient_id);
+  END IF;
+  -- Room schedules only show the name
+  IF NOT (NEW.full_name <=> OLD.full_name) THEN
+    INSERT INTO row_change_log(entity, entity_id)
+    SELECT DISTINCT 'room', ar.room_id
+    FROM appointment a
+    JOIN appointment_room ar ON ar.appt_id = a.appt_id
+    WHERE a.patient_id = NEW.patient_id;
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_patient_rowlog_after_delete $$
+CREATE TRIGGER trg_patient_rowlog_after_delete
+AFTER DELETE ON patient
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('patient', OLD.patient_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_room_rowlog_after_insert $$
+CREATE TRIGGER trg_appointment_room_rowlog_after_insert
+AFTER INSERT ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('room', NEW.room_id);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_room_rowlog_after_delete $$
+CREATE TRIGGER trg_appointment_room_rowlog_after_delete
+AFTER DELETE ON appointment_room
+FOR EACH ROW
+BEGIN
+  INSERT INTO row_change_log(entity, entity_id) VALUES ('room', OLD.room_id);
+END$$
+
+
+/* ----------------------------------------------------------
+   18 Keep revenue_daily and revenue_monthly in step with every
+      billing write, and move a bill's revenue to the new doctor
+      when its appointment is reassigned.
+-----------------------------------------------------------*/
+DROP TRIGGER IF EXISTS trg_billing_revenue_after_insert $$
+CREATE TRIGGER trg_billing_revenue_after_insert
+AFTER INSERT ON billing
+FOR EACH ROW
+BEGIN
+  CALL sp_revenue_rollup_apply(NEW.appt_id, NEW.billing_date, NEW.payment_method,
+                               NEW.payment_status, NEW.amount, 1);
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_revenue_after_update $$
+CREATE TRIGGER trg_billing_revenue_after_update
+AFTER UPDATE ON billing
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.amount <=> OLD.amount) OR NOT (NEW.payment_status <=> OLD.payment_status)
+     OR NOT (NEW.payment_method <=> OLD.payment_method)
+     OR NEW.billing_date <> OLD.billing_date OR NEW.appt_id <> OLD.appt_id THEN
+    CALL sp_revenue_rollup_apply(OLD.appt_id, OLD.billing_date, OLD.payment_method,
+                                 OLD.payment_status, OLD.amount, -1);
+    CALL sp_revenue_rollup_apply(NEW.appt_id, NEW.billing_date, NEW.payment_method,
+                                 NEW.payment_status, NEW.amount, 1);
+  END IF;
+END$$
+
+DROP TRIGGER IF EXISTS trg_billing_revenue_after_delete $$
+CREATE TRIGGER trg_billing_revenue_after_delete
+AFTER DELETE ON billing
+FOR EACH ROW
+BEGIN
+  CALL sp_revenue_rollup_apply(OLD.appt_id, OLD.billing_date, OLD.payment_method,
+                               OLD.payment_status, OLD.amount, -1);
+END$$
+
+DROP TRIGGER IF EXISTS trg_appointment_revenue_after_update $$
+CREATE TRIGGER trg_appointment_revenue_after_update
+AFTER UPDATE ON appointment
+FOR EACH ROW
+BEGIN
+  IF NEW.doctor_id <> OLD.doctor_id THEN
+    INSERT INTO revenue_daily (day, doctor_id, payment_method, payment_status, total_amount, bills_count)
+    SELECT b.billing_date, m.doctor_id, COALESCE(b.payment_method, ''),
+           COALESCE(b.payment_status, ''), m.sign * b.amount, m.sign
+    FROM billing b
+    JOIN (SELECT OLD.doctor_id AS doctor_id, -1 AS sign
+          UNION ALL SELECT NEW.doctor_id, 1) m
+    WHERE b.appt_id = NEW.appt_id
+    ON DUPLICATE KEY UPDATE
+      total_amount = total_amount + VALUES(total_amount),
+      bills_count = bills_count + VALUES(bills_count);
+
+    INSERT INTO revenue_monthly (month, doctor_id, payment_method, payment_status, total_amount, bills_count)
+    SELECT b.billing_date - INTERVAL (DAYOFMONTH(b.billing_date) - 1) DAY, m.doctor_id,
+           COALESCE(b.payment_method, ''), COALESCE(b.payment_status, ''),
+           m.sign * b.amount, m.sign
+    FROM billing b
+    JOIN (SELECT OLD.doctor_id AS doctor_id, -1 AS sign
+          UNION ALL SELECT NEW.doctor_id, 1) m
+    WHERE b.appt_id = NEW.appt_id
+    ON DUPLICATE KEY UPDATE
+      total_amount = total_amount + VALUES(total_amount),
+      bills_count = bills_count + VALUES(bills_count);
+  END IF;
 END$$
 
 DELIMITER ;
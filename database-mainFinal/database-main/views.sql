@@ -5,28 +5,26 @@ use Clinic
 --####################################################
 
 -- 1) Total billing and number of invoices per patient
+--    (read from the trigger-maintained billing_summary_patient table)
 CREATE OR REPLACE VIEW vw_billing_per_patient AS
 SELECT
   p.patient_id,
   p.full_name,
-  COALESCE(SUM(b.amount), 0) AS total_billed,
-  COUNT(b.bill_id) AS invoices_count
+  COALESCE(s.total_billed, 0) AS total_billed,
+  COALESCE(s.invoices_count, 0) AS invoices_count
 FROM patient p
-LEFT JOIN appointment a ON a.patient_id = p.patient_id
-LEFT JOIN billing b ON b.appt_id = a.appt_id
-GROUP BY p.patient_id, p.full_name;
+LEFT JOIN billing_summary_patient s ON s.patient_id = p.patient_id;
 
 -- 2) Total billing per doctor (how much revenue each doctor generated)
+--    (read from the trigger-maintained billing_summary_doctor table)
 CREATE OR REPLACE VIEW vw_billing_per_doctor AS
 SELECT
   d.doctor_id,
   d.full_name,
-  COALESCE(SUM(b.amount), 0) AS total_billed,
-  COUNT(b.bill_id) AS invoices_count
+  COALESCE(s.total_billed, 0) AS total_billed,
+  COALESCE(s.invoices_count, 0) AS invoices_count
 FROM doctor d
-LEFT JOIN appointment a ON a.doctor_id = d.doctor_id
-LEFT JOIN billing b ON b.appt_id = a.appt_id
-GROUP BY d.doctor_id, d.full_name;
+LEFT JOIN billing_summary_doctor s ON s.doctor_id = d.doctor_id;
 
 -- 3) Average appointment duration (in minutes) per doctor
 CREATE OR REPLACE VIEW vw_avg_appt_duration_per_doctor AS